@@ -1,6 +1,19 @@
+import bisect
+import heapq
 import json
 import datetime
+import os
+import random
+import socket
+import socketserver
+import sqlite3
 import sys
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
 from decimal import Decimal, getcontext
 
 import pymysql
@@ -11,22 +24,229 @@ from PyQt6.QtWidgets import (
     QHeaderView, QDialog, QButtonGroup, QRadioButton,
     QDialogButtonBox, QSizePolicy, QGridLayout, QComboBox,
     QCompleter, QFrame, QStackedWidget, QAbstractItemView, QDateEdit, QInputDialog, QTabWidget,
-    QCheckBox  # ADDED: For refund checkboxes
+    QCheckBox,  # ADDED: For refund checkboxes
+    QTableView, QStyledItemDelegate, QStyle
 )
-from PyQt6.QtCore import Qt, QStringListModel, QTimer
+from PyQt6.QtCore import Qt, QStringListModel, QTimer, QObject, QRunnable, QThreadPool, QAbstractListModel, QModelIndex
+from PyQt6.QtCore import QEvent, QEventLoop, QAbstractTableModel
 from PyQt6.QtCore import pyqtSignal
 from PyQt6.QtGui import QPixmap, QColor, QBrush, QDoubleValidator, QIntValidator  # ADDED: Validators
+from PyQt6.QtGui import QKeyEvent
 from calendar import monthrange
 from PyQt6.QtGui import QPainter, QColor, QFont, QPen
 from PyQt6.QtCore import QRectF, QPointF
 import math
 
 # ----------  MySQL  ----------
-DB = dict(host='localhost', user='root', password='', database='pos_db', autocommit=True)
+DB = dict(host='localhost', user='root', password='', database='pos_db', autocommit=True,
+          connect_timeout=5)  # a lane that cannot reach the server falls back to its offline journal
+
+POOL_MIN_SIZE = 2
+POOL_MAX_SIZE = 10
+POOL_IDLE_TIMEOUT = 300.0    # seconds before an idle connection above the minimum is closed
+POOL_PING_INTERVAL = 2.0     # connections idle for less than this are handed out without a ping
+POOL_BORROW_TIMEOUT = 10.0   # seconds to wait for a free connection when the pool is at max size
+
+
+class PoolTimeoutError(RuntimeError):
+    pass
+
+
+class ConnectionPool:
+    """Thread-safe pool of pymysql connections.
+
+    Connections are pinged when they have been idle for a while and are
+    transparently replaced when the ping fails, so callers never see a
+    connection the server has already dropped.
+    """
+
+    def __init__(self, params, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 idle_timeout=POOL_IDLE_TIMEOUT, ping_interval=POOL_PING_INTERVAL,
+                 borrow_timeout=POOL_BORROW_TIMEOUT):
+        self.params = params
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self.borrow_timeout = borrow_timeout
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, last_used), most recently used on the right
+        self._size = 0        # open connections, idle + in use
+        self._in_use = 0
+        self._closed = False
+        self._created = 0
+        self._reconnects = 0
+        self._evicted = 0
+        self._timeouts = 0
+        self._borrows = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def warm(self):
+        """Open connections up to ``min_size`` so the first queries skip the handshake."""
+        opened = []
+        with self._cond:
+            missing = max(0, self.min_size - self._size)
+            self._size += missing
+        try:
+            for _ in range(missing):
+                opened.append(pymysql.connect(**self.params))
+        finally:
+            now = time.monotonic()
+            with self._cond:
+                self._size -= missing - len(opened)
+                self._created += len(opened)
+                for conn in opened:
+                    self._idle.append((conn, now))
+                self._cond.notify_all()
+
+    def borrow(self):
+        start = time.monotonic()
+        deadline = start + self.borrow_timeout
+        conn = None
+        last_used = 0.0
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeoutError("Connection pool is closed")
+                self._evict_idle_locked(time.monotonic())
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(
+                        f"No database connection available after {self.borrow_timeout:.0f}s "
+                        f"({self._in_use} in use)")
+                self._cond.wait(remaining)
+            self._in_use += 1
+
+        try:
+            if conn is None:
+                conn = pymysql.connect(**self.params)
+                created, reconnected = 1, 0
+            else:
+                conn, created, reconnected = self._check_alive(conn, last_used)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._created += created
+            self._reconnects += reconnected
+            self._borrows += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def _check_alive(self, conn, last_used):
+        if time.monotonic() - last_used < self.ping_interval:
+            return conn, 0, 0
+        try:
+            conn.ping(False)
+            return conn, 0, 0
+        except Exception:
+            self._close_quietly(conn)
+            return pymysql.connect(**self.params), 1, 1
+
+    def release(self, conn, broken=False):
+        now = time.monotonic()
+        with self._cond:
+            self._in_use -= 1
+            if broken or self._closed or not conn.open:
+                self._size -= 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, now))
+                self._evict_idle_locked(now)
+            self._cond.notify()
+
+    def _evict_idle_locked(self, now):
+        # The oldest idle connections sit on the left of the deque.
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._evicted += 1
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._size -= 1
+                self._close_quietly(conn)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "created": self._created,
+                "reconnects": self._reconnects,
+                "evicted": self._evicted,
+                "timeouts": self._timeouts,
+                "borrows": self._borrows,
+                "wait_avg_ms": (self._wait_total / self._borrows * 1000) if self._borrows else 0.0,
+                "wait_max_ms": self._wait_max * 1000,
+            }
+
+
+class _PooledConnection:
+    """Context manager handing out a pooled connection for the duration of a ``with`` block."""
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = None
+
+    def __enter__(self):
+        self._conn = self._pool.borrow()
+        return self._conn
+
+    def __exit__(self, exc_type, exc, tb):
+        conn, self._conn = self._conn, None
+        broken = False
+        if exc_type is not None:
+            # Never hand a half-finished transaction to the next borrower.
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            if isinstance(exc, (pymysql.err.OperationalError, pymysql.err.InterfaceError)):
+                broken = True
+        self._pool.release(conn, broken=broken)
+        return False
+
+
+POOL = ConnectionPool(DB)
 
 
 def get_connection():
-    return pymysql.connect(**DB)
+    return _PooledConnection(POOL)
+
+
+def fetch_all(sql, params=()):
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchall()
 
 
 def validate_user(username: str, password: str) -> bool:
@@ -39,24 +259,2493 @@ def validate_user(username: str, password: str) -> bool:
 
 def get_items_from_db():
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT id, name, price, stock FROM items WHERE stock > 0 ORDER BY name")
-                items = cur.fetchall()
-                return items
+        return load_catalog(in_stock=True)
     except Exception as e:
         print(f"Error fetching items: {e}")
         return []
 
-def sql_sum(where, params):
-    sql = f"SELECT COALESCE(SUM(total_amount),0) FROM sales WHERE {where}"
-    print(f"DEBUG: Executing SQL: {sql} with params: {params}")
+
+# ----------  Sales queries  ----------
+# Reports filter sales with half-open ranges on the bare sale_time column
+# (never DATE()/YEAR()/MONTH() around it) so MySQL can use the indexes below.
+SALES_INDEXES = (
+    ("idx_sales_sale_time", "sale_time"),
+    ("idx_sales_cashier_time", "cashier, sale_time"),
+    ("idx_sales_payment_time", "payment_method, sale_time"),
+)
+
+SALES_PAGE_SIZE = 200
+SALES_SEARCH_DEBOUNCE_MS = 300
+
+# The cashier dimension: a loose index scan over idx_sales_cashier_time, a
+# handful of rows. Searches match it in memory and filter sales by exact
+# names, which the index serves, instead of a leading-wildcard LIKE.
+CASHIER_NAMES_SQL = "SELECT DISTINCT cashier FROM sales ORDER BY cashier"
+
+
+def match_cashiers(names, search):
+    """Cashier names containing ``search``, case-insensitively."""
+    search = search.strip().lower()
+    return [name for name in names if search in name.lower()]
+
+
+def day_range(day):
+    start = datetime.datetime.combine(day, datetime.time.min)
+    return start, start + datetime.timedelta(days=1)
+
+
+def month_range(year, month):
+    start = datetime.datetime(year, month, 1)
+    end = datetime.datetime(year + month // 12, month % 12 + 1, 1)
+    return start, end
+
+
+def year_range(year):
+    return datetime.datetime(year, 1, 1), datetime.datetime(year + 1, 1, 1)
+
+
+def build_sales_page_query(day, cashiers=None, pay_filter="All", after=None, limit=SALES_PAGE_SIZE):
+    """One page of a day's sales, newest first, seeking past ``after`` = (sale_time, id) of the last row shown.
+
+    ``cashiers`` limits the page to those exact names; None means everyone.
+    """
+    sql = """
+        SELECT cashier, sale_time, id, total_amount, payment_method
+        FROM sales
+        WHERE sale_time >= %s AND sale_time < %s
+    """
+    params = list(day_range(day))
+    if cashiers is not None:
+        sql += f" AND cashier IN ({', '.join(['%s'] * len(cashiers))})"
+        params += cashiers
+    if pay_filter != "All":
+        sql += " AND payment_method = %s"
+        params.append(pay_filter)
+    if after is not None:
+        sql += " AND (sale_time < %s OR (sale_time = %s AND id < %s))"
+        params += [after[0], after[0], after[1]]
+    sql += " ORDER BY sale_time DESC, id DESC LIMIT %s"
+    params.append(limit)
+    return sql, params
+
+
+PLAN_SCAN_ROW_LIMIT = 1000  # below this the optimizer may legitimately prefer a scan
+PLAN_CHECKED_TABLES = ("sales", "s", "sales_daily_rollup", "r")
+
+
+def hot_sales_queries(today=None):
+    """The report queries that must stay index-backed, as (name, sql, params)."""
+    today = today or datetime.date.today()
+    return [
+        ("dashboard KPIs", KPI_SQL, kpi_params(today)),
+        ("sales by month", SALES_BY_MONTH_SQL, [d.date() for d in year_range(today.year)]),
+        ("sales by day", SALES_BY_DAY_SQL, [d.date() for d in month_range(today.year, today.month)]),
+        ("sales list first page", *build_sales_page_query(today)),
+        ("sales list next page", *build_sales_page_query(today, after=(day_range(today)[0], 1))),
+        ("cash sales list page", *build_sales_page_query(today, None, "Cash")),
+        ("cashier sales list page", *build_sales_page_query(today, ["admin", "cashier"])),
+    ]
+
+
+def check_query_plans(today=None):
+    """EXPLAIN every hot query and return a list of full-scan problems on the sales tables."""
+    problems = []
+    with get_connection() as conn:
+        with conn.cursor(pymysql.cursors.DictCursor) as cur:
+            for name, sql, params in hot_sales_queries(today):
+                cur.execute("EXPLAIN " + sql, params)
+                for step in cur.fetchall():
+                    if step.get("table") not in PLAN_CHECKED_TABLES or step.get("type") != "ALL":
+                        continue
+                    if not step.get("possible_keys"):
+                        problems.append(f"{name}: full scan of {step['table']}, no usable index")
+                    elif (step.get("rows") or 0) > PLAN_SCAN_ROW_LIMIT:
+                        problems.append(f"{name}: full scan of {step['table']} ({step['rows']} rows) despite "
+                                        f"candidate indexes {step['possible_keys']}")
+    return problems
+
+
+# ----------  Daily sales rollup  ----------
+# One row per (day, cashier, payment method), kept current by checkout and
+# refunds in the same transaction as the sale.  Charts and KPIs read it instead
+# of re-aggregating raw receipts; gross - discount equals SUM(sales.total_amount).
+# Each sale also keeps its gross, so a rebuild never has to guess it back from
+# the discount; only rows older than sales.gross_amount fall back to the
+# factor that was charged when they were rung up.
+SENIOR_DISCOUNT_FACTOR = Decimal("0.8")   # share of the basket a Senior/PWD customer pays
+LEGACY_DISCOUNT_FACTOR = Decimal("0.8")   # the same share for sales recorded without gross_amount
+ROLLUP_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS sales_daily_rollup (
+        day DATE NOT NULL,
+        cashier VARCHAR(50) NOT NULL,
+        payment_method VARCHAR(10) NOT NULL,
+        gross DECIMAL(14,2) NOT NULL DEFAULT 0,
+        discount DECIMAL(14,2) NOT NULL DEFAULT 0,
+        refunds DECIMAL(14,2) NOT NULL DEFAULT 0,
+        sale_count INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, cashier, payment_method)
+    )
+"""
+
+ROLLUP_ADD_SALE_SQL = """
+    INSERT INTO sales_daily_rollup (day, cashier, payment_method, gross, discount, sale_count)
+    VALUES (%s, %s, %s, %s, %s, 1)
+    ON DUPLICATE KEY UPDATE gross = gross + VALUES(gross),
+                            discount = discount + VALUES(discount),
+                            sale_count = sale_count + 1
+"""
+
+ROLLUP_ADD_REFUND_SQL = """
+    UPDATE sales_daily_rollup r
+    JOIN sales s ON s.id = %s
+                AND r.day = DATE(s.sale_time)
+                AND r.cashier = s.cashier
+                AND r.payment_method = s.payment_method
+    SET r.refunds = r.refunds + %s
+"""
+
+SALES_BY_MONTH_SQL = """
+    SELECT MONTH(day) AS month_num, SUM(gross - discount) AS total
+    FROM sales_daily_rollup
+    WHERE day >= %s AND day < %s
+    GROUP BY month_num
+    ORDER BY month_num
+"""
+
+SALES_BY_DAY_SQL = """
+    SELECT DAY(day) AS day_num, SUM(gross - discount) AS total
+    FROM sales_daily_rollup
+    WHERE day >= %s AND day < %s
+    GROUP BY day_num
+    ORDER BY day_num
+"""
+
+
+@contextmanager
+def db_transaction():
+    """Yield a cursor whose statements commit together or not at all."""
+    with get_connection() as conn:
+        conn.begin()
+        try:
+            with conn.cursor() as cur:
+                yield cur
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def sale_amounts(gross, net):
+    """(gross, net) of a sale rounded to cents; ``gross`` is the basket before discount, never below ``net``."""
+    net = round(Decimal(str(net)), 2)
+    return max(round(Decimal(str(gross)), 2), net), net
+
+
+def rollup_add_sale(cur, cashier, sale_time, payment_method, gross, net):
+    """Add one sale to its rollup row; ``gross`` is the basket before discount, ``net`` what was charged."""
+    gross, net = sale_amounts(gross, net)
+    cur.execute(ROLLUP_ADD_SALE_SQL, (sale_time.date(), cashier, payment_method, gross, gross - net))
+
+
+def rebuild_sales_rollup(start_day=None):
+    """Recompute the rollup from raw sales and refunds, for every day from ``start_day`` on."""
+    with db_transaction() as cur:
+        return _rebuild_sales_rollup(cur, start_day)
+
+
+def _rebuild_sales_rollup(cur, start_day=None):
+    start_day = start_day or datetime.date(1970, 1, 1)
+    cur.execute("DELETE FROM sales_daily_rollup WHERE day >= %s", (start_day,))
+    cur.execute("""
+        INSERT INTO sales_daily_rollup (day, cashier, payment_method, gross, discount, sale_count)
+        SELECT DATE(sale_time), cashier, payment_method,
+               SUM(COALESCE(gross_amount, IF(discount_applied, ROUND(total_amount / %s, 2), total_amount))),
+               SUM(COALESCE(gross_amount, IF(discount_applied, ROUND(total_amount / %s, 2), total_amount))
+                   - total_amount),
+               COUNT(*)
+        FROM sales
+        WHERE sale_time >= %s
+        GROUP BY DATE(sale_time), cashier, payment_method
+    """, (LEGACY_DISCOUNT_FACTOR, LEGACY_DISCOUNT_FACTOR, start_day))
+    days = cur.rowcount
+    cur.execute("""
+        UPDATE sales_daily_rollup r
+        JOIN (
+            SELECT DATE(s.sale_time) AS day, s.cashier, s.payment_method,
+                   SUM(f.refund_amount) AS amount
+            FROM refunds f
+            JOIN sales s ON s.id = f.transaction_id
+            WHERE s.sale_time >= %s
+            GROUP BY DATE(s.sale_time), s.cashier, s.payment_method
+        ) x ON x.day = r.day AND x.cashier = r.cashier AND x.payment_method = r.payment_method
+        SET r.refunds = x.amount
+    """, (start_day,))
+    return days
+
+
+# ----------  Sale lines  ----------
+SALE_ITEMS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS sale_items (
+        sale_id INT NOT NULL,
+        item_id INT NOT NULL,
+        qty INT NOT NULL,
+        unit_price DECIMAL(10,2) NOT NULL,
+        line_total DECIMAL(12,2) NOT NULL,
+        PRIMARY KEY (sale_id, item_id),
+        KEY idx_sale_items_item_sale (item_id, sale_id)
+    )
+"""
+
+BACKFILL_CHECKPOINTS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+        name VARCHAR(64) PRIMARY KEY,
+        last_id BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )
+"""
+
+INSERT_SALE_ITEMS_SQL = """
+    INSERT INTO sale_items (sale_id, item_id, qty, unit_price, line_total)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+
+def sale_item_rows(sale_id, lines):
+    """Rows for ``INSERT_SALE_ITEMS_SQL`` from cart-style line dicts (id, price, qty, total).
+
+    A basket can list the same item on several lines; they fold into one
+    row per item, keyed like the table, with their quantities and totals
+    summed and the first line's unit price.
+    """
+    rows = {}
+    for line in lines:
+        qty = int(line["qty"])
+        total = Decimal(str(line.get("total", Decimal(str(line["price"])) * qty)))
+        if line["id"] in rows:
+            _, item_id, seen_qty, price, seen_total = rows[line["id"]]
+            rows[item_id] = (sale_id, item_id, seen_qty + qty, price, seen_total + total)
+        else:
+            rows[line["id"]] = (sale_id, line["id"], qty, line["price"], total)
+    return list(rows.values())
+
+
+def insert_sale_items(cur, sale_id, lines):
+    # executemany folds the rows into one multi-row INSERT
+    cur.executemany(INSERT_SALE_ITEMS_SQL, sale_item_rows(sale_id, lines))
+
+
+def backfill_sale_items(chunk_size=1000, max_chunks=None):
+    """Copy ``sales.items_json`` baskets into ``sale_items``, one committed chunk at a time.
+
+    Progress is stored in ``backfill_checkpoints`` with each chunk, so an
+    interrupted run resumes after the last sale it finished.
+    """
+    copied = chunks = 0
+    while max_chunks is None or chunks < max_chunks:
+        with db_transaction() as cur:
+            cur.execute("SELECT last_id FROM backfill_checkpoints WHERE name = 'sale_items' FOR UPDATE")
+            row = cur.fetchone()
+            last_id = row[0] if row else 0
+            cur.execute("""
+                SELECT id, items_json FROM sales
+                WHERE id > %s AND items_json IS NOT NULL
+                ORDER BY id
+                LIMIT %s
+            """, (last_id, chunk_size))
+            sales = cur.fetchall()
+            if not sales:
+                break
+            rows = []
+            for sale_id, items_json in sales:
+                try:
+                    lines = json.loads(items_json)
+                except (TypeError, ValueError):
+                    print(f"Skipping sale {sale_id}: unreadable items_json")
+                    continue
+                rows.extend(sale_item_rows(sale_id, [line for line in lines if line.get("id") is not None]))
+            if rows:
+                cur.executemany(INSERT_SALE_ITEMS_SQL.replace("INSERT", "INSERT IGNORE", 1), rows)
+            cur.execute("""
+                INSERT INTO backfill_checkpoints (name, last_id) VALUES ('sale_items', %s)
+                ON DUPLICATE KEY UPDATE last_id = VALUES(last_id)
+            """, (sales[-1][0],))
+        copied += len(rows)
+        chunks += 1
+    return copied
+
+
+# ----------  Item catalog cache  ----------
+# Each lane keeps the items table in memory. Every write to items takes the
+# next value of the one-row catalog_version counter in its own transaction
+# and stamps the rows it touches with it, so a refresh is one primary-key
+# read when nothing changed and otherwise fetches only the newer rows. The
+# counter's row lock makes stamps commit in version order, so no row can
+# show up later with a version the cache has already passed.  Sales do not
+# take the counter inside their checkout transaction, where its lock would
+# queue every lane behind the slowest checkout; they stamp the items they
+# sold in a short transaction of their own once the sale has committed.
+# That makes sold stock eventually consistent across lanes: a stamp that
+# fails is kept and retried on the change feed's next poll, and until then
+# other lanes show the old count, which the guarded deduction still checks.
+CATALOG_VERSION_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS catalog_version (
+        id TINYINT PRIMARY KEY,
+        version BIGINT NOT NULL
+    )
+"""
+
+CATALOG_ROWS_SQL = "SELECT id, name, price, stock, barcode, catalog_version FROM items"
+CATALOG_LOG_LIMIT = 10000  # changed-id entries kept for incremental readers; older readers reload in full
+
+
+def bump_catalog_version(cur):
+    """Take the next catalog version; MySQL hands ``LAST_INSERT_ID(expr)`` back as ``lastrowid``."""
+    cur.execute("UPDATE catalog_version SET version = LAST_INSERT_ID(version + 1) WHERE id = 1")
+    return cur.lastrowid
+
+
+_unstamped = set()
+_unstamped_lock = threading.Lock()
+
+
+def stamp_sold_items(item_ids):
+    """Stamp items a committed sale took stock from, so other lanes re-read them.
+
+    If it fails the sale stands and the ids are kept; they are stamped
+    with the next sale's items, or by the change feed's next poll, which
+    calls this with none of its own.
+    """
+    with _unstamped_lock:
+        item_ids = sorted(_unstamped.union(item_ids))
+        _unstamped.clear()
+    if not item_ids:
+        return
+    placeholders = ", ".join(["%s"] * len(item_ids))
+    try:
+        with db_transaction() as cur:
+            version = bump_catalog_version(cur)
+            cur.execute(f"UPDATE items SET catalog_version = %s WHERE id IN ({placeholders})", [version, *item_ids])
+    except Exception as e:
+        with _unstamped_lock:
+            _unstamped.update(item_ids)
+        print(f"Could not stamp sold items {item_ids}, retrying on the next poll: {e}")
+
+
+def add_item(name, price, stock, barcode=None):
+    with db_transaction() as cur:
+        version = bump_catalog_version(cur)
+        cur.execute("INSERT INTO items (name, price, stock, barcode, catalog_version) VALUES (%s, %s, %s, %s, %s)",
+                    (name, price, stock, barcode or None, version))
+        return cur.lastrowid
+
+
+def update_item(item_id, name, price, stock, barcode=None):
+    with db_transaction() as cur:
+        version = bump_catalog_version(cur)
+        cur.execute("UPDATE items SET name=%s, price=%s, stock=%s, barcode=%s, catalog_version=%s WHERE id=%s",
+                    (name, price, stock, barcode or None, version, item_id))
+
+
+def add_stock(item_id, qty):
+    with db_transaction() as cur:
+        version = bump_catalog_version(cur)
+        cur.execute("UPDATE items SET stock = stock + %s, catalog_version = %s WHERE id = %s",
+                    (qty, version, item_id))
+
+
+class ItemCatalog:
+    """Items as (id, name, price, stock) tuples, keyed by id and by barcode."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_id = {}
+        self._by_barcode = {}  # barcode -> item_id
+        self._barcodes = {}    # item_id -> barcode
+        self._sorted = None
+        self._log = []     # (version, item_id) of every delta applied, oldest first
+        self._base = None  # oldest version ``changes_since`` can answer from the log
+        self.version = None  # None until the first full load
+
+    def refresh(self):
+        """Bring the cache up to date; returns the ids that changed (every id on the first load)."""
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT version FROM catalog_version WHERE id = 1")
+                row = cur.fetchone()
+                current = row[0] if row else 0
+                seen = self.version
+                if seen == current:
+                    return []
+                if seen is None:
+                    cur.execute(CATALOG_ROWS_SQL)
+                else:
+                    cur.execute(CATALOG_ROWS_SQL + " WHERE catalog_version > %s", (seen,))
+                rows = cur.fetchall()
+        return self._apply(rows, seen, current)
+
+    def _apply(self, rows, seen, current):
+        with self._lock:
+            changed = []
+            for item_id, name, price, stock, barcode, version in sorted(rows, key=lambda row: row[5]):
+                old_barcode = self._barcodes.pop(item_id, None)
+                if old_barcode is not None and self._by_barcode.get(old_barcode) == item_id:
+                    del self._by_barcode[old_barcode]
+                if barcode:
+                    self._barcodes[item_id] = barcode
+                    self._by_barcode[barcode] = item_id
+                item = (item_id, name, price, stock)
+                self._by_id[item_id] = item
+                changed.append(item_id)
+                if seen is not None:
+                    self._log.append((version, item_id))
+                current = max(current, version)
+            if changed:
+                self._sorted = None
+            self.version = max(current, self.version or 0)
+            if seen is None:
+                self._log.clear()
+                self._base = self.version
+            elif len(self._log) > CATALOG_LOG_LIMIT:
+                cut = len(self._log) - CATALOG_LOG_LIMIT
+                self._base = self._log[cut - 1][0]
+                del self._log[:cut]
+            return changed
+
+    def changes_since(self, version):
+        """Ids changed after ``version`` and the version they bring a reader to.
+
+        The ids are None when ``version`` is older than the change log, in
+        which case the reader should start again from ``rows()``.
+        """
+        with self._lock:
+            if version is None or self._base is None or version < self._base:
+                return None, self.version
+            start = bisect.bisect_right(self._log, (version, float("inf")))
+            return list(dict.fromkeys(item_id for _, item_id in self._log[start:])), self.version
+
+    def get(self, item_id):
+        return self._by_id.get(item_id)
+
+    def find_barcode(self, barcode):
+        """Id of the item with ``barcode``, or None."""
+        return self._by_barcode.get(barcode)
+
+    def barcode_of(self, item_id):
+        return self._barcodes.get(item_id)
+
+    def rows(self, in_stock=False):
+        """All items ordered by name, optionally only those with stock left."""
+        with self._lock:
+            if self._sorted is None:
+                self._sorted = sorted(self._by_id.values(), key=lambda item: item[1])
+            rows = self._sorted
+        return [item for item in rows if item[3] > 0] if in_stock else rows
+
+    def __len__(self):
+        return len(self._by_id)
+
+
+CATALOG = ItemCatalog()
+
+
+def load_catalog(in_stock=False):
+    """Refresh the shared catalog and return its rows; safe to run on a worker thread."""
+    CATALOG.refresh()
+    return CATALOG.rows(in_stock)
+
+
+# ----------  Catalog search  ----------
+SEARCH_RESULT_LIMIT = 12
+SEARCH_MIN_SIMILARITY = 0.5  # share of the query's trigrams a fuzzy match must contain
+SEARCH_FUZZY_SCAN = 5000     # posting entries a fuzzy lookup may visit, rarest trigrams first
+SEARCH_PREFIX_SCAN = 500     # candidates looked at for one- and two-letter queries
+
+
+def _normalize(text):
+    return " ".join(text.lower().split())
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CatalogSearchIndex:
+    """Substring and typo-tolerant item name search over a trigram index.
+
+    Names starting with the query rank first, then names with a word starting
+    with it, then other substring matches, then fuzzy matches by trigram
+    similarity ("bannana" finds "Banana"). One- and two-letter queries have
+    no useful trigrams and go through a sorted word list instead, which acts
+    as a flat prefix trie. Items are added and removed one at a time.
+    """
+
+    def __init__(self):
+        self._names = {}      # item_id -> (name, normalized name)
+        self._grams = {}      # item_id -> trigrams of the normalized name
+        self._postings = defaultdict(set)
+        self._words = []      # sorted (word, item_id)
+
+    def __len__(self):
+        return len(self._names)
+
+    def rebuild(self, items):
+        """Index (item_id, name) pairs from scratch."""
+        self._names.clear()
+        self._grams.clear()
+        self._postings.clear()
+        words = []
+        for item_id, name in items:
+            words.extend(self._index(item_id, name))
+        self._words = sorted(words)
+
+    def add(self, item_id, name):
+        if item_id in self._names:
+            self.remove(item_id)
+        for entry in self._index(item_id, name):
+            bisect.insort(self._words, entry)
+
+    def remove(self, item_id):
+        entry = self._names.pop(item_id, None)
+        if entry is None:
+            return
+        for gram in self._grams.pop(item_id):
+            posting = self._postings[gram]
+            posting.discard(item_id)
+            if not posting:
+                del self._postings[gram]
+        for word in set(entry[1].split()):
+            i = bisect.bisect_left(self._words, (word, item_id))
+            if i < len(self._words) and self._words[i] == (word, item_id):
+                del self._words[i]
+
+    def _index(self, item_id, name):
+        norm = _normalize(name)
+        grams = _trigrams(norm)
+        self._names[item_id] = (name, norm)
+        self._grams[item_id] = grams
+        for gram in grams:
+            self._postings[gram].add(item_id)
+        return [(word, item_id) for word in set(norm.split())]
+
+    def search(self, query, limit=SEARCH_RESULT_LIMIT):
+        """Best matches for ``query`` as (item_id, name), best first."""
+        q = _normalize(query)
+        if not q:
+            return []
+        matches = self._prefix_matches(q) if len(q) < 3 else self._substring_matches(q)
+        ranked = heapq.nsmallest(limit, matches, key=lambda item_id: (self._rank(item_id, q), self._names[item_id][1]))
+        if len(ranked) < limit and len(q) >= 3:
+            seen = set(ranked)
+            ranked += [item_id for item_id in self._fuzzy_matches(q, limit) if item_id not in seen][:limit - len(ranked)]
+        return [(item_id, self._names[item_id][0]) for item_id in ranked]
+
+    def _rank(self, item_id, q):
+        norm = self._names[item_id][1]
+        if norm.startswith(q):
+            return 0
+        return 1 if f" {q}" in norm else 2
+
+    def _prefix_matches(self, q):
+        matches = set()
+        i = bisect.bisect_left(self._words, (q,))
+        while i < len(self._words) and len(matches) < SEARCH_PREFIX_SCAN:
+            word, item_id = self._words[i]
+            if not word.startswith(q):
+                break
+            matches.add(item_id)
+            i += 1
+        return matches
+
+    def _substring_matches(self, q):
+        postings = [self._postings.get(q[i:i + 3]) for i in range(len(q) - 2)]
+        if not all(postings):
+            return set()
+        postings.sort(key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        return {item_id for item_id in candidates if q in self._names[item_id][1]}
+
+    def _fuzzy_matches(self, q, limit):
+        grams = _trigrams(q)
+        postings = sorted((self._postings[gram] for gram in grams if gram in self._postings), key=len)
+        hits = defaultdict(int)
+        budget = SEARCH_FUZZY_SCAN
+        for posting in postings:
+            if len(posting) > budget:
+                break
+            budget -= len(posting)
+            for item_id in posting:
+                hits[item_id] += 1
+        # rank by the rare trigrams counted above, then score the front runners on all of them
+        front = heapq.nlargest(limit * 4, hits, key=hits.get)
+        scored = []
+        for item_id in front:
+            item_grams = self._grams[item_id]
+            similarity = len(grams & item_grams) / len(grams)
+            if similarity >= SEARCH_MIN_SIMILARITY:
+                scored.append((similarity, -len(item_grams), item_id))
+        return [item_id for _, _, item_id in heapq.nlargest(limit, scored)]
+
+
+class ItemSearchModel(QAbstractListModel):
+    """Completer rows: the best index matches for the text being typed."""
+
+    def __init__(self, search_index, parent=None):
+        super().__init__(parent)
+        self.search_index = search_index
+        self._names = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._names)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if index.isValid() and role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            return self._names[index.row()]
+        return None
+
+    def set_query(self, text):
+        self.beginResetModel()
+        self._names = [name for _, name in self.search_index.search(text)]
+        self.endResetModel()
+
+
+# ----------  Checkout engine  ----------
+# A sale costs a fixed number of statements whatever the basket size: the
+# sale row, one multi-row sale_items INSERT, the rollup upsert and one
+# guarded stock UPDATE, all in a single transaction.  The stock UPDATE goes
+# last so the item row locks other lanes wait on are held only for the
+# commit, and it never reads-then-writes, so two lanes cannot both sell the
+# last unit.  The catalog version is taken after the commit, in the short
+# transaction of ``stamp_sold_items``.
+DEADLOCK_ERRORS = (1213, 1205)  # ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT
+DEADLOCK_RETRIES = 3
+DUPLICATE_KEY = 1062
+# can't connect, server gone away, lost connection, lost connection at handshake
+CONNECTION_ERRORS = (2003, 2006, 2013, 2055)
+CHECKOUT_STATS = {"deadlock_retries": 0}
+
+
+class OutOfStockError(RuntimeError):
+    def __init__(self, shortages):
+        self.shortages = shortages  # [(item_id, name, available)]
+        if shortages:
+            _, name, available = shortages[0]
+            message = f"Not enough stock for '{name}'. Available: {available}"
+        else:
+            message = "Not enough stock."
+        super().__init__(message)
+
+
+def cart_quantities(cart):
+    """Total quantity per item id, ordered by id."""
+    qty = defaultdict(int)
+    for line in cart:
+        qty[line["id"]] += int(line["qty"])
+    return sorted(qty.items())
+
+
+def build_stock_deduct_query(quantities, guarded=True):
+    """One UPDATE deducting every line; short lines are skipped.
+
+    The caller compares the affected row count with ``len(quantities)`` and
+    rolls back when they differ, so the deduction is all-or-nothing.  Sales
+    replayed from the offline journal are not ``guarded``: their goods have
+    already left the store, so stock may go below zero.
+    """
+    wanted = " UNION ALL ".join(["SELECT %s AS id, %s AS qty"] * len(quantities))
+    sql = f"""
+        UPDATE items i
+        JOIN ({wanted}) w ON w.id = i.id
+        SET i.stock = i.stock - w.qty
+        {"WHERE i.stock >= w.qty" if guarded else ""}
+    """
+    return sql, [value for line in quantities for value in line]
+
+
+def deduct_stock(cur, quantities, guarded=True):
+    """Deduct all quantities or raise ``OutOfStockError``; the caller's transaction is rolled back on raise.
+
+    The caller stamps the items with ``stamp_sold_items`` after committing.
+    """
+    if not quantities:
+        return
+    sql, params = build_stock_deduct_query(quantities, guarded)
+    if cur.execute(sql, params) != len(quantities) and guarded:
+        raise OutOfStockError([])
+
+
+def is_connection_error(error):
+    """True when ``error`` means the server could not be reached, not that it refused the work."""
+    if isinstance(error, (pymysql.err.InterfaceError, PoolTimeoutError, OSError)):
+        return True
+    return isinstance(error, pymysql.err.OperationalError) and bool(error.args) and error.args[0] in CONNECTION_ERRORS
+
+
+def stock_shortages(cur, quantities):
+    """Lines whose quantity exceeds the stock on hand, as (item_id, name, available)."""
+    if not quantities:
+        return []
+    wanted = dict(quantities)
+    placeholders = ", ".join(["%s"] * len(wanted))
+    cur.execute(f"SELECT id, name, stock FROM items WHERE id IN ({placeholders})", list(wanted))
+    found = {item_id: (name, stock) for item_id, name, stock in cur.fetchall()}
+    shortages = []
+    for item_id, qty in quantities:
+        name, stock = found.get(item_id, (f"Item #{item_id}", 0))
+        if stock < qty:
+            shortages.append((item_id, name, stock))
+    return shortages
+
+
+def check_stock(cart):
+    """Read-only pre-check for the payment dialog; the real guard is ``deduct_stock``."""
     with get_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute(sql, params)
-            result = float(cur.fetchone()[0])
-            print(f"DEBUG: SQL result: {result}")
-            return result
+            return stock_shortages(cur, cart_quantities(cart))
+
+
+def record_sale(cur, cashier, cart, payment_method, gross, net, discount_applied, sale_time,
+                client_txn_id=None, guarded=True, deduct=True):
+    """Write one sale inside the caller's transaction; returns its id.
+
+    Returns None without writing anything if a sale with ``client_txn_id``
+    is already recorded, so a sale pushed twice is only counted once.  With
+    ``deduct`` off the caller takes the stock off itself, for several sales
+    at once.
+    """
+    gross, net = sale_amounts(gross, net)
+    try:
+        cur.execute("""
+            INSERT INTO sales (cashier, sale_time, payment_method, total_amount, gross_amount, items_json,
+                               discount_applied, client_txn_id)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """, (cashier, sale_time, payment_method, net, gross, json.dumps(cart, default=str), discount_applied,
+              client_txn_id))
+    except pymysql.err.IntegrityError as e:
+        if client_txn_id is not None and e.args and e.args[0] == DUPLICATE_KEY:
+            return None
+        raise
+    sale_id = cur.lastrowid
+    insert_sale_items(cur, sale_id, cart)
+    rollup_add_sale(cur, cashier, sale_time, payment_method, gross, net)
+    if deduct:
+        deduct_stock(cur, cart_quantities(cart), guarded)
+    return sale_id
+
+
+def checkout_sale(cashier, cart, payment_method, gross, net, discount_applied, sale_time=None, client_txn_id=None):
+    """Record a sale and deduct its stock atomically; returns the new sale id.
+
+    Raises ``OutOfStockError`` with the short lines if any line would take
+    stock below zero, in which case nothing is written.  Returns None if the
+    sale was already recorded under ``client_txn_id``.
+    """
+    sale_time = sale_time or datetime.datetime.now().replace(microsecond=0)
+    for attempt in range(DEADLOCK_RETRIES + 1):
+        try:
+            with db_transaction() as cur:
+                sale_id = record_sale(cur, cashier, cart, payment_method, gross, net, discount_applied,
+                                      sale_time, client_txn_id)
+            break
+        except OutOfStockError:
+            # re-read after the rollback so the message shows the real stock
+            raise OutOfStockError(check_stock(cart)) from None
+        except pymysql.err.OperationalError as e:
+            if e.args[0] not in DEADLOCK_ERRORS or attempt == DEADLOCK_RETRIES:
+                raise
+            CHECKOUT_STATS["deadlock_retries"] += 1
+            time.sleep(random.uniform(0.005, 0.02) * (attempt + 1))
+    if sale_id is not None:
+        stamp_sold_items(item_id for item_id, _ in cart_quantities(cart))
+    return sale_id
+
+
+# ----------  Refunds  ----------
+# refund_items records which lines each refund returned, and
+# sale_items.refunded_qty keeps the running total per sale line, so a
+# receipt shows what is still refundable without summing past refunds.
+REFUND_ITEMS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS refund_items (
+        refund_id INT NOT NULL,
+        sale_id INT NOT NULL,
+        item_id INT NOT NULL,
+        qty INT NOT NULL,
+        amount DECIMAL(12,2) NOT NULL,
+        PRIMARY KEY (refund_id, item_id),
+        KEY idx_refund_items_sale_item (sale_id, item_id)
+    )
+"""
+
+INSERT_REFUND_ITEMS_SQL = """
+    INSERT INTO refund_items (refund_id, sale_id, item_id, qty, amount)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+REFUNDABLE_LINES_SQL = """
+    SELECT si.item_id, COALESCE(i.name, CONCAT('Item #', si.item_id)), si.unit_price, si.qty, si.refunded_qty
+    FROM sales s
+    LEFT JOIN sale_items si ON si.sale_id = s.id
+    LEFT JOIN items i ON i.id = si.item_id
+    WHERE s.id = %s
+    ORDER BY i.name
+"""
+
+
+class OverRefundError(RuntimeError):
+    pass
+
+
+def build_refund_claim_query(sale_id, quantities):
+    """One UPDATE adding ``quantities`` to the sale's refunded_qty; lines that would pass qty are skipped.
+
+    As with stock deduction, the caller compares the affected row count with
+    ``len(quantities)`` and rolls back when they differ.
+    """
+    returned = " UNION ALL ".join(["SELECT %s AS id, %s AS qty"] * len(quantities))
+    sql = f"""
+        UPDATE sale_items si
+        JOIN ({returned}) r ON r.id = si.item_id
+        SET si.refunded_qty = si.refunded_qty + r.qty
+        WHERE si.sale_id = %s AND si.refunded_qty + r.qty <= si.qty
+    """
+    params = [value for line in quantities for value in line]
+    params.append(sale_id)
+    return sql, params
+
+
+def build_stock_restore_query(quantities, version):
+    """One UPDATE putting every refunded line back on the shelf, stamped with catalog ``version``."""
+    returned = " UNION ALL ".join(["SELECT %s AS id, %s AS qty"] * len(quantities))
+    sql = f"""
+        UPDATE items i
+        JOIN ({returned}) r ON r.id = i.id
+        SET i.stock = i.stock + r.qty, i.catalog_version = %s
+    """
+    params = [value for line in quantities for value in line]
+    params.append(version)
+    return sql, params
+
+
+def refund_sale(transaction_id, lines, amount, processed_by):
+    """Refund receipt ``lines`` (dicts with id, price and the qty returned) and restock them in one transaction.
+
+    The lines are claimed against sale_items.refunded_qty first.  That
+    guarded UPDATE locks the sale's rows, so two managers refunding the same
+    receipt cannot both give back the last unit.
+    """
+    quantities = cart_quantities(lines)
+    amounts = defaultdict(Decimal)
+    for line in lines:
+        amounts[line["id"]] += Decimal(str(line["price"])) * int(line["qty"])
+    with db_transaction() as cur:
+        if quantities:
+            sql, params = build_refund_claim_query(transaction_id, quantities)
+            if cur.execute(sql, params) != len(quantities):
+                raise OverRefundError("Some of these items were already refunded. Load the receipt again.")
+        cur.execute("""
+            INSERT INTO refunds (transaction_id, refund_amount, processed_by, processed_at)
+            VALUES (%s, %s, %s, NOW())
+        """, (transaction_id, amount, processed_by))
+        refund_id = cur.lastrowid
+        if quantities:
+            cur.executemany(INSERT_REFUND_ITEMS_SQL, [(refund_id, transaction_id, item_id, qty, amounts[item_id])
+                                                      for item_id, qty in quantities])
+            sql, params = build_stock_restore_query(quantities, bump_catalog_version(cur))
+            if cur.execute(sql, params) != len(quantities):
+                raise RuntimeError("Some refunded items are no longer in inventory.")
+        cur.execute(ROLLUP_ADD_REFUND_SQL, (transaction_id, amount))
+
+
+def resolve_line_ids(cur, lines):
+    """Fill in item ids for legacy ``items_json`` lines that only carry a name, in one query."""
+    names = sorted({line["name"] for line in lines if line.get("id") is None})
+    if not names:
+        return lines
+    placeholders = ", ".join(["%s"] * len(names))
+    cur.execute(f"SELECT name, id FROM items WHERE name IN ({placeholders})", names)
+    ids = dict(cur.fetchall())
+    return [dict(line, id=ids.get(line["name"])) if line.get("id") is None else line for line in lines]
+
+
+def load_refundable_lines(sale_id):
+    """Lines of a sale with id, name, price, qty and refunded, or None if there is no such sale.
+
+    A sale the backfill has not reached yet gets its sale_items rows copied
+    from items_json first, so its refunds are tracked like any other.
+    """
+    with db_transaction() as cur:
+        cur.execute(REFUNDABLE_LINES_SQL, (sale_id,))
+        rows = cur.fetchall()
+        if not rows:
+            return None
+        if rows[0][0] is None:
+            cur.execute("SELECT items_json FROM sales WHERE id = %s", (sale_id,))
+            lines = resolve_line_ids(cur, json.loads(cur.fetchone()[0] or "[]"))
+            lines = [line for line in lines if line.get("id") is not None]
+            if lines:
+                cur.executemany(INSERT_SALE_ITEMS_SQL.replace("INSERT", "INSERT IGNORE", 1),
+                                sale_item_rows(sale_id, lines))
+                cur.execute(REFUNDABLE_LINES_SQL, (sale_id,))
+                rows = cur.fetchall()
+    return [{"id": item_id, "name": name, "price": price, "qty": qty, "refunded": refunded}
+            for item_id, name, price, qty, refunded in rows if item_id is not None]
+
+
+# ----------  Offline journal  ----------
+# Every sale is written to a local SQLite journal before it is sent to
+# MySQL, under a client_txn_id that is unique in the sales table.  When the
+# server cannot be reached the sale stays journaled, the lane keeps selling
+# from its last catalog snapshot, and the replicator pushes the queue
+# upstream in batches once the server is back.  A sale that reached MySQL
+# but whose reply was lost is recognised by its key and not counted twice.
+JOURNAL_PATH = os.environ.get("CASHIER_JOURNAL", os.path.join(os.path.expanduser("~"), ".cashier_journal.db"))
+JOURNAL_BATCH = 50                # sales pushed per upstream transaction
+JOURNAL_SYNC_INTERVAL_MS = 5000
+
+
+class OfflineJournal:
+    """Durable local queue of sales not yet confirmed by MySQL.
+
+    A sale is 'pushing' while its lane is sending it and 'queued' once it
+    waits for the replicator.  A queued sale the server refuses is 'held'
+    so the sales behind it still go through.  Entries left 'pushing' by a
+    lane that died, and held ones, are queued again when the journal is
+    opened.  A write-behind sale that found its stock gone is 'short': it
+    is never queued for the unguarded replay, only recorded through the
+    guarded checkout once the stock covers it.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS journal (
+                client_txn_id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                state TEXT NOT NULL,
+                sale TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("UPDATE journal SET state = 'queued' WHERE state != 'short'")
+        self.offline = self.count() > 0
+
+    def append(self, cashier, cart, payment_method, gross, net, discount_applied):
+        """Journal a sale before it is sent; returns it as the keyword arguments of ``checkout_sale``."""
+        sale = {
+            "cashier": cashier, "cart": cart, "payment_method": payment_method, "gross": gross, "net": net,
+            "discount_applied": discount_applied, "sale_time": datetime.datetime.now().replace(microsecond=0),
+            "client_txn_id": str(uuid.uuid4()),
+        }
+        state = "queued" if self.offline else "pushing"
+        with self._lock:
+            self._conn.execute("INSERT INTO journal (client_txn_id, created_at, state, sale) VALUES (?, ?, ?, ?)",
+                               (sale["client_txn_id"], time.time(), state, json.dumps(sale, default=str)))
+        return sale
+
+    def queue(self, client_txn_id):
+        with self._lock:
+            self._conn.execute("UPDATE journal SET state = 'queued' WHERE client_txn_id = ?", (client_txn_id,))
+
+    def hold(self, client_txn_id, state="held"):
+        with self._lock:
+            self._conn.execute("UPDATE journal SET state = ? WHERE client_txn_id = ?", (state, client_txn_id))
+
+    def remove(self, client_txn_ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM journal WHERE client_txn_id = ?",
+                                   [(txn_id,) for txn_id in client_txn_ids])
+
+    def queued(self, limit, state="queued"):
+        """Oldest sales in ``state``, decoded back into ``checkout_sale`` keyword arguments."""
+        with self._lock:
+            rows = self._conn.execute("SELECT sale FROM journal WHERE state = ? ORDER BY created_at LIMIT ?",
+                                      (state, limit)).fetchall()
+        return [decode_sale(json.loads(sale)) for sale, in rows]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM journal WHERE state = 'queued'").fetchone()[0]
+
+    def queued_quantities(self):
+        """Units per item id sold by queued sales, which the server's stock does not include yet."""
+        qty = defaultdict(int)
+        for sale in self.queued(limit=-1):
+            for item_id, n in cart_quantities(sale["cart"]):
+                qty[item_id] += n
+        return dict(qty)
+
+
+def decode_sale(sale):
+    """A journaled or shipped sale, read back from JSON, as ``checkout_sale`` keyword arguments."""
+    return dict(sale, sale_time=datetime.datetime.fromisoformat(sale["sale_time"]))
+
+
+_offline_journal = None
+
+
+def offline_journal():
+    global _offline_journal
+    if _offline_journal is None:
+        _offline_journal = OfflineJournal(JOURNAL_PATH)
+    return _offline_journal
+
+
+def push_sale(sale):
+    """Send a journaled sale upstream and drop it from the journal; runs on a worker thread."""
+    if AGGREGATOR_ADDRESS:
+        ship_sales([sale])
+    else:
+        checkout_sale(**sale)
+    offline_journal().remove([sale["client_txn_id"]])
+
+
+def replicate_journal():
+    """Push queued sales upstream, a batch per transaction.
+
+    Returns (sales pushed, sales still queued, units per item they hold).
+
+    Replayed sales are not stock-guarded: they were sold while offline and
+    the goods are gone whatever the server's count says.  A batch the
+    server refuses is retried a sale at a time, and the sales it still
+    refuses are held in the journal instead of blocking the queue.
+    """
+    journal = offline_journal()
+    pushed = 0
+    while True:
+        sales = journal.queued(JOURNAL_BATCH)
+        if not sales:
+            break
+        try:
+            write_sales(sales)
+        except Exception as e:
+            if is_connection_error(e):
+                raise
+            pushed += _replicate_one_by_one(journal, sales)
+            continue
+        journal.remove([sale["client_txn_id"] for sale in sales])
+        pushed += len(sales)
+    pushed += _record_short(journal)
+    if journal.offline and not pushed:
+        # nothing needed sending, so make sure the server answers before the lane sells online again
+        if AGGREGATOR_ADDRESS:
+            aggregator_request({"op": "stats"})
+        else:
+            fetch_all("SELECT 1")
+    journal.offline = False
+    return pushed, journal.count(), journal.queued_quantities()
+
+
+def _replicate_one_by_one(journal, sales):
+    pushed = 0
+    for sale in sales:
+        try:
+            write_sales([sale])
+        except Exception as e:
+            if is_connection_error(e):
+                raise
+            print(f"Sale {sale['client_txn_id']} refused by the server, held in the journal: {e}")
+            journal.hold(sale["client_txn_id"])
+            continue
+        journal.remove([sale["client_txn_id"]])
+        pushed += 1
+    return pushed
+
+
+def _record_short(journal):
+    """Record short sales whose stock has been put right since, through the guarded checkout."""
+    recorded = 0
+    for sale in journal.queued(JOURNAL_BATCH, state="short"):
+        try:
+            if check_stock(sale["cart"]):
+                continue
+            checkout_sale(**sale)
+        except OutOfStockError:
+            continue
+        except Exception as e:
+            if is_connection_error(e):
+                raise
+            print(f"Short sale {sale['client_txn_id']} could not be recorded: {e}")
+            continue
+        journal.remove([sale["client_txn_id"]])
+        recorded += 1
+    return recorded
+
+
+class JournalReplicator(QObject):
+    """Runs ``replicate_journal`` for the whole process, whichever window is open."""
+
+    synced = pyqtSignal(object)  # replicate_journal's result
+
+    def start(self):
+        refresh_scheduler().subscribe("journal_sync", replicate_journal, on_result=self.synced.emit,
+                                      interval_ms=JOURNAL_SYNC_INTERVAL_MS)
+
+
+_journal_replicator = None
+
+
+def journal_replicator():
+    """The process-wide replicator, started on first use from the GUI thread."""
+    global _journal_replicator
+    if _journal_replicator is None:
+        _journal_replicator = JournalReplicator()
+        _journal_replicator.start()
+    return _journal_replicator
+
+
+def write_sales(sales):
+    """Record already-paid sales in one transaction, or one aggregator batch; stock is not guarded."""
+    if AGGREGATOR_ADDRESS:
+        ship_sales(sales)
+        return
+    for attempt in range(DEADLOCK_RETRIES + 1):
+        try:
+            with db_transaction() as cur:
+                for sale in sales:
+                    record_sale(cur, guarded=False, **sale)
+            break
+        except pymysql.err.OperationalError as e:
+            if e.args[0] not in DEADLOCK_ERRORS or attempt == DEADLOCK_RETRIES:
+                raise
+            CHECKOUT_STATS["deadlock_retries"] += 1
+            time.sleep(random.uniform(0.005, 0.02) * (attempt + 1))
+    stamp_sold_items(line["id"] for sale in sales for line in sale["cart"])
+
+
+# ----------  Write-behind sales  ----------
+# With CASHIER_WRITE_BEHIND=1 a paid sale is journaled and handed to a
+# writer thread, and the lane moves on to the next customer without waiting
+# for MySQL.  The writer commits whatever has queued up as one transaction.
+# The journal entry is only dropped once its group has committed, so a lane
+# that crashes with sales in the queue replays them from the journal on the
+# next start.  The stock check before payment still runs, and the writer's
+# deduction stays guarded: a sale another lane left short of stock in the
+# meantime is kept in the journal as 'short' and reported to its lane.  The
+# replicator records it, still guarded, once a restock or recount covers it.
+WRITE_BEHIND = os.environ.get("CASHIER_WRITE_BEHIND") == "1"
+WRITE_BEHIND_CAPACITY = 100        # queued sales before checkout waits for the writer
+WRITE_BEHIND_GROUP = 50            # sales per group commit
+WRITE_BEHIND_FLUSH_TIMEOUT = 15.0  # seconds logout waits for the queue to drain
+
+
+class SaleWriter(QObject):
+    """Bounded queue of journaled sales, committed in groups by one background thread."""
+
+    saved = pyqtSignal(object)           # sales now in MySQL
+    short = pyqtSignal(object)           # [(sale kept in the journal as 'short', OutOfStockError)]
+    failed = pyqtSignal(object, object)  # (sales moved to the journal's queue, error)
+    drained = pyqtSignal()               # nothing left to write
+
+    def __init__(self, journal, parent=None):
+        super().__init__(parent)
+        self.journal = journal
+        self._pending = deque()
+        self._writing = []
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, name="sale-writer", daemon=True).start()
+
+    def full(self):
+        with self._cond:
+            return len(self._pending) >= WRITE_BEHIND_CAPACITY
+
+    def backlog(self):
+        with self._cond:
+            return len(self._pending) + len(self._writing)
+
+    def put(self, sale):
+        """Queue a journaled sale; blocks while the queue is full, so callers check ``full`` first."""
+        with self._cond:
+            while len(self._pending) >= WRITE_BEHIND_CAPACITY:
+                self._cond.wait()
+            self._pending.append(sale)
+            self._cond.notify_all()
+
+    def pending_quantities(self):
+        """Units per item id in sales not written yet, which the server's stock does not include."""
+        qty = defaultdict(int)
+        with self._cond:
+            sales = list(self._pending) + self._writing
+        for sale in sales:
+            for item_id, n in cart_quantities(sale["cart"]):
+                qty[item_id] += n
+        return dict(qty)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                group = [self._pending.popleft() for _ in range(min(len(self._pending), WRITE_BEHIND_GROUP))]
+                self._writing = group
+                self._cond.notify_all()
+            try:
+                short = write_sales_guarded(group)
+            except Exception as e:
+                # still journaled: the replicator sends them once the server takes them again
+                for sale in group:
+                    self.journal.queue(sale["client_txn_id"])
+                if is_connection_error(e):
+                    self.journal.offline = True
+                self.failed.emit(group, e)
+            else:
+                short_ids = {sale["client_txn_id"] for sale, _ in short}
+                for txn_id in short_ids:
+                    self.journal.hold(txn_id, state="short")
+                self.journal.remove([sale["client_txn_id"] for sale in group if sale["client_txn_id"] not in short_ids])
+                if short:
+                    self.short.emit(short)
+                self.saved.emit([sale for sale in group if sale["client_txn_id"] not in short_ids])
+            with self._cond:
+                self._writing = []
+                self._cond.notify_all()
+                drained = not self._pending
+            if drained:
+                self.drained.emit()
+
+
+def write_sales_guarded(sales):
+    """Record sales in one transaction, each guarded against overselling; returns the ones left out.
+
+    A sale that would take stock below zero is rolled back to its savepoint
+    and returned with its ``OutOfStockError``; the others commit.  Through
+    the aggregator the sales are written as one batch, unguarded.
+    """
+    if AGGREGATOR_ADDRESS:
+        ship_sales(sales)
+        return []
+    for attempt in range(DEADLOCK_RETRIES + 1):
+        short = []
+        try:
+            with db_transaction() as cur:
+                for n, sale in enumerate(sales):
+                    cur.execute(f"SAVEPOINT sale_{n}")
+                    try:
+                        record_sale(cur, **sale)
+                    except OutOfStockError:
+                        cur.execute(f"ROLLBACK TO SAVEPOINT sale_{n}")
+                        short.append(sale)
+            break
+        except pymysql.err.OperationalError as e:
+            if e.args[0] not in DEADLOCK_ERRORS or attempt == DEADLOCK_RETRIES:
+                raise
+            CHECKOUT_STATS["deadlock_retries"] += 1
+            time.sleep(random.uniform(0.005, 0.02) * (attempt + 1))
+    stamp_sold_items(line["id"] for sale in sales if sale not in short for line in sale["cart"])
+    return [(sale, _shortage_after_commit(sale["cart"])) for sale in short]
+
+
+def _shortage_after_commit(cart):
+    # re-read so the message shows the real stock; the sales are committed, so a failed read must not raise
+    try:
+        return OutOfStockError(check_stock(cart))
+    except Exception:
+        return OutOfStockError([])
+
+
+_sale_writer = None
+
+
+def sale_writer():
+    global _sale_writer
+    if _sale_writer is None:
+        _sale_writer = SaleWriter(offline_journal())
+    return _sale_writer
+
+
+# ----------  Stock stress test  ----------
+STRESS_CASHIER_PREFIX = "stress-lane-"
+
+
+def _stress_lane(lane, item_ids, checkouts, seed):
+    """One checkout lane in its own process: sells random baskets of the stress items."""
+    rng = random.Random(seed)
+    cashier = f"{STRESS_CASHIER_PREFIX}{lane}"
+    sold = defaultdict(int)
+    rejected = 0
+    latencies = []
+    for _ in range(checkouts):
+        cart = [{"id": item_id, "name": f"Item #{item_id}", "price": Decimal("1.00"), "qty": rng.randint(1, 3)}
+                for item_id in rng.sample(item_ids, rng.randint(1, len(item_ids)))]
+        for line in cart:
+            line["total"] = line["price"] * line["qty"]
+        total = sum(line["total"] for line in cart)
+        started = time.perf_counter()
+        try:
+            checkout_sale(cashier, cart, "Cash", total, total, False)
+        except OutOfStockError:
+            rejected += 1
+        else:
+            for line in cart:
+                sold[line["id"]] += line["qty"]
+        latencies.append(time.perf_counter() - started)
+    return dict(sold), rejected, latencies, CHECKOUT_STATS["deadlock_retries"]
+
+
+def stress_stock(lanes=8, checkouts=200, stock=500, items=3):
+    """Hammer a few hot items from ``lanes`` processes and check nothing was oversold.
+
+    Creates throwaway items, runs every lane's checkouts concurrently, then
+    compares the stock left with what the lanes report as sold and with the
+    ``sale_items`` rows written. All stress rows are deleted afterwards, but
+    lanes running against the same database keep the throwaway items in
+    their catalog until restarted, so point it at a test database.
+    Returns a list of problems (empty when stock stayed consistent).
+    """
+    import multiprocessing
+
+    tag = f"{os.getpid()}-{int(time.time())}"
+    with db_transaction() as cur:
+        item_ids = []
+        for n in range(items):
+            cur.execute("INSERT INTO items (name, price, stock) VALUES (%s, %s, %s)",
+                        (f"__stress {tag} #{n}", Decimal("1.00"), stock))
+            item_ids.append(cur.lastrowid)
+
+    cashiers = [f"{STRESS_CASHIER_PREFIX}{lane}" for lane in range(lanes)]
+    started = time.perf_counter()
+    # spawn, not fork: each lane starts with its own connection pool
+    with multiprocessing.get_context("spawn").Pool(lanes) as workers:
+        results = workers.starmap(_stress_lane, [(lane, item_ids, checkouts, f"{tag}-{lane}")
+                                                 for lane in range(lanes)])
+    elapsed = time.perf_counter() - started
+
+    sold = defaultdict(int)
+    latencies = []
+    rejected = retries = 0
+    for lane_sold, lane_rejected, lane_latencies, lane_retries in results:
+        for item_id, qty in lane_sold.items():
+            sold[item_id] += qty
+        rejected += lane_rejected
+        retries += lane_retries
+        latencies.extend(lane_latencies)
+    latencies.sort()
+
+    problems = []
+    id_marks = ", ".join(["%s"] * len(item_ids))
+    cashier_marks = ", ".join(["%s"] * len(cashiers))
+    with db_transaction() as cur:
+        cur.execute(f"SELECT id, stock FROM items WHERE id IN ({id_marks})", item_ids)
+        left = dict(cur.fetchall())
+        cur.execute(f"""
+            SELECT si.item_id, SUM(si.qty) FROM sale_items si
+            JOIN sales s ON s.id = si.sale_id
+            WHERE s.cashier IN ({cashier_marks}) AND si.item_id IN ({id_marks})
+            GROUP BY si.item_id
+        """, cashiers + item_ids)
+        recorded = {item_id: int(qty) for item_id, qty in cur.fetchall()}
+        for item_id in item_ids:
+            if left[item_id] < 0:
+                problems.append(f"item {item_id} oversold: stock is {left[item_id]}")
+            if left[item_id] != stock - sold[item_id]:
+                problems.append(f"item {item_id}: stock {left[item_id]} but lanes sold {sold[item_id]} of {stock}")
+            if recorded.get(item_id, 0) != sold[item_id]:
+                problems.append(f"item {item_id}: sale_items has {recorded.get(item_id, 0)}, lanes sold {sold[item_id]}")
+
+        cur.execute(f"""
+            DELETE si FROM sale_items si JOIN sales s ON s.id = si.sale_id
+            WHERE s.cashier IN ({cashier_marks})
+        """, cashiers)
+        cur.execute(f"DELETE FROM sales WHERE cashier IN ({cashier_marks})", cashiers)
+        cur.execute(f"DELETE FROM sales_daily_rollup WHERE cashier IN ({cashier_marks})", cashiers)
+        cur.execute(f"DELETE FROM items WHERE id IN ({id_marks})", item_ids)
+
+    total = lanes * checkouts
+    print(f"{total} checkouts on {lanes} lanes in {elapsed:.1f}s ({total / elapsed:,.0f}/s), "
+          f"{rejected} rejected for stock, {retries} deadlock retries")
+    if latencies:
+        print(f"checkout latency p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+    return problems
+
+
+# ----------  Sales aggregator  ----------
+# With many lanes, a transaction per sale means a commit per customer.  When
+# CASHIER_AGGREGATOR is set, lanes ship their journaled sales to a local
+# aggregator process over TCP instead.  It gathers the batches that arrive
+# while the previous group is committing and writes them in one
+# transaction: a savepoint per lane batch, so one bad batch does not sink
+# the rest, and a single stock UPDATE for the whole group.  Each batch is
+# acknowledged once its group has committed; lanes keep it journaled until
+# then.  Messages are one JSON object per line in each direction.
+AGGREGATOR_ADDRESS = os.environ.get("CASHIER_AGGREGATOR")  # "host:port"; unset means lanes write to MySQL
+AGGREGATOR_DEFAULT_PORT = 9765
+AGGREGATOR_GROUP_MAX = 500     # sales per group commit
+AGGREGATOR_TIMEOUT = 30.0      # seconds the aggregator lets a batch wait for its group commit
+SIM_CASHIER_PREFIX = "sim-lane-"
+
+
+def parse_address(address):
+    host, _, port = (address or "").rpartition(":")
+    if not host:
+        return address or "127.0.0.1", AGGREGATOR_DEFAULT_PORT
+    return host, int(port)
+
+
+class AggregatorError(RuntimeError):
+    """The aggregator did not acknowledge a batch.  Whether it was written is unknown, so the lane keeps it journaled."""
+
+
+def aggregator_request(message, address=None, timeout=AGGREGATOR_TIMEOUT + 5):
+    """Send one message to the aggregator and return its reply; network failures raise ``OSError``."""
+    with socket.create_connection(parse_address(address or AGGREGATOR_ADDRESS), timeout=timeout) as sock:
+        sock.sendall((json.dumps(message, default=str) + "\n").encode())
+        reply = sock.makefile("rb").readline()
+    if not reply:
+        raise ConnectionError("Aggregator closed the connection")
+    return json.loads(reply)
+
+
+def ship_sales(sales, address=None):
+    """Send ``sales`` as one batch and return the reply once they are committed."""
+    reply = aggregator_request({"op": "batch", "sales": sales}, address)
+    if not reply.get("ok"):
+        raise AggregatorError(f"Aggregator rejected the batch: {reply.get('error')}")
+    return reply
+
+
+class _PendingBatch:
+    def __init__(self, sales):
+        self.sales = sales
+        self.done = threading.Event()
+        self.reply = None
+
+
+class _AggregatorHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        aggregator = self.server.aggregator
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if request.get("op") == "batch":
+                    reply = aggregator.submit([decode_sale(sale) for sale in request["sales"]])
+                elif request.get("op") == "stats":
+                    reply = aggregator.stats()
+                else:
+                    reply = {"ok": False, "error": f"unknown op {request.get('op')!r}"}
+            except (ValueError, KeyError, TypeError) as e:
+                reply = {"ok": False, "error": f"bad request: {e}"}
+            self.wfile.write((json.dumps(reply) + "\n").encode())
+
+
+class SalesAggregator:
+    """Group-commits sales shipped by lanes; one committer thread, one handler thread per lane connection."""
+
+    def __init__(self, address=None):
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._counts = {"batches": 0, "sales": 0, "duplicates": 0, "group_commits": 0, "failed_batches": 0}
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer(parse_address(address), _AggregatorHandler)
+        self.server.daemon_threads = True
+        self.server.aggregator = self
+        self.address = "%s:%d" % self.server.server_address[:2]
+        self._committer = threading.Thread(target=self._commit_loop, name="aggregator-commit", daemon=True)
+
+    def serve_forever(self):
+        self._committer.start()
+        self.server.serve_forever()
+
+    def start(self):
+        """Serve from background threads, for tests and simulations in one process."""
+        threading.Thread(target=self.serve_forever, name="aggregator-serve", daemon=True).start()
+        return self
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def submit(self, sales):
+        batch = _PendingBatch(sales)
+        with self._cond:
+            self._pending.append(batch)
+            self._cond.notify()
+        if not batch.done.wait(AGGREGATOR_TIMEOUT):
+            with self._cond:
+                if batch in self._pending:
+                    # not started yet: drop it so it cannot commit after the lane was told it failed
+                    self._pending.remove(batch)
+                    return {"ok": False, "error": "timed out waiting for the group commit"}
+            # its group is being written; the lane retries and client_txn_id keeps it from counting twice
+            return {"ok": False, "error": "timed out while the batch was being written"}
+        return batch.reply
+
+    def stats(self):
+        with self._cond:
+            backlog_batches = len(self._pending)
+            backlog_sales = sum(len(batch.sales) for batch in self._pending)
+            counts = dict(self._counts)
+        return dict(counts, ok=True, backlog_batches=backlog_batches, backlog_sales=backlog_sales)
+
+    def _commit_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                group = [self._pending.popleft()]
+                size = len(group[0].sales)
+                while self._pending and size + len(self._pending[0].sales) <= AGGREGATOR_GROUP_MAX:
+                    size += len(self._pending[0].sales)
+                    group.append(self._pending.popleft())
+            self._commit_group(group)
+
+    def _commit_group(self, group):
+        for attempt in range(DEADLOCK_RETRIES + 1):
+            try:
+                replies = self._write_group(group)
+                break
+            except pymysql.err.OperationalError as e:
+                if e.args and e.args[0] in DEADLOCK_ERRORS and attempt < DEADLOCK_RETRIES:
+                    time.sleep(random.uniform(0.005, 0.02) * (attempt + 1))
+                    continue
+                replies = [{"ok": False, "error": str(e)}] * len(group)
+                break
+            except Exception as e:
+                replies = [{"ok": False, "error": str(e)}] * len(group)
+                break
+        with self._cond:
+            self._counts["group_commits"] += 1
+            for reply in replies:
+                if reply["ok"]:
+                    self._counts["batches"] += 1
+                    self._counts["sales"] += reply["recorded"]
+                    self._counts["duplicates"] += reply["duplicates"]
+                else:
+                    self._counts["failed_batches"] += 1
+        for batch, reply in zip(group, replies):
+            batch.reply = reply
+            batch.done.set()
+
+    @staticmethod
+    def _write_group(group):
+        replies = []
+        quantities = defaultdict(int)
+        with db_transaction() as cur:
+            for n, batch in enumerate(group):
+                cur.execute(f"SAVEPOINT lane_batch_{n}")
+                recorded = duplicates = 0
+                sold = defaultdict(int)
+                try:
+                    for sale in batch.sales:
+                        # lanes only ship sales that were paid for, so stock is not guarded
+                        if record_sale(cur, guarded=False, deduct=False, **sale) is None:
+                            duplicates += 1
+                            continue
+                        recorded += 1
+                        for item_id, qty in cart_quantities(sale["cart"]):
+                            sold[item_id] += qty
+                except pymysql.err.OperationalError:
+                    raise
+                except Exception as e:
+                    cur.execute(f"ROLLBACK TO SAVEPOINT lane_batch_{n}")
+                    replies.append({"ok": False, "error": str(e)})
+                    continue
+                for item_id, qty in sold.items():
+                    quantities[item_id] += qty
+                replies.append({"ok": True, "recorded": recorded, "duplicates": duplicates})
+            if quantities:
+                deduct_stock(cur, sorted(quantities.items()), guarded=False)
+        stamp_sold_items(quantities)
+        return replies
+
+
+def _sim_lane(lane, item_ids, batches, batch_size, address, seed):
+    """One simulated lane in its own process: ships ``batches`` batches of random sales."""
+    rng = random.Random(seed)
+    cashier = f"{SIM_CASHIER_PREFIX}{lane}"
+    sold = defaultdict(int)
+    latencies = []
+    duplicates = 0
+    last_batch = None
+    for _ in range(batches):
+        sales = []
+        for _ in range(batch_size):
+            cart = [{"id": item_id, "name": f"Item #{item_id}", "price": Decimal("1.00"), "qty": rng.randint(1, 3)}
+                    for item_id in rng.sample(item_ids, rng.randint(1, len(item_ids)))]
+            for line in cart:
+                line["total"] = line["price"] * line["qty"]
+                sold[line["id"]] += line["qty"]
+            total = sum(line["total"] for line in cart)
+            sales.append({"cashier": cashier, "cart": cart, "payment_method": "Cash", "gross": total, "net": total,
+                          "discount_applied": False, "sale_time": datetime.datetime.now().replace(microsecond=0),
+                          "client_txn_id": str(uuid.uuid4())})
+        started = time.perf_counter()
+        ship_sales(sales, address)
+        latencies.append(time.perf_counter() - started)
+        last_batch = sales
+    if last_batch:
+        # a lane that lost the acknowledgement sends the batch again; it must not count twice
+        duplicates = ship_sales(last_batch, address)["duplicates"]
+    return dict(sold), latencies, duplicates
+
+
+def simulate_lanes(lanes=12, batches=50, batch_size=5, address=None, stock=10 ** 6, items=20):
+    """Drive an aggregator with ``lanes`` lane processes and check every sale landed exactly once.
+
+    Starts an aggregator in this process unless ``address`` names a running
+    one.  Like the stress test it creates throwaway items and deletes all of
+    its rows afterwards, so point it at a test database.  Returns a list of
+    problems (empty when the sales and stock add up).
+    """
+    import multiprocessing
+
+    aggregator = None
+    if address is None:
+        aggregator = SalesAggregator("127.0.0.1:0").start()
+        address = aggregator.address
+    tag = f"{os.getpid()}-{int(time.time())}"
+    with db_transaction() as cur:
+        item_ids = []
+        for n in range(items):
+            cur.execute("INSERT INTO items (name, price, stock) VALUES (%s, %s, %s)",
+                        (f"__sim {tag} #{n}", Decimal("1.00"), stock))
+            item_ids.append(cur.lastrowid)
+    before = aggregator_request({"op": "stats"}, address)
+
+    started = time.perf_counter()
+    with multiprocessing.get_context("spawn").Pool(lanes) as workers:
+        results = workers.starmap(_sim_lane, [(lane, item_ids, batches, batch_size, address, f"{tag}-{lane}")
+                                              for lane in range(lanes)])
+    elapsed = time.perf_counter() - started
+    after = aggregator_request({"op": "stats"}, address)
+
+    sold = defaultdict(int)
+    latencies = []
+    duplicates = 0
+    for lane_sold, lane_latencies, lane_duplicates in results:
+        for item_id, qty in lane_sold.items():
+            sold[item_id] += qty
+        latencies.extend(lane_latencies)
+        duplicates += lane_duplicates
+    latencies.sort()
+
+    problems = []
+    expected = lanes * batches * batch_size
+    cashiers = [f"{SIM_CASHIER_PREFIX}{lane}" for lane in range(lanes)]
+    id_marks = ", ".join(["%s"] * len(item_ids))
+    cashier_marks = ", ".join(["%s"] * len(cashiers))
+    with db_transaction() as cur:
+        cur.execute(f"SELECT COUNT(*) FROM sales WHERE cashier IN ({cashier_marks})", cashiers)
+        recorded = cur.fetchone()[0]
+        if recorded != expected:
+            problems.append(f"sales has {recorded} simulated sales, lanes shipped {expected}")
+        if duplicates != lanes * batch_size:
+            problems.append(f"{duplicates} resent sales recognised as duplicates, expected {lanes * batch_size}")
+        cur.execute(f"SELECT id, stock FROM items WHERE id IN ({id_marks})", item_ids)
+        for item_id, left in cur.fetchall():
+            if left != stock - sold[item_id]:
+                problems.append(f"item {item_id}: stock {left} but lanes sold {sold[item_id]} of {stock}")
+
+        cur.execute(f"""
+            DELETE si FROM sale_items si JOIN sales s ON s.id = si.sale_id
+            WHERE s.cashier IN ({cashier_marks})
+        """, cashiers)
+        cur.execute(f"DELETE FROM sales WHERE cashier IN ({cashier_marks})", cashiers)
+        cur.execute(f"DELETE FROM sales_daily_rollup WHERE cashier IN ({cashier_marks})", cashiers)
+        cur.execute(f"DELETE FROM items WHERE id IN ({id_marks})", item_ids)
+    if aggregator is not None:
+        aggregator.shutdown()
+
+    commits = after["group_commits"] - before["group_commits"]
+    print(f"{expected} sales from {lanes} lanes in {elapsed:.1f}s ({expected / elapsed:,.0f}/s) "
+          f"using {commits} commits ({expected / max(commits, 1):.1f} sales per commit)")
+    if latencies:
+        print(f"batch acknowledgement p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+    return problems
+
+
+# ----------  KPI engine  ----------
+@dataclass(frozen=True)
+class KPISnapshot:
+    day: datetime.date
+    daily: float = 0.0
+    yesterday: float = 0.0
+    weekly: float = 0.0
+    month: float = 0.0
+    year: float = 0.0
+    cash_today: float = 0.0
+    card_today: float = 0.0
+    refunds_today: float = 0.0
+    top_cashier: str = None
+    top_cashier_total: float = 0.0
+    new_products: int = 0
+    item_count: int = 0
+
+    @property
+    def top_cashier_label(self):
+        if self.top_cashier is None:
+            return "-"
+        return f"{self.top_cashier}  (₱{self.top_cashier_total:,.2f})"
+
+
+KPI_SQL = """
+    SELECT
+        COALESCE(SUM(CASE WHEN r.day = %(today)s THEN r.gross - r.discount END), 0),
+        COALESCE(SUM(CASE WHEN r.day = %(yesterday)s THEN r.gross - r.discount END), 0),
+        COALESCE(SUM(CASE WHEN r.day >= %(week_start)s THEN r.gross - r.discount END), 0),
+        COALESCE(SUM(CASE WHEN r.day >= %(month_start)s THEN r.gross - r.discount END), 0),
+        COALESCE(SUM(CASE WHEN r.day >= %(year_start)s THEN r.gross - r.discount END), 0),
+        COALESCE(SUM(CASE WHEN r.day = %(today)s AND r.payment_method = 'Cash'
+                          THEN r.gross - r.discount END), 0),
+        COALESCE(SUM(CASE WHEN r.day = %(today)s AND r.payment_method = 'Card'
+                          THEN r.gross - r.discount END), 0),
+        COALESCE(SUM(CASE WHEN r.day = %(today)s THEN r.refunds END), 0),
+        MAX(top.cashier),
+        COALESCE(MAX(top.total), 0),
+        (SELECT COUNT(*) FROM items WHERE created_at >= %(today)s AND created_at < %(tomorrow)s),
+        (SELECT COUNT(*) FROM items)
+    FROM sales_daily_rollup r
+    LEFT JOIN (
+        SELECT cashier, SUM(gross - discount) AS total
+        FROM sales_daily_rollup
+        WHERE day = %(today)s
+        GROUP BY cashier
+        ORDER BY total DESC
+        LIMIT 1
+    ) top ON 1 = 1
+    WHERE r.day >= %(since)s
+"""
+
+
+def kpi_params(today):
+    year_start = today.replace(month=1, day=1)
+    week_start = today - datetime.timedelta(days=today.weekday())
+    yesterday = today - datetime.timedelta(days=1)
+    return {
+        "today": today, "tomorrow": today + datetime.timedelta(days=1), "yesterday": yesterday,
+        "week_start": week_start, "month_start": today.replace(day=1), "year_start": year_start,
+        # The week (and yesterday) can start in the previous year during early January.
+        "since": min(year_start, week_start, yesterday),
+    }
+
+
+CASHIER_TOTALS_SQL = """
+    SELECT cashier, SUM(gross - discount)
+    FROM sales_daily_rollup
+    WHERE day = %s
+    GROUP BY cashier
+"""
+
+
+def _kpi_from_row(today, row):
+    (daily, yest, weekly, month, year, cash, card, refunds,
+     top_name, top_total, new_products, item_count) = row
+    return KPISnapshot(
+        day=today, daily=float(daily), yesterday=float(yest), weekly=float(weekly),
+        month=float(month), year=float(year), cash_today=float(cash), card_today=float(card),
+        refunds_today=float(refunds), top_cashier=top_name, top_cashier_total=float(top_total),
+        new_products=int(new_products or 0), item_count=int(item_count or 0))
+
+
+def fetch_kpi_snapshot(today=None):
+    """Compute every dashboard KPI in a single conditional-aggregation query over the daily rollup."""
+    today = today or datetime.date.today()
+    params = kpi_params(today)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(KPI_SQL, params)
+            row = cur.fetchone()
+    return _kpi_from_row(today, row)
+
+
+KPI_RECONCILE_MS = 10 * 60 * 1000  # full KPI re-read for pages that otherwise apply deltas
+
+
+def fetch_dashboard_state(today=None):
+    """(KPI snapshot, today's net per cashier, last sales id they include), read from one snapshot.
+
+    The id is where change-feed deltas take over: sales above it are not in
+    the totals yet, sales at or below it already are.
+    """
+    today = today or datetime.date.today()
+    with db_transaction() as cur:
+        # the first read fixes the InnoDB snapshot the other two see
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM sales")
+        last_sale_id = cur.fetchone()[0]
+        cur.execute(KPI_SQL, kpi_params(today))
+        kpi = _kpi_from_row(today, cur.fetchone())
+        cur.execute(CASHIER_TOTALS_SQL, (today,))
+        totals = {cashier: float(total) for cashier, total in cur.fetchall()}
+    return kpi, totals, last_sale_id
+
+
+def kpi_with_sales(kpi, sales, cashier_totals):
+    """``kpi`` with change-feed sales added, or None if one falls outside the snapshot's day.
+
+    ``sales`` are (cashier, sale_time, id, total_amount, payment_method) rows;
+    ``cashier_totals`` is today's net per cashier and is updated in place.
+    """
+    added = cash = card = 0.0
+    for cashier, sale_time, _, total, payment_method in sales:
+        if sale_time.date() != kpi.day:
+            return None
+        amount = float(total)
+        added += amount
+        cash += amount if payment_method == "Cash" else 0.0
+        card += amount if payment_method == "Card" else 0.0
+        cashier_totals[cashier] = cashier_totals.get(cashier, 0.0) + amount
+    top_name, top_total = max(cashier_totals.items(), key=lambda kv: kv[1], default=(None, 0.0))
+    # today is inside this week, month and year, so every running total moves together
+    return replace(
+        kpi, daily=kpi.daily + added, weekly=kpi.weekly + added, month=kpi.month + added,
+        year=kpi.year + added, cash_today=kpi.cash_today + cash, card_today=kpi.card_today + card,
+        top_cashier=top_name, top_cashier_total=top_total)
+
+
+class LiveKpi:
+    """A ``fetch_dashboard_state`` snapshot kept current by adding change-feed sales on top."""
+
+    def __init__(self):
+        self.kpi = KPISnapshot(day=datetime.date.today())
+        self.cashier_totals = {}
+        self._snapshot_sale_id = None  # sales at or below it are in the snapshot
+        self._applied_sale_ids = set()  # later sales already added on top
+
+    def reset(self, state):
+        self.kpi, cashier_totals, self._snapshot_sale_id = state
+        self.cashier_totals = dict(cashier_totals)  # pages sharing the read update their own copy
+        self._applied_sale_ids = set()
+
+    def add_sales(self, sales):
+        """Add the sales not counted yet; returns False if a full read is needed instead (the day rolled over)."""
+        if self._snapshot_sale_id is None:
+            return True  # the first snapshot is still loading and will include them
+        sales = [sale for sale in sales
+                 if sale[2] > self._snapshot_sale_id and sale[2] not in self._applied_sale_ids]
+        if not sales:
+            return True
+        self._applied_sale_ids.update(sale[2] for sale in sales)
+        kpi = kpi_with_sales(self.kpi, sales, self.cashier_totals)
+        if kpi is None:
+            return False
+        self.kpi = kpi
+        return True
+
+
+# ----------  Schema migrations  ----------
+# Every schema change is an ordered, numbered step recorded in schema_version.
+# Startup costs a single MAX(version) query once the database is current;
+# nothing probes information_schema or runs DDL on the hot path.
+SCHEMA_VERSION_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INT PRIMARY KEY,
+        description VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+MIGRATION_LOCK_TIMEOUT = 60  # seconds a lane waits while another one migrates
+
+
+def _migrate_base_tables(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(50) UNIQUE NOT NULL,
+            password VARCHAR(64) NOT NULL,
+            role ENUM('cashier', 'admin') NOT NULL,
+            full_name VARCHAR(100),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS managers (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(50) UNIQUE NOT NULL,
+            password VARCHAR(64) NOT NULL,
+            full_name VARCHAR(100),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS items (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            price DECIMAL(10,2) NOT NULL,
+            stock INT NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS sales (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            cashier VARCHAR(50) NOT NULL,
+            sale_time DATETIME NOT NULL,
+            payment_method ENUM('Cash', 'Card') NOT NULL,
+            total_amount DECIMAL(10,2) NOT NULL,
+            gross_amount DECIMAL(10,2) NULL,
+            discount_applied TINYINT(1) NOT NULL DEFAULT 0,
+            items_json TEXT,
+            refund_for INT NULL,
+            CONSTRAINT fk_refund FOREIGN KEY (refund_for) REFERENCES sales (id)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS refunds (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            transaction_id INT NOT NULL,
+            refund_amount DECIMAL(10,2) NOT NULL,
+            processed_by VARCHAR(50),
+            processed_at DATETIME,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def _column_exists(cur, table, column):
+    cur.execute("""
+        SELECT COUNT(*) FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+    """, (table, column))
+    return cur.fetchone()[0] > 0
+
+
+def _index_names(cur, table):
+    cur.execute("""
+        SELECT DISTINCT index_name FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s
+    """, (table,))
+    return {row[0] for row in cur.fetchall()}
+
+
+def _migrate_items_created_at(cur):
+    # Databases created before the column existed; migrations are the only place we probe for it.
+    if not _column_exists(cur, "items", "created_at"):
+        cur.execute("ALTER TABLE items ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
+
+
+def _migrate_sales_indexes(cur):
+    existing = _index_names(cur, "sales")
+    for name, columns in SALES_INDEXES:
+        if name not in existing:
+            cur.execute(f"ALTER TABLE sales ADD INDEX {name} ({columns})")
+
+
+def _migrate_sales_rollup(cur):
+    _migrate_sales_gross_amount(cur)  # the rebuild reads it
+    cur.execute(ROLLUP_TABLE_SQL)
+    _rebuild_sales_rollup(cur)
+
+
+def _migrate_sale_items(cur):
+    cur.execute(SALE_ITEMS_TABLE_SQL)
+    cur.execute(BACKFILL_CHECKPOINTS_TABLE_SQL)
+
+
+def _migrate_catalog_version(cur):
+    cur.execute(CATALOG_VERSION_TABLE_SQL)
+    cur.execute("INSERT IGNORE INTO catalog_version (id, version) VALUES (1, 0)")
+    if not _column_exists(cur, "items", "catalog_version"):
+        cur.execute("ALTER TABLE items ADD COLUMN catalog_version BIGINT NOT NULL DEFAULT 0, "
+                    "ADD INDEX idx_items_catalog_version (catalog_version)")
+
+
+def _migrate_items_barcode(cur):
+    # some stores added the column by hand before it was part of the schema
+    if not _column_exists(cur, "items", "barcode"):
+        cur.execute("ALTER TABLE items ADD COLUMN barcode VARCHAR(64) NULL")
+    if "uq_items_barcode" not in _index_names(cur, "items"):
+        cur.execute("UPDATE items SET barcode = NULL WHERE barcode = ''")
+        cur.execute("ALTER TABLE items ADD UNIQUE INDEX uq_items_barcode (barcode)")
+
+
+def _migrate_inventory_indexes(cur):
+    existing = _index_names(cur, "items")
+    for name, columns in INVENTORY_INDEXES:
+        if name not in existing:
+            cur.execute(f"ALTER TABLE items ADD INDEX {name} ({columns})")
+
+
+def _migrate_sales_client_txn_id(cur):
+    if not _column_exists(cur, "sales", "client_txn_id"):
+        cur.execute("ALTER TABLE sales ADD COLUMN client_txn_id CHAR(36) NULL, "
+                    "ADD UNIQUE INDEX uq_sales_client_txn (client_txn_id)")
+
+
+def _migrate_sales_gross_amount(cur):
+    # sales recorded before the column keep NULL; the rollup rebuild derives theirs
+    if not _column_exists(cur, "sales", "gross_amount"):
+        cur.execute("ALTER TABLE sales ADD COLUMN gross_amount DECIMAL(10,2) NULL AFTER total_amount")
+
+
+def _migrate_refund_items(cur):
+    # refunds recorded before this step have no line detail, so they start at zero
+    cur.execute(REFUND_ITEMS_TABLE_SQL)
+    if not _column_exists(cur, "sale_items", "refunded_qty"):
+        cur.execute("ALTER TABLE sale_items ADD COLUMN refunded_qty INT NOT NULL DEFAULT 0")
+
+
+MIGRATIONS = [
+    (1, "base tables", _migrate_base_tables),
+    (2, "items.created_at", _migrate_items_created_at),
+    (3, "sales report indexes", _migrate_sales_indexes),
+    (4, "sales_daily_rollup", _migrate_sales_rollup),
+    (5, "sale_items and backfill checkpoints", _migrate_sale_items),
+    (6, "catalog_version", _migrate_catalog_version),
+    (7, "items.barcode", _migrate_items_barcode),
+    (8, "inventory sort indexes", _migrate_inventory_indexes),
+    (9, "refund_items and sale_items.refunded_qty", _migrate_refund_items),
+    (10, "sales.client_txn_id", _migrate_sales_client_txn_id),
+    (11, "sales.gross_amount", _migrate_sales_gross_amount),
+]
+
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def _schema_version(cur):
+    try:
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return cur.fetchone()[0]
+    except pymysql.err.ProgrammingError:
+        return 0
+
+
+def run_migrations():
+    """Bring the schema up to ``LATEST_SCHEMA_VERSION``; returns the versions applied."""
+    applied = []
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            if _schema_version(cur) >= LATEST_SCHEMA_VERSION:
+                return applied
+            # Several lanes can start at once; only one of them migrates.
+            cur.execute("SELECT GET_LOCK('pos_schema_migrations', %s)", (MIGRATION_LOCK_TIMEOUT,))
+            if cur.fetchone()[0] != 1:
+                raise RuntimeError("Timed out waiting for another lane to finish migrating the schema")
+            try:
+                cur.execute(SCHEMA_VERSION_TABLE_SQL)
+                current = _schema_version(cur)
+                for version, description, step in MIGRATIONS:
+                    if version <= current:
+                        continue
+                    step(cur)
+                    cur.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                                (version, description))
+                    applied.append(version)
+                    print(f"✅ Applied migration {version}: {description}")
+            finally:
+                cur.execute("SELECT RELEASE_LOCK('pos_schema_migrations')")
+    return applied
+
+
+# ----------  Background database work  ----------
+# Queries run on a small QThreadPool; results come back through queued Qt
+# signals so callbacks always execute on the GUI thread.  Each page owns a
+# DbRequests tracker: submitting under a key supersedes the previous request
+# with that key, so stale results never overwrite newer ones.
+DB_WORKER_THREADS = 4
+
+_db_thread_pool = None
+
+
+def db_thread_pool():
+    global _db_thread_pool
+    if _db_thread_pool is None:
+        _db_thread_pool = QThreadPool()
+        _db_thread_pool.setMaxThreadCount(min(DB_WORKER_THREADS, POOL_MAX_SIZE))
+    return _db_thread_pool
+
+
+class _DbTaskSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(object)
+
+
+class DbTask(QRunnable):
+    def __init__(self, fn, args, kwargs):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+        self.signals = _DbTaskSignals()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        if self.cancelled:
+            self._emit("finished", None)
+            return
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            self._emit("failed", e)
+        else:
+            self._emit("finished", result)
+
+    def _emit(self, name, value):
+        try:
+            # looking the signal up already fails once its QObject is deleted
+            getattr(self.signals, name).emit(value)
+        except RuntimeError:
+            pass  # the window that asked was closed while this ran
+
+
+class DbRequests(QObject):
+    """Submits database calls for one page and tracks which results are still wanted."""
+
+    busy_changed = pyqtSignal(bool)
+
+    def __init__(self, parent, busy_widget=None):
+        super().__init__(parent)
+        self._latest = {}
+        self._running = set()
+        if busy_widget is not None:
+            self.busy_changed.connect(
+                lambda busy: busy_widget.setCursor(Qt.CursorShape.BusyCursor) if busy
+                else busy_widget.unsetCursor())
+
+    def submit(self, key, fn, *args, on_result=None, on_error=None, **kwargs):
+        self.cancel(key)
+        task = DbTask(fn, args, kwargs)
+        self._latest[key] = task
+        task.signals.finished.connect(lambda result, t=task: self._done(key, t, on_result, result))
+        task.signals.failed.connect(lambda error, t=task: self._done(key, t, on_error or self._report, error))
+        self._running.add(task)
+        if len(self._running) == 1:
+            self.busy_changed.emit(True)
+        db_thread_pool().start(task)
+        return task
+
+    def cancel(self, key):
+        task = self._latest.pop(key, None)
+        if task is None:
+            return
+        task.cancel()
+        if db_thread_pool().tryTake(task):
+            self._finish(task)
+
+    def is_pending(self, key):
+        return key in self._latest
+
+    def _done(self, key, task, callback, value):
+        self._finish(task)
+        if task.cancelled or self._latest.get(key) is not task:
+            return
+        del self._latest[key]
+        if callback is not None:
+            callback(value)
+
+    def _finish(self, task):
+        if task in self._running:
+            self._running.discard(task)
+            if not self._running:
+                self.busy_changed.emit(False)
+
+    @staticmethod
+    def _report(error):
+        print(f"Database error: {error}")
+
+
+# ----------  Refresh scheduler  ----------
+# Every periodic or on-show reload goes through one scheduler per process.
+# A job is a read under a key; pages subscribe to it with a callback and the
+# widget that has to be on screen for the data to matter.  Jobs for hidden
+# pages are only marked stale and run when a page shows again, pages sharing
+# a key share one query, and a slow or failing database stretches the
+# interval instead of piling up more queries.
+REFRESH_TICK_MS = 1000
+REFRESH_MAX_AGE_MS = 30000     # data older than this is re-read when its page is shown
+REFRESH_JITTER = 0.2           # +/- fraction of the interval, so consoles do not poll in step
+REFRESH_SLOW_MS = 1500         # a run slower than this doubles the interval
+REFRESH_MAX_BACKOFF = 8
+
+
+class _RefreshJob:
+    def __init__(self, key, fn, args):
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.subscribers = []  # (widget or None, callback)
+        self.interval_ms = None
+        self.max_age_ms = REFRESH_MAX_AGE_MS
+        self.due = None
+        self.last_run = None
+        self.started = None
+        self.stale = True
+        self.backoff = 1
+
+
+class RefreshScheduler(QObject):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.db = DbRequests(self)
+        self._jobs = {}
+        self._queued = set()
+        self._tick = QTimer(self)
+        self._tick.setInterval(REFRESH_TICK_MS)
+        self._tick.timeout.connect(self._on_tick)
+        self._tick.start()
+
+    def subscribe(self, key, fn, *args, on_result, widget=None, interval_ms=None, max_age_ms=None):
+        """Call ``on_result`` with each result of ``fn(*args)``, read under ``key``.
+
+        The first subscriber's ``fn`` is the one run.  ``interval_ms`` makes
+        the job periodic; without ``widget`` it runs whether or not anything
+        is on screen.
+        """
+        job = self._jobs.get(key)
+        if job is None:
+            job = self._jobs[key] = _RefreshJob(key, fn, args)
+        job.subscribers.append((widget, on_result))
+        if interval_ms:
+            job.interval_ms = min(job.interval_ms or interval_ms, interval_ms)
+            job.due = self._next_due(job)
+        if max_age_ms:
+            job.max_age_ms = min(job.max_age_ms, max_age_ms)
+        if widget is not None:
+            widget.installEventFilter(self)
+            widget.destroyed.connect(lambda _=None, w=widget: self._forget(key, w))
+        self.request(key)
+
+    def request(self, key, force=False):
+        """Re-read ``key`` if it is stale (always, with ``force``) and on screen.
+
+        Requests made in one pass of the event loop share a single query.
+        """
+        job = self._jobs.get(key)
+        if job is None:
+            return
+        if force:
+            job.stale = True
+        if self._wanted(job) and self._is_stale(job):
+            self._queue(key)
+
+    def refresh_now(self):
+        """Re-read every job, once each; hidden pages catch up when shown."""
+        for key in self._jobs:
+            self.request(key, force=True)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Show:
+            for job in self._jobs.values():
+                if any(widget is obj for widget, _ in job.subscribers):
+                    self.request(job.key)
+        return False
+
+    def _forget(self, key, widget):
+        job = self._jobs.get(key)
+        if job is not None:
+            job.subscribers = [sub for sub in job.subscribers if sub[0] is not widget]
+            if not job.subscribers:
+                del self._jobs[key]
+                self.db.cancel(key)
+
+    @staticmethod
+    def _wanted(job):
+        return any(widget is None or widget.isVisible() for widget, _ in job.subscribers)
+
+    @staticmethod
+    def _is_stale(job):
+        return (job.stale or job.last_run is None
+                or (time.monotonic() - job.last_run) * 1000 > job.max_age_ms)
+
+    @staticmethod
+    def _next_due(job):
+        if not job.interval_ms:
+            return None
+        jitter = random.uniform(1 - REFRESH_JITTER, 1 + REFRESH_JITTER)
+        return time.monotonic() + job.interval_ms * job.backoff * jitter / 1000
+
+    def _on_tick(self):
+        now = time.monotonic()
+        for job in self._jobs.values():
+            if job.due is None or now < job.due or self.db.is_pending(job.key):
+                continue
+            job.stale = True
+            if self._wanted(job):
+                self._queue(job.key)
+            else:
+                job.due = self._next_due(job)
+
+    def _queue(self, key):
+        if not self._queued:
+            QTimer.singleShot(0, self._flush)
+        self._queued.add(key)
+
+    def _flush(self):
+        keys, self._queued = self._queued, set()
+        for key in keys:
+            job = self._jobs.get(key)
+            if job is None:
+                continue
+            if self.db.is_pending(key):
+                job.stale = True  # re-read once the run in flight lands
+                continue
+            job.stale = False
+            job.started = time.monotonic()
+            self.db.submit(key, job.fn, *job.args,
+                           on_result=lambda result, job=job: self._done(job, result),
+                           on_error=lambda error, job=job: self._failed(job, error))
+
+    def _done(self, job, result):
+        took_ms = (time.monotonic() - job.started) * 1000
+        job.backoff = min(job.backoff * 2, REFRESH_MAX_BACKOFF) if took_ms > REFRESH_SLOW_MS else 1
+        job.last_run = time.monotonic()
+        job.due = self._next_due(job)
+        for _, callback in list(job.subscribers):
+            callback(result)
+        if job.stale and self._wanted(job):
+            self._queue(job.key)
+
+    def _failed(self, job, error):
+        print(f"Database error: {error}")
+        job.stale = True
+        job.backoff = min(job.backoff * 2, REFRESH_MAX_BACKOFF)
+        job.due = self._next_due(job)
+
+
+_refresh_scheduler = None
+
+
+def refresh_scheduler():
+    global _refresh_scheduler
+    if _refresh_scheduler is None:
+        _refresh_scheduler = RefreshScheduler()
+    return _refresh_scheduler
+
+
+# ----------  Change feed  ----------
+# One poller per process watches high-water marks instead of every page
+# re-running its query on a timer: the newest sales and refunds ids and the
+# catalog version.  When a mark moves only the rows past it are read and
+# handed to subscribers, which patch their cached totals and open views.
+CHANGE_FEED_INTERVAL_MS = 5000
+CHANGE_FEED_BATCH = 1000       # rows read per query while catching up
+CHANGE_FEED_HOLE_TTL = 60.0    # seconds a skipped id is re-checked before it counts as rolled back
+CHANGE_FEED_MAX_HOLES = 200
+
+CHANGE_MARKS_SQL = """
+    SELECT (SELECT COALESCE(MAX(id), 0) FROM sales),
+           (SELECT COALESCE(MAX(id), 0) FROM refunds),
+           (SELECT COALESCE(MAX(version), 0) FROM catalog_version)
+"""
+FEED_SALES_SQL = "SELECT cashier, sale_time, id, total_amount, payment_method FROM sales"
+FEED_REFUNDS_SQL = "SELECT id, transaction_id, refund_amount, processed_at FROM refunds"
+
+
+class HighWaterMark:
+    """Highest id read from a table, plus lower ids that were skipped.
+
+    Auto-increment ids are handed out at insert time but become visible at
+    commit, so a gap below the mark may still fill in.  Gaps are re-read
+    until CHANGE_FEED_HOLE_TTL has passed.
+    """
+
+    def __init__(self, mark=0):
+        self.mark = mark
+        self.holes = {}  # id -> time.monotonic() it was first missed
+
+    def copy(self):
+        marks = HighWaterMark(self.mark)
+        marks.holes = dict(self.holes)
+        return marks
+
+    def advance(self, ids):
+        now = time.monotonic()
+        for row_id in ids:
+            self.holes.pop(row_id, None)
+        expected = self.mark + 1
+        for row_id in sorted(i for i in ids if i > self.mark):
+            for missing in range(max(expected, row_id - CHANGE_FEED_MAX_HOLES), row_id):
+                self.holes[missing] = now
+            expected = row_id + 1
+        self.mark = max(self.mark, expected - 1)
+        self.holes = {i: t for i, t in self.holes.items() if now - t < CHANGE_FEED_HOLE_TTL}
+        if len(self.holes) > CHANGE_FEED_MAX_HOLES:
+            self.holes = dict(sorted(self.holes.items())[-CHANGE_FEED_MAX_HOLES:])
+
+
+def _rows_past(cur, select_sql, id_column, marks):
+    """Rows of ``select_sql`` past ``marks`` or filling one of its holes, oldest first."""
+    rows = []
+    while True:
+        holes = sorted(marks.holes)
+        sql = f"{select_sql} WHERE id > %s"
+        if holes:
+            sql += f" OR id IN ({', '.join(['%s'] * len(holes))})"
+        cur.execute(sql + " ORDER BY id LIMIT %s", [marks.mark, *holes, CHANGE_FEED_BATCH])
+        batch = cur.fetchall()
+        marks.advance([row[id_column] for row in batch])
+        rows.extend(batch)
+        if len(batch) < CHANGE_FEED_BATCH:
+            return rows
+
+
+def poll_changes(sales, refunds):
+    """Read what changed past the ``sales`` and ``refunds`` marks.
+
+    Returns (new sales, new refunds, catalog version, sales marks, refunds
+    marks).  The marks passed in are not touched: the returned copies have
+    moved past the rows read and replace them once those rows are
+    published, so a poll that fails part way reads the same rows again.
+    With no marks yet nothing is read and the marks start at the current
+    maxima.
+    """
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(CHANGE_MARKS_SQL)
+            max_sale, max_refund, version = cur.fetchone()
+            if sales is None:
+                return [], [], version, HighWaterMark(max_sale), HighWaterMark(max_refund)
+            sales, refunds = sales.copy(), refunds.copy()
+            new_sales = new_refunds = []
+            if max_sale > sales.mark or sales.holes:
+                new_sales = _rows_past(cur, FEED_SALES_SQL, 2, sales)
+            if max_refund > refunds.mark or refunds.holes:
+                new_refunds = _rows_past(cur, FEED_REFUNDS_SQL, 0, refunds)
+    return new_sales, new_refunds, version, sales, refunds
+
+
+class ChangeFeed(QObject):
+    sales_added = pyqtSignal(object)      # [(cashier, sale_time, id, total_amount, payment_method)]
+    refunds_added = pyqtSignal(object)    # [(id, transaction_id, refund_amount, processed_at)]
+    catalog_changed = pyqtSignal(int)     # new catalog version
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.sales = None
+        self.refunds = None
+        self.catalog_version = None
+
+    def start(self):
+        refresh_scheduler().subscribe("change_feed", self._poll, on_result=self._publish,
+                                      interval_ms=CHANGE_FEED_INTERVAL_MS)
+
+    def poll(self):
+        refresh_scheduler().request("change_feed", force=True)
+
+    def _poll(self):
+        # runs on a worker; the scheduler never overlaps two polls, and the
+        # marks are only replaced from _publish while none is in flight
+        stamp_sold_items(())  # sold items a failed stamp left behind
+        return poll_changes(self.sales, self.refunds)
+
+    def _publish(self, result):
+        new_sales, new_refunds, version, self.sales, self.refunds = result
+        if new_sales:
+            self.sales_added.emit(new_sales)
+        if new_refunds:
+            self.refunds_added.emit(new_refunds)
+        if self.catalog_version is not None and version != self.catalog_version:
+            self.catalog_changed.emit(version)
+        self.catalog_version = version
+
+
+_change_feed = None
+
+
+def change_feed():
+    """The process-wide feed, started on first use from the GUI thread."""
+    global _change_feed
+    if _change_feed is None:
+        _change_feed = ChangeFeed()
+        _change_feed.start()
+    return _change_feed
+
 
 class RectWidget(QFrame):
     def __init__(self, color="#2ecc71", title="", value=""):
@@ -96,21 +2785,16 @@ class DashboardPage(QWidget):
         layout.setContentsMargins(0, 2, 2, 0)
         layout.setSpacing(10)
         self._last_top = None
-        self._timer = QTimer(self)
-        self._timer.timeout.connect(self._check_top_cashier)
-        self._timer.start(30000)
-
-        self.kpi = self._fetch_kpi()
-        data = [
-            {"title": "Today sales", "value": f"₱{self.kpi['daily']:,.2f}"},
-            {"title": "Top Cashier", "value": self.kpi['top_cashier']},
-            {"title": "Cancel sales", "value": "0%"},
-            {"title": "New Products", "value": f"Item ({self.kpi['new_products']})"},
-            {"title": "Daily Profit", "value": f"₱{self.kpi['daily'] * 0.25:,.2f}"},
-            {"title": "Weekly Profit", "value": f"₱{self.kpi['weekly']:,.2f}"},
-            {"title": "Current Month", "value": f"Profit ₱{self.kpi['month']:,.2f}"},
-            {"title": "Current Year", "value": f"profit ₱{self.kpi['year']:,.2f}"}
-        ]
+        self.live = LiveKpi()
+        feed = change_feed()
+        feed.sales_added.connect(self._on_new_sales)
+        feed.catalog_changed.connect(self._on_totals_changed)
+        feed.refunds_added.connect(self._on_totals_changed)
+
+        self.kpi = self.live.kpi
+        titles = ["Today sales", "Top Cashier", "Cancel sales", "New Products",
+                  "Daily Profit", "Weekly Profit", "Current Month", "Current Year"]
+        data = [{"title": t, "value": v} for t, v in zip(titles, self._card_values(self.kpi))]
         colors = ["#2ecc71", "#2ecc71", "#f1c40f", "#3498db",
                   "#2ecc71", "#2ecc71", "#2ecc71", "#2ecc71"]
 
@@ -138,24 +2822,28 @@ class DashboardPage(QWidget):
         layout.addWidget(grid_container, alignment=Qt.AlignmentFlag.AlignTop)
         self._build_refresh_button_only()
         layout.addStretch()
+        # the feed keeps the cards current; the full read reconciles refunds and item counts
+        refresh_scheduler().subscribe("dashboard_state", fetch_dashboard_state, on_result=self._apply_state,
+                                      widget=self, interval_ms=KPI_RECONCILE_MS)
 
     def set_username(self, name):
         pass
 
-    def _check_top_cashier(self):
-        today = datetime.date.today()
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""SELECT cashier, SUM(total_amount)
-                               FROM sales
-                               WHERE DATE(sale_time) = %s
-                               GROUP BY cashier
-                               ORDER BY SUM(total_amount) DESC
-                               LIMIT 1""", (today,))
-                row = cur.fetchone()
-        if not row:
+    def _on_new_sales(self, sales):
+        if not self.live.add_sales(sales):
+            self.refresh_values()  # the day rolled over
+            return
+        if self.live.kpi is not self.kpi:
+            self._apply_kpi(self.live.kpi)
+            self._notify_top_cashier()
+
+    def _on_totals_changed(self, _changes):
+        self.refresh_values()
+
+    def _notify_top_cashier(self):
+        if self.kpi.top_cashier is None:
             return
-        top_name, top_sales = row
+        top_name, top_sales = self.kpi.top_cashier, self.kpi.top_cashier_total
         if top_name != self._last_top:
             self._last_top = top_name
             msg = QMessageBox(self)
@@ -198,71 +2886,35 @@ class DashboardPage(QWidget):
             }
             QPushButton:hover{background-color: #1565c0;}
         """)
-        refresh_btn.clicked.connect(self.refresh_values)
+        refresh_btn.clicked.connect(refresh_scheduler().refresh_now)
         h_layout.addWidget(refresh_btn)
 
         self.layout().addWidget(refresh_container)
 
-    def _fetch_kpi(self):
-        today = datetime.date.today()
-        week_start = today - datetime.timedelta(days=today.weekday())
-        month_start = today.replace(day=1)
-        year_start = today.replace(month=1, day=1)
-
-        daily = sql_sum("DATE(sale_time) = %s", (today,))
-        weekly = sql_sum("sale_time >= %s", (week_start,))
-        month = sql_sum("sale_time >= %s", (month_start,))
-        year = sql_sum("sale_time >= %s", (year_start,))
+    @staticmethod
+    def _card_values(kpi):
+        return [
+            f"₱{kpi.daily:,.2f}",
+            kpi.top_cashier_label,
+            f"{kpi.refunds_today / kpi.daily:.0%}" if kpi.daily else "0%",
+            f"Item ({kpi.new_products})",
+            f"₱{kpi.daily * 0.25:,.2f}",
+            f"₱{kpi.weekly:,.2f}",
+            f"Profit ₱{kpi.month:,.2f}",
+            f"profit ₱{kpi.year:,.2f}",
+        ]
 
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""SELECT cashier, SUM(total_amount)
-                               FROM sales
-                               WHERE DATE(sale_time) = %s
-                               GROUP BY cashier
-                               ORDER BY SUM(total_amount) DESC
-                               LIMIT 1""", (today,))
-                row = cur.fetchone()
-                top = f"{row[0]}  (₱{row[1]:,.2f})" if row else "-"
-                cur.execute("""
-                    SELECT COUNT(*) FROM information_schema.columns 
-                    WHERE table_name = 'items' AND column_name = 'created_at'
-                """)
-                has_created_at = cur.fetchone()[0] > 0
+    def refresh_values(self):
+        refresh_scheduler().request("dashboard_state", force=True)
 
-                if has_created_at:
-                    cur.execute("SELECT COUNT(*) FROM items WHERE DATE(created_at) = %s", (today,))
-                else:
-                    try:
-                        cur.execute("ALTER TABLE items ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
-                        print("Added created_at column to items table")
-                        cur.execute("SELECT COUNT(*) FROM items WHERE DATE(created_at) = %s", (today,))
-                    except Exception as e:
-                        print(f"Error adding created_at column: {e}")
-                        cur.execute("SELECT COUNT(*) FROM items")
-                new_products_result = cur.fetchone()
-                new_products = new_products_result[0] if new_products_result else 0
-
-        return {"daily": daily, "weekly": weekly, "month": month,
-                "year": year, "top_cashier": top, "new_products": new_products}
+    def _apply_state(self, state):
+        self.live.reset(state)
+        self._apply_kpi(self.live.kpi)
 
-    def refresh_values(self):
-        self.kpi = self._fetch_kpi()
-        keys = ["daily", "top_cashier", "cancel", "new_products",
-                "daily", "weekly", "month", "year"]
-        for idx, key in enumerate(keys):
-            if key == "daily":
-                self.rect_widgets[idx].set_value(f"₱{self.kpi['daily']:,.2f}")
-            elif key == "top_cashier":
-                self.rect_widgets[idx].set_value(self.kpi['top_cashier'])
-            elif key == "new_products":
-                self.rect_widgets[idx].set_value(f"Item ({self.kpi['new_products']})")
-            elif key == "weekly":
-                self.rect_widgets[idx].set_value(f"₱{self.kpi['weekly']:,.2f}")
-            elif key == "month":
-                self.rect_widgets[idx].set_value(f"Profit ₱{self.kpi['month']:,.2f}")
-            elif key == "year":
-                self.rect_widgets[idx].set_value(f"profit ₱{self.kpi['year']:,.2f}")
+    def _apply_kpi(self, kpi):
+        self.kpi = kpi
+        for rect, value in zip(self.rect_widgets, self._card_values(self.kpi)):
+            rect.set_value(value)
 
 class ProcessSalesPage(QWidget):
     def __init__(self):
@@ -341,57 +2993,63 @@ class ProcessSalesPage(QWidget):
             QPushButton{ background:#1976d2; color:white; border:none; border-radius:4px; font-weight:bold; }
             QPushButton:hover{ background:#1565c0; }
         """)
-        refresh_btn.clicked.connect(self.load_sales)
         top_bar.addWidget(refresh_btn)
         outer.addLayout(top_bar)
-        self.table = QTableWidget(0, 4)
-        self.table.setHorizontalHeaderLabels(
-            ["Cashier", "Date / time", "Grand total", "Payment method"])
+        self.table = QTableView()
         self.table.horizontalHeader().setStretchLastSection(True)
         self.table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
-        self.table.setSelectionMode(QTableWidget.SelectionMode.NoSelection)
+        self.table.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
         self.table.setStyleSheet("""
             QHeaderView::section{ background:#000; color:#fff; }
-            QTableWidget{ color:#000; background: white; }
+            QTableView{ color:#000; background: white; }
         """)
         outer.addWidget(self.table)
-        refresh_btn.clicked.connect(self.load_sales)
+        self.db = DbRequests(self, busy_widget=self.table)
+        self.model = SalesListModel(self.db, [("Cashier", "cashier"), ("Date / time", "time"),
+                                              ("Grand total", "total"), ("Payment method", "payment")], self)
+        self.table.setModel(self.model)
+        self.cashier_names = []
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SALES_SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.load_sales)
+        refresh_btn.clicked.connect(self.refresh)
         self.filter_cb.currentTextChanged.connect(self.load_sales)
-        self.search_le.textChanged.connect(self.load_sales)
+        self.search_le.textChanged.connect(lambda _: self.search_timer.start())
         self.date_pick.dateChanged.connect(self.load_sales)
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.load_sales)
-        self.timer.start(30000)
+        change_feed().sales_added.connect(self._on_new_sales)
+        refresh_scheduler().subscribe("cashier_names", fetch_all, CASHIER_NAMES_SQL,
+                                      on_result=self._set_cashier_names, widget=self)
+        self.load_sales()
+
+    def refresh(self):
+        refresh_scheduler().request("cashier_names", force=True)
         self.load_sales()
 
+    def _set_cashier_names(self, rows):
+        names = [name for name, in rows]
+        if names != self.cashier_names:
+            self.cashier_names = names
+            if self.search_le.text().strip():
+                self.load_sales()
+
+    def _on_new_sales(self, sales):
+        new_names = {sale[0] for sale in sales} - set(self.cashier_names)
+        if new_names:
+            self.cashier_names = sorted(set(self.cashier_names) | new_names)
+            search = self.search_le.text().strip()
+            if search and match_cashiers(sorted(new_names), search):
+                self.load_sales()  # the cashier filter itself changed
+                return
+        self.model.add_sales(sales)
+
     def load_sales(self):
-        search = self.search_le.text().strip().lower()
+        self.search_timer.stop()
+        search = self.search_le.text().strip()
         pay_filter = self.filter_cb.currentText()
         selected_date = self.date_pick.date().toPyDate()
-        self.table.setRowCount(0)
-
-        sql = """
-            SELECT cashier, sale_time, total_amount, payment_method
-            FROM sales
-            WHERE DATE(sale_time) = %s
-              AND (cashier LIKE %s)
-        """
-        params = [selected_date, f"%{search}%"]
-        if pay_filter != "All":
-            sql += " AND payment_method = %s"
-            params.append(pay_filter)
-        sql += " ORDER BY sale_time DESC LIMIT 200"
-
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, params)
-                for cashier, ts, total, pay in cur.fetchall():
-                    row = self.table.rowCount()
-                    self.table.insertRow(row)
-                    self.table.setItem(row, 0, QTableWidgetItem(cashier))
-                    self.table.setItem(row, 1, QTableWidgetItem(ts.strftime("%Y-%m-%d %H:%M")))
-                    self.table.setItem(row, 2, QTableWidgetItem(f"₱{total:,.2f}"))
-                    self.table.setItem(row, 3, QTableWidgetItem(pay))
+        cashiers = match_cashiers(self.cashier_names, search) if search else None
+        self.model.set_filters(selected_date, cashiers, pay_filter)
 
 class SaleReportPage(QWidget):
     def __init__(self):
@@ -415,7 +3073,7 @@ class SaleReportPage(QWidget):
             }
             QPushButton:hover{background:#1565c0;}
         """)
-        refresh_btn.clicked.connect(self._load_data)
+        refresh_btn.clicked.connect(refresh_scheduler().refresh_now)
         v.addWidget(refresh_btn, alignment=Qt.AlignmentFlag.AlignLeft)
         self.tab_widget = QTabWidget()
         self.tab_widget.setStyleSheet("""
@@ -446,7 +3104,13 @@ class SaleReportPage(QWidget):
         charts_layout = QVBoxLayout(self.charts_tab)
         self._setup_qt_charts(charts_layout)
         self.tab_widget.addTab(self.charts_tab, "📈 Sales Analytics")
-        QTimer.singleShot(100, self._load_data)
+        # new sales are added to the charts as they arrive; the full read reconciles refunds
+        self.live = LiveKpi()
+        self._shown = None
+        refresh_scheduler().subscribe("dashboard_state", fetch_dashboard_state, on_result=self._show_state,
+                                      widget=self, interval_ms=KPI_RECONCILE_MS)
+        change_feed().sales_added.connect(self._on_new_sales)
+        change_feed().refunds_added.connect(self._load_data)
 
     def _setup_qt_charts(self, layout):
         charts_container = QWidget()
@@ -485,50 +3149,26 @@ class SaleReportPage(QWidget):
         payment_layout.addWidget(self.payment_chart, alignment=Qt.AlignmentFlag.AlignCenter)
         charts_layout.addWidget(payment_widget)
         layout.addWidget(charts_container)
-    def _load_data(self):
-        try:
-            print("DEBUG: Starting _load_data")
-
-            today = datetime.date.today()
-            yesterday = today - datetime.timedelta(days=1)
-            year_start = today.replace(month=1, day=1)
-            print(f"DEBUG: Date ranges - Today: {today}, Year: {year_start}")
-            daily_sales = self._get_sales_sum("DATE(sale_time) = %s", (today,))
-            yesterday_sales = self._get_sales_sum("DATE(sale_time) = %s", (yesterday,))
-            year_sales = self._get_sales_sum("sale_time >= %s", (year_start,))
-            print(f"DEBUG: Sales data - Daily: {daily_sales}, Yesterday: {yesterday_sales}, Yearly: {year_sales}")
-            cash_today = self._get_sales_sum("payment_method = 'Cash' AND DATE(sale_time) = %s", (today,))
-            card_today = self._get_sales_sum("payment_method = 'Card' AND DATE(sale_time) = %s", (today,))
-
-            self._update_profit_chart(daily_sales, yesterday_sales)
-            self._update_payment_chart(cash_today, card_today)
-
-            print("DEBUG: _load_data completed successfully")
-
-        except Exception as e:
-            print(f"DEBUG: Error in _load_data: {e}")
-            import traceback
-            traceback.print_exc()
-
-    def _get_sales_sum(self, where_clause, params):
-        try:
-            sql = f"SELECT COALESCE(SUM(total_amount), 0) FROM sales WHERE {where_clause}"
-            print(f"DEBUG: Executing SQL: {sql} with params: {params}")
-
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(sql, params)
-                    result = cur.fetchone()
-                    amount = float(result[0]) if result else 0.0
-                    print(f"DEBUG: SQL result: {amount}")
-                    return amount
-        except Exception as e:
-            print(f"DEBUG: Error in _get_sales_sum: {e}")
-            return 0.0
-
-    def showEvent(self, event):
-        super().showEvent(event)
-        QTimer.singleShot(100, self._load_data)
+    def _load_data(self, *_):
+        print("DEBUG: Starting _load_data")
+        refresh_scheduler().request("dashboard_state", force=True)
+
+    def _on_new_sales(self, sales):
+        if not self.live.add_sales(sales):
+            self._load_data()  # the day rolled over
+        elif self.live.kpi is not self._shown:
+            self._show_kpi(self.live.kpi)
+
+    def _show_state(self, state):
+        self.live.reset(state)
+        self._show_kpi(self.live.kpi)
+
+    def _show_kpi(self, kpi):
+        self._shown = kpi
+        print(f"DEBUG: Sales data - Daily: {kpi.daily}, Yesterday: {kpi.yesterday}, Yearly: {kpi.year}")
+        self._update_profit_chart(kpi.daily, kpi.yesterday)
+        self._update_payment_chart(kpi.cash_today, kpi.card_today)
+        print("DEBUG: _load_data completed successfully")
 
     def _update_profit_chart(self, today_sales, yesterday_sales):
         data = {'Yesterday': yesterday_sales, 'Today': today_sales}
@@ -789,19 +3429,13 @@ class _SalesGraphWidget(QWidget):
         main_layout = QVBoxLayout(self)
         main_layout.addWidget(self.canvas, 1)
         main_layout.addLayout(button_layout)
-        self.show_year()
+        self.db = DbRequests(self, busy_widget=self.canvas)
 
     def _sales_for_year(self, year):
-        sql = """
-            SELECT MONTH(sale_time) AS month_num, SUM(total_amount) as total
-            FROM sales 
-            WHERE YEAR(sale_time) = %s 
-            GROUP BY month_num 
-            ORDER BY month_num
-        """
         with get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute(sql, (year,))
+                start, end = year_range(year)
+                cur.execute(SALES_BY_MONTH_SQL, (start.date(), end.date()))
                 results = cur.fetchall()
 
         monthly_sales = {month: 0.0 for month in range(1, 13)}
@@ -814,16 +3448,10 @@ class _SalesGraphWidget(QWidget):
         return labels, values
 
     def _sales_for_month(self, year, month):
-        sql = """
-            SELECT DAY(sale_time) AS day_num, SUM(total_amount) as total
-            FROM sales 
-            WHERE YEAR(sale_time) = %s AND MONTH(sale_time) = %s
-            GROUP BY day_num 
-            ORDER BY day_num
-        """
         with get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute(sql, (year, month))
+                start, end = month_range(year, month)
+                cur.execute(SALES_BY_DAY_SQL, (start.date(), end.date()))
                 results = cur.fetchall()
         _, num_days = monthrange(year, month)
         daily_sales = {day: 0.0 for day in range(1, num_days + 1)}
@@ -840,7 +3468,10 @@ class _SalesGraphWidget(QWidget):
             return
 
         current_year = datetime.date.today().year
-        labels, values = self._sales_for_year(current_year)
+        self.db.submit("chart", self._sales_for_year, current_year,
+                       on_result=lambda data: self._draw_year(current_year, *data))
+
+    def _draw_year(self, current_year, labels, values):
         self.axes.clear()
         bars = self.axes.bar(labels, values, color='skyblue', edgecolor='navy', alpha=0.7)
         for bar, value in zip(bars, values):
@@ -862,7 +3493,10 @@ class _SalesGraphWidget(QWidget):
             return
 
         today = datetime.date.today()
-        labels, values = self._sales_for_month(today.year, today.month)
+        self.db.submit("chart", self._sales_for_month, today.year, today.month,
+                       on_result=lambda data: self._draw_month(today, *data))
+
+    def _draw_month(self, today, labels, values):
         self.axes.clear()
         bars = self.axes.bar(labels, values, color='lightgreen', edgecolor='darkgreen', alpha=0.7)
         for bar, value in zip(bars, values):
@@ -885,8 +3519,12 @@ class _SalesGraphWidget(QWidget):
             return
         current_year = datetime.date.today().year
         previous_year = current_year - 1
-        labels, current_values = self._sales_for_year(current_year)
-        _, previous_values = self._sales_for_year(previous_year)
+        self.db.submit("chart", lambda: (self._sales_for_year(current_year), self._sales_for_year(previous_year)),
+                       on_result=lambda data: self._draw_comparison(current_year, previous_year, *data))
+
+    def _draw_comparison(self, current_year, previous_year, current, previous):
+        labels, current_values = current
+        _, previous_values = previous
         self.axes.clear()
         bar_width = 0.35
         x_pos = self.np.arange(len(labels))
@@ -969,23 +3607,34 @@ class AdminWindow(QMainWindow):
         content_layout.setContentsMargins(0, 0, 0, 0)
         self.stacked_widget = QStackedWidget()
         content_layout.addWidget(self.stacked_widget)
-        self.dashboard_page = DashboardPage()
-        self.dashboard_page.set_username(username)
-        self.process_sales_page = ProcessSalesPage()
-        self.sale_report_page = SaleReportPage()
-        self.sale_history_page = SaleHistoryPage()
-        self.create_user_page = CreateUserPage()
-
-        self.stacked_widget.addWidget(self.dashboard_page)
-        self.stacked_widget.addWidget(self.process_sales_page)
-        self.stacked_widget.addWidget(self.sale_report_page)
-        self.stacked_widget.addWidget(self.sale_history_page)
-        self.stacked_widget.addWidget(self.create_user_page)
+        # pages are built on first visit; until then each slot holds an empty placeholder
+        self._page_classes = [DashboardPage, ProcessSalesPage, SaleReportPage, SaleHistoryPage, CreateUserPage]
+        self.pages = [None] * len(self._page_classes)
+        for _ in self._page_classes:
+            self.stacked_widget.addWidget(QWidget())
         root.addWidget(sidebar)
         root.addWidget(content, 1)
         btn_group.buttonClicked.connect(self._on_nav)
-        self.dashboard_page.refresh_values()
-        self.process_sales_page.load_sales()
+        # the landing page is built once the window has painted its first frame
+        QTimer.singleShot(0, self._show_landing_page)
+
+    def _show_landing_page(self):
+        self._show_page(0)
+
+    def _page(self, index):
+        page = self.pages[index]
+        if page is None:
+            page = self.pages[index] = self._page_classes[index]()
+            placeholder = self.stacked_widget.widget(index)
+            self.stacked_widget.insertWidget(index, page)
+            self.stacked_widget.removeWidget(placeholder)
+            placeholder.deleteLater()
+        return page
+
+    def _show_page(self, index):
+        page = self._page(index)
+        self.stacked_widget.setCurrentIndex(index)
+        return page
 
     def _on_nav(self, btn):
         txt = btn.text()
@@ -993,20 +3642,17 @@ class AdminWindow(QMainWindow):
             b.setChecked(b is btn)
 
         if "Dashboard" in txt:
-            self.stacked_widget.setCurrentIndex(0)
-            self.dashboard_page.refresh_values()
+            self._show_page(0)
         elif "Process of Sales" in txt:
-            self.stacked_widget.setCurrentIndex(1)
-            self.process_sales_page.load_sales()
+            self._show_page(1)
         elif "Sale Report" in txt:
-            self.stacked_widget.setCurrentIndex(2)
-            self.sale_report_page._load_data()
+            self._show_page(2)
         elif "Sale History" in txt:
-            self.stacked_widget.setCurrentIndex(3)
-            if hasattr(self.sale_history_page, 'graph') and self.sale_history_page.graph.matplotlib_available:
-                self.sale_history_page.graph.show_year()
+            page = self._show_page(3)
+            if hasattr(page, 'graph') and page.graph.matplotlib_available:
+                page.graph.show_year()
         elif "Create User" in txt:
-            self.stacked_widget.setCurrentIndex(4)
+            self._show_page(4)
         elif "Logout" in txt:
             if self.logout_callback:
                 self.logout_callback()
@@ -1133,6 +3779,7 @@ class CreateUserPage(QWidget):
 
         self.username_input.textChanged.connect(self.validate_inputs)
         self.password_input.textChanged.connect(self.validate_inputs)
+        self.db = DbRequests(self, busy_widget=self)
 
     def validate_inputs(self):
         username = self.username_input.text().strip()
@@ -1162,70 +3809,81 @@ class CreateUserPage(QWidget):
                                QMessageBox.Icon.Warning)
             return
 
-        try:
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("SELECT username FROM users WHERE username = %s", (username,))
-                    if cur.fetchone():
-                        self._show_message("User Already Exists",
-                                           f"Username '{username}' is already taken.\n\nPlease choose a different username.",
-                                           QMessageBox.Icon.Warning)
-                        return
+        self.create_btn.setEnabled(False)
+        self.db.submit("create_user", self._insert_user, username, password, role,
+                       on_result=lambda created: self._on_user_created(created, username, role),
+                       on_error=self._on_create_failed)
 
-                    cur.execute("SELECT username FROM managers WHERE username = %s", (username,))
-                    if cur.fetchone():
-                        self._show_message("User Already Exists",
-                                           f"Username '{username}' is already taken.\n\nPlease choose a different username.",
-                                           QMessageBox.Icon.Warning)
-                        return
+    @staticmethod
+    def _insert_user(username, password, role):
+        """Runs on a worker thread; returns False when the username is already taken."""
+        with get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT username FROM users WHERE username = %s", (username,))
+                if cur.fetchone():
+                    return False
 
-                    if role == "Admin" or role == "Cashier":
-                        cur.execute("""
-                            INSERT INTO users (username, password, role) 
-                            VALUES (%s, SHA2(%s, 256), %s)
-                        """, (username, password, role.lower()))
-
-                        if role == "Admin":
-                            message = (
-                                f"✅ <b>Admin User Created Successfully!</b><br><br>"
-                                f"👤 <b>Username:</b> {username}<br>"
-                                f"🔑 <b>Role:</b> Administrator<br><br>"
-                                f"This user can now login to the Admin Portal."
-                            )
-                        else:
-                            message = (
-                                f"✅ <b>Cashier User Created Successfully!</b><br><br>"
-                                f"👤 <b>Username:</b> {username}<br>"
-                                f"🔑 <b>Role:</b> Cashier<br><br>"
-                                f"This user can now login to the Cashier POS system."
-                            )
-
-                    elif role == "Manager":
-                        cur.execute("""
-                            INSERT INTO managers (username, password) 
-                            VALUES (%s, SHA2(%s, 256))
-                        """, (username, password))
-                        message = (
-                            f"✅ <b>Manager User Created Successfully!</b><br><br>"
-                            f"👤 <b>Username:</b> {username}<br>"
-                            f"🔑 <b>Role:</b> Manager<br><br>"
-                            f"This user can now login to the Manager Portal."
-                        )
-
-                    self._show_message("User Created", message, QMessageBox.Icon.Information)
-                    self.username_input.clear()
-                    self.password_input.clear()
-                    self.role_combo.setCurrentIndex(0)
-                    self.create_btn.setEnabled(False)
+                cur.execute("SELECT username FROM managers WHERE username = %s", (username,))
+                if cur.fetchone():
+                    return False
 
-        except Exception as e:
-            error_message = (
-                f"❌ <b>Failed to Create User</b><br><br>"
-                f"An error occurred while creating the user account:<br>"
-                f"<code>{str(e)}</code><br><br>"
-                f"Please check the database connection and try again."
+                if role == "Admin" or role == "Cashier":
+                    cur.execute("""
+                        INSERT INTO users (username, password, role) 
+                        VALUES (%s, SHA2(%s, 256), %s)
+                    """, (username, password, role.lower()))
+                elif role == "Manager":
+                    cur.execute("""
+                        INSERT INTO managers (username, password) 
+                        VALUES (%s, SHA2(%s, 256))
+                    """, (username, password))
+        return True
+
+    def _on_user_created(self, created, username, role):
+        if not created:
+            self.validate_inputs()
+            self._show_message("User Already Exists",
+                               f"Username '{username}' is already taken.\n\nPlease choose a different username.",
+                               QMessageBox.Icon.Warning)
+            return
+
+        if role == "Admin":
+            message = (
+                f"✅ <b>Admin User Created Successfully!</b><br><br>"
+                f"👤 <b>Username:</b> {username}<br>"
+                f"🔑 <b>Role:</b> Administrator<br><br>"
+                f"This user can now login to the Admin Portal."
+            )
+        elif role == "Cashier":
+            message = (
+                f"✅ <b>Cashier User Created Successfully!</b><br><br>"
+                f"👤 <b>Username:</b> {username}<br>"
+                f"🔑 <b>Role:</b> Cashier<br><br>"
+                f"This user can now login to the Cashier POS system."
+            )
+        else:
+            message = (
+                f"✅ <b>Manager User Created Successfully!</b><br><br>"
+                f"👤 <b>Username:</b> {username}<br>"
+                f"🔑 <b>Role:</b> Manager<br><br>"
+                f"This user can now login to the Manager Portal."
             )
-            self._show_message("Database Error", error_message, QMessageBox.Icon.Critical)
+
+        self._show_message("User Created", message, QMessageBox.Icon.Information)
+        self.username_input.clear()
+        self.password_input.clear()
+        self.role_combo.setCurrentIndex(0)
+        self.create_btn.setEnabled(False)
+
+    def _on_create_failed(self, e):
+        self.validate_inputs()
+        error_message = (
+            f"❌ <b>Failed to Create User</b><br><br>"
+            f"An error occurred while creating the user account:<br>"
+            f"<code>{str(e)}</code><br><br>"
+            f"Please check the database connection and try again."
+        )
+        self._show_message("Database Error", error_message, QMessageBox.Icon.Critical)
 
     def _show_message(self, title, message, icon):
         """Show a styled message box with consistent formatting"""
@@ -1269,6 +3927,10 @@ class ManagerWindow(QMainWindow):
         super().__init__()
         self.username = username
         self.logout_callback = logout_callback
+        self.db = DbRequests(self, busy_widget=self)
+        feed = change_feed()
+        feed.sales_added.connect(self._on_feed_change)
+        feed.catalog_changed.connect(self._on_feed_change)
         self.setWindowTitle(f"Manager Portal – {username}")
         self.resize(1200, 800)
         central = QWidget()
@@ -1326,29 +3988,14 @@ class ManagerWindow(QMainWindow):
         self.stack.addWidget(self.inventory_page)
         self.stack.addWidget(self.sales_page)
         self.stack.addWidget(self.refund_page)
+        refresh_scheduler().subscribe("kpi_snapshot", fetch_kpi_snapshot, on_result=self._show_kpi,
+                                      widget=self.dashboard_page)
 
         self.grp.buttonClicked.connect(self.nav)
         self.grp.buttons()[0].setChecked(True)
         self.stack.setCurrentIndex(0)
         self.current_transaction_id = None
         self.current_transaction_items = []
-        self._ensure_created_at_column()
-
-    def _ensure_created_at_column(self):
-        try:
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT COUNT(*) FROM information_schema.columns 
-                        WHERE table_name = 'items' AND column_name = 'created_at'
-                    """)
-                    has_created_at = cur.fetchone()[0] > 0
-
-                    if not has_created_at:
-                        cur.execute("ALTER TABLE items ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
-                        print("Added created_at column to items table")
-        except Exception as e:
-            print(f"Error ensuring created_at column exists: {e}")
 
     def build_manager_inventory(self):
         w = QWidget()
@@ -1640,62 +4287,56 @@ class ManagerWindow(QMainWindow):
             QMessageBox.information(self, "Oops", "Please type the receipt number first.")
             return
 
-        try:
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        SELECT cashier, sale_time, total_amount, items_json
-                        FROM sales
-                        WHERE id=%s
-                    """, (tx,))
-                    row = cur.fetchone()
-                    if not row:
-                        QMessageBox.information(self, "Not Found", "Receipt number not found.")
-                        return
-                    cashier, sale_time, total, items_json = row
-                    self.current_transaction_id = tx
-                    self.current_transaction_items = json.loads(items_json)
-
-                    # fill table
-                    self.refund_table.setRowCount(0)
-                    for idx, item in enumerate(self.current_transaction_items):
-                        r = self.refund_table.rowCount()
-                        self.refund_table.insertRow(r)
-
-                        # ----  original purchase qty  ----
-                        bought_qty = int(item["qty"])
-
-                        # ----  build items  ----
-                        self.refund_table.setItem(r, 0, QTableWidgetItem(item["name"]))
-                        self.refund_table.setItem(r, 1, QTableWidgetItem(f"₱{float(item['price']):.2f}"))
-                        self.refund_table.setItem(r, 2, QTableWidgetItem(str(bought_qty)))
-
-                        # ----  refund qty editor  ----
-                        spin = QSpinBox()
-                        spin.setRange(0, bought_qty)
-                        spin.setValue(0)
-                        spin.setButtonSymbols(QSpinBox.ButtonSymbols.NoButtons)
-                        spin.setAlignment(Qt.AlignmentFlag.AlignCenter)
-                        spin.setStyleSheet("background:white;color:black;border:1px solid #ccc;border-radius:4px;")
-                        spin.valueChanged.connect(self._update_refund_total)
-                        self.refund_table.setCellWidget(r, 3, spin)
-
-                        # ----  refund amount  ----
-                        refund_item = QTableWidgetItem("₱0.00")
-                        refund_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
-                        self.refund_table.setItem(r, 4, refund_item)
-
-                        # ----  PAINT THE WHOLE ROW SOFT BLUE  ----
-                        for c in range(5):
-                            if self.refund_table.item(r, c):
-                                self.refund_table.item(r, c).setBackground(QBrush(QColor(219, 234, 254)))  # soft blue
-                                self.refund_table.item(r, c).setForeground(QBrush(QColor(0, 0, 0)))       # black text
-
-                    self.step2.show()
-                    self._update_refund_total()
+        self.db.submit("receipt", load_refundable_lines, tx,
+                       on_result=lambda lines: self._show_receipt(tx, lines),
+                       on_error=lambda e: QMessageBox.critical(self, "Error", f"Could not load receipt:\n{e}"))
 
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Could not load receipt:\n{e}")
+    def _show_receipt(self, tx, lines):
+        if lines is None:
+            QMessageBox.information(self, "Not Found", "Receipt number not found.")
+            return
+        self.current_transaction_id = tx
+        self.current_transaction_items = lines
+
+        # fill table
+        self.refund_table.setRowCount(0)
+        for idx, item in enumerate(self.current_transaction_items):
+            r = self.refund_table.rowCount()
+            self.refund_table.insertRow(r)
+
+            # ----  original purchase qty, less what earlier refunds returned  ----
+            bought_qty = int(item["qty"])
+            refunded_qty = int(item["refunded"])
+
+            # ----  build items  ----
+            self.refund_table.setItem(r, 0, QTableWidgetItem(item["name"]))
+            self.refund_table.setItem(r, 1, QTableWidgetItem(f"₱{float(item['price']):.2f}"))
+            bought_text = f"{bought_qty} ({refunded_qty} refunded)" if refunded_qty else str(bought_qty)
+            self.refund_table.setItem(r, 2, QTableWidgetItem(bought_text))
+
+            # ----  refund qty editor  ----
+            spin = QSpinBox()
+            spin.setRange(0, bought_qty - refunded_qty)
+            spin.setValue(0)
+            spin.setButtonSymbols(QSpinBox.ButtonSymbols.NoButtons)
+            spin.setAlignment(Qt.AlignmentFlag.AlignCenter)
+            spin.setStyleSheet("background:white;color:black;border:1px solid #ccc;border-radius:4px;")
+            spin.valueChanged.connect(self._update_refund_total)
+            self.refund_table.setCellWidget(r, 3, spin)
+
+            # ----  refund amount  ----
+            refund_item = QTableWidgetItem("₱0.00")
+            refund_item.setTextAlignment(Qt.AlignmentFlag.AlignCenter)
+            self.refund_table.setItem(r, 4, refund_item)
+
+            # ----  PAINT THE WHOLE ROW SOFT BLUE  ----
+            for c in range(5):
+                if self.refund_table.item(r, c):
+                    self.refund_table.item(r, c).setBackground(QBrush(QColor(219, 234, 254)))  # soft blue
+                    self.refund_table.item(r, c).setForeground(QBrush(QColor(0, 0, 0)))       # black text
+
+        self.step2.show()
+        self._update_refund_total()
 
     def _update_refund_total(self):
         total_refund = 0.0
@@ -1715,29 +4356,16 @@ class ManagerWindow(QMainWindow):
 
     def process_refund(self):
         total = 0.0
-        refund_qtys = []  # will hold (item_id, qty)
+        refund_lines = []  # receipt lines with the quantity being returned
         for r in range(self.refund_table.rowCount()):
             spin = self.refund_table.cellWidget(r, 3)
             qty = spin.value()
             if qty:
-                price = float(self.current_transaction_items[r]["price"])
-                total += price * qty
-
-                # -----  NEW: find id by name  -----
-                item_name = self.current_transaction_items[r]["name"]
-                with get_connection() as conn:
-                    with conn.cursor() as cur:
-                        cur.execute("SELECT id FROM items WHERE name = %s", (item_name,))
-                        row = cur.fetchone()
-                        if not row:  # should never happen
-                            QMessageBox.critical(self, "Item missing",
-                                                 f"Item '{item_name}' not found in inventory.")
-                            return
-                        item_id = row[0]
-                # -----------------------------------
-                refund_qtys.append((item_id, qty))
-
-        if not refund_qtys:
+                line = self.current_transaction_items[r]
+                total += float(line["price"]) * qty
+                refund_lines.append({"id": line["id"], "price": line["price"], "qty": qty})
+
+        if not refund_lines:
             return
 
         reply = QMessageBox.question(
@@ -1749,25 +4377,19 @@ class ManagerWindow(QMainWindow):
         if reply != QMessageBox.StandardButton.Yes:
             return
 
-        try:
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    # record refund
-                    cur.execute("""
-                        INSERT INTO refunds (transaction_id, refund_amount, processed_by, processed_at)
-                        VALUES (%s, %s, %s, NOW())
-                    """, (self.current_transaction_id, total, self.username))
-
-                    # restore stock
-                    for item_id, qty in refund_qtys:
-                        cur.execute("UPDATE items SET stock = stock + %s WHERE id = %s", (qty, item_id))
+        self.big_refund_btn.setEnabled(False)
+        self.db.submit("refund", refund_sale, self.current_transaction_id, refund_lines, total, self.username,
+                       on_result=lambda _: self._on_refund_done(total),
+                       on_error=self._on_refund_failed)
 
-            QMessageBox.information(self, "Done", f"Refund complete!\n₱{total:.2f} was returned to customer.")
-            self.refund_search.clear()
-            self.step2.hide()
+    def _on_refund_done(self, total):
+        QMessageBox.information(self, "Done", f"Refund complete!\n₱{total:.2f} was returned to customer.")
+        self.refund_search.clear()
+        self.step2.hide()
 
-        except Exception as e:
-            QMessageBox.critical(self, "Refund Failed", str(e))
+    def _on_refund_failed(self, e):
+        self._update_refund_total()
+        QMessageBox.critical(self, "Refund Failed", str(e))
 
     def build_manager_dashboard(self):
         w = QWidget()
@@ -1823,7 +4445,7 @@ class ManagerWindow(QMainWindow):
             font-weight:bold;
             font-size:14px;
         """)
-        ref.clicked.connect(self.refresh_dashboard)
+        ref.clicked.connect(refresh_scheduler().refresh_now)
         lay.addWidget(ref, alignment=Qt.AlignmentFlag.AlignLeft)
         lay.addStretch()
         return w
@@ -1931,12 +4553,25 @@ class ManagerWindow(QMainWindow):
         lay.addWidget(quick_add_section)
 
         # table
-        self.inv_table = QTableWidget(0, 5)
-        self.inv_table.setHorizontalHeaderLabels(["ID", "Name", "Price", "Stock", "Actions"])
+        self.inv_search = QLineEdit()
+        self.inv_search.setPlaceholderText("Search items...")
+        self.inv_search.setStyleSheet(
+            "background:white; color:black; border:1px solid #ccc; border-radius:5px; padding:8px; margin-top:10px;")
+        lay.addWidget(self.inv_search)
+
+        self.inv_model = InventoryModel(self.db, self)
+        self.inv_table = QTableView()
+        self.inv_table.setModel(self.inv_model)
         self.inv_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
         self.inv_table.horizontalHeader().setStretchLastSection(True)
+        self.inv_table.setMouseTracking(True)
+        self.inv_table.horizontalHeader().setSortIndicator(1, Qt.SortOrder.AscendingOrder)
+        self.inv_table.setSortingEnabled(True)
+        edit_delegate = ButtonDelegate("Edit", "#ffb703", "#ffc833", parent=self.inv_table)
+        edit_delegate.clicked.connect(lambda row: self.edit_item(*self.inv_model.item(row)))
+        self.inv_table.setItemDelegateForColumn(4, edit_delegate)
         self.inv_table.setStyleSheet("""
-            QTableWidget{
+            QTableView{
                 background:#3c3c3c;
                 border:1px solid #555;
                 color: #ffffff;
@@ -1946,13 +4581,19 @@ class ManagerWindow(QMainWindow):
                 color:#fff;
                 font-weight:bold;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 5px;
                 color: #ffffff;
             }
         """)
         lay.addWidget(self.inv_table)
 
+        self.inv_search_timer = QTimer(self)
+        self.inv_search_timer.setSingleShot(True)
+        self.inv_search_timer.setInterval(300)
+        self.inv_search_timer.timeout.connect(lambda: self.inv_model.set_search(self.inv_search.text()))
+        self.inv_search.textChanged.connect(lambda _: self.inv_search_timer.start())
+
         self.load_inventory_table()
         self.fill_inventory_combo()
         return w
@@ -1992,13 +4633,16 @@ class ManagerWindow(QMainWindow):
         h.addStretch()
         lay.addLayout(h)
 
-        self.sales_table = QTableWidget(0, 6)
-        self.sales_table.setHorizontalHeaderLabels(
-            ["Cashier", "Date/Time", "Transaction ID", "Sub-total", "Grand Total", "Payment"])
+        self.sales_model = SalesListModel(self.db, [
+            ("Cashier", "cashier"), ("Date/Time", "time"), ("Transaction ID", "id"),
+            ("Sub-total", "blank"), ("Grand Total", "total"), ("Payment", "payment")], self)
+        change_feed().sales_added.connect(self.sales_model.add_sales)
+        self.sales_table = QTableView()
+        self.sales_table.setModel(self.sales_model)
         self.sales_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
         self.sales_table.horizontalHeader().setStretchLastSection(True)
         self.sales_table.setStyleSheet("""
-            QTableWidget{
+            QTableView{
                 background:#3c3c3c;
                 border:1px solid #555;
                 color: #ffffff;
@@ -2008,7 +4652,7 @@ class ManagerWindow(QMainWindow):
                 color:#fff;
                 font-weight:bold;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 5px;
                 color: #ffffff;
             }
@@ -2108,51 +4752,32 @@ class ManagerWindow(QMainWindow):
             return
 
         item_id = self.item_map[name]
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("UPDATE items SET stock = stock + %s WHERE id = %s", (qty, item_id))
+        self.db.submit("quick_add", add_stock, item_id, qty,
+                       on_result=lambda _: self._on_stock_added(name, qty),
+                       on_error=lambda e: QMessageBox.critical(self, "Database Error", f"Failed to add stock: {e}"))
+
+    def _on_stock_added(self, name, qty):
         QMessageBox.information(self, "Done", f"Added {qty} pcs to '{name}'.")
         self.load_inventory_table()
 
     # ----------  manager helpers  ----------
     def refresh_dashboard(self):
-        today = datetime.date.today()
-        week_start = today - datetime.timedelta(days=today.weekday())
-        daily = self.sql_sum("DATE(sale_time) = %s", (today,))
-        weekly = self.sql_sum("sale_time >= %s", (week_start,))
-        top = self.top_cashier_today()
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT COUNT(*) FROM items")
-                items = cur.fetchone()[0]
-        self.kpi_daily.set_value(f"₱{daily:,.2f}")
-        self.kpi_week.set_value(f"₱{weekly:,.2f}")
-        self.kpi_top.set_value(top)
-        self.kpi_items.set_value(str(items))
-
-    def sql_sum(self, where, params):
-        sql = f"SELECT COALESCE(SUM(total_amount),0) FROM sales WHERE {where}"
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql, params)
-                return float(cur.fetchone()[0])
+        refresh_scheduler().request("kpi_snapshot", force=True)
 
-    def top_cashier_today(self):
-        today = datetime.date.today()
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT cashier, SUM(total_amount) FROM sales WHERE DATE(sale_time) = %s GROUP BY cashier ORDER BY SUM(total_amount) DESC LIMIT 1",
-                    (today,))
-                row = cur.fetchone()
-                return f"{row[0]}  (₱{row[1]:,.2f})" if row else "-"
+    def _on_feed_change(self, _changes):
+        self.refresh_dashboard()
+
+    def _show_kpi(self, kpi):
+        self.kpi_daily.set_value(f"₱{kpi.daily:,.2f}")
+        self.kpi_week.set_value(f"₱{kpi.weekly:,.2f}")
+        self.kpi_top.set_value(kpi.top_cashier_label)
+        self.kpi_items.set_value(str(kpi.item_count))
 
     def fill_inventory_combo(self):
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT id, name FROM items ORDER BY name")
-                items = cur.fetchall()
-        self.item_map = {name: id for id, name in items}
+        self.db.submit("inventory_combo", load_catalog, on_result=self._fill_inventory_combo)
+
+    def _fill_inventory_combo(self, items):
+        self.item_map = {name: id for id, name, price, stock in items}
         self.combo.clear()
         self.combo.addItems(self.item_map.keys())
         completer = QCompleter(list(self.item_map.keys()), self)
@@ -2160,28 +4785,7 @@ class ManagerWindow(QMainWindow):
         self.combo.setCompleter(completer)
 
     def load_inventory_table(self):
-        self.inv_table.setRowCount(0)
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT id, name, price, stock FROM items ORDER BY name")
-                for id, name, price, stock in cur.fetchall():
-                    row = self.inv_table.rowCount()
-                    self.inv_table.insertRow(row)
-                    self.inv_table.setItem(row, 0, QTableWidgetItem(str(id)))
-                    self.inv_table.setItem(row, 1, QTableWidgetItem(name))
-                    self.inv_table.setItem(row, 2, QTableWidgetItem(f"₱{price:,.2f}"))
-                    self.inv_table.setItem(row, 3, QTableWidgetItem(str(stock)))
-                    btn = QPushButton("Edit")
-                    btn.setStyleSheet("""
-                        background:#ffb703;
-                        color:#000;
-                        border:none;
-                        border-radius:4px;
-                        padding:5px 10px;
-                        font-weight:bold;
-                    """)
-                    btn.clicked.connect(lambda _, i=id, n=name, p=price, s=stock: self.edit_item(i, n, p, s))
-                    self.inv_table.setCellWidget(row, 4, btn)
+        self.inv_model.reload()
 
     def edit_item(self, id, name, price, stock):
         new_name, ok = QInputDialog.getText(self, "Edit", "Item name:", text=name)
@@ -2190,40 +4794,25 @@ class ManagerWindow(QMainWindow):
         if not ok: return
         new_stock, ok = QInputDialog.getInt(self, "Edit", "Stock:", value=stock)
         if not ok: return
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("UPDATE items SET name=%s, price=%s, stock=%s WHERE id=%s",
-                            (new_name, new_price, new_stock, id))
-        QMessageBox.information(self, "Done", "Item updated.")
+        barcode, ok = QInputDialog.getText(self, "Edit", "Barcode (optional):", text=CATALOG.barcode_of(id) or "")
+        if not ok: return
+        self.db.submit("edit_item", update_item, id, new_name, new_price, new_stock, barcode.strip(),
+                       on_result=lambda _: self._on_items_changed("Item updated."),
+                       on_error=lambda e: QMessageBox.critical(self, "Database Error", f"Failed to update item: {e}"))
+
+    def _on_items_changed(self, message):
+        QMessageBox.information(self, "Done", message)
         self.load_inventory_table()
         self.fill_inventory_combo()
 
     def load_sales_table(self):
-        self.sales_table.setRowCount(0)
         picked = self.date_pick.date().toPyDate()
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT cashier, sale_time, id, total_amount, payment_method, items_json
-                    FROM sales
-                    WHERE DATE(sale_time) = %s
-                    ORDER BY sale_time DESC
-                """, (picked,))
-                for cashier, ts, id, total, pay, items_json in cur.fetchall():
-                    row = self.sales_table.rowCount()
-                    self.sales_table.insertRow(row)
-                    self.sales_table.setItem(row, 0, QTableWidgetItem(cashier))
-                    self.sales_table.setItem(row, 1, QTableWidgetItem(ts.strftime("%Y-%m-%d %H:%M")))
-                    self.sales_table.setItem(row, 2, QTableWidgetItem(str(id)))
-                    self.sales_table.setItem(row, 3, QTableWidgetItem(""))
-                    self.sales_table.setItem(row, 4, QTableWidgetItem(f"₱{total:,.2f}"))
-                    self.sales_table.setItem(row, 5, QTableWidgetItem(pay))
+        self.sales_model.set_filters(picked)
 
     def nav(self, btn):
         txt = btn.text()
         if "Dashboard" in txt:
             self.stack.setCurrentIndex(0)
-            self.refresh_dashboard()
         elif "Inventory" in txt:
             self.stack.setCurrentIndex(1)
             self.load_inventory_table()
@@ -2250,12 +4839,439 @@ class ManagerWindow(QMainWindow):
         if not ok or stock < 0:
             return
 
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("INSERT INTO items (name, price, stock) VALUES (%s, %s, %s)", (name, price, stock))
-        QMessageBox.information(self, "Done", f"Added new item '{name}' to inventory.")
-        self.load_inventory_table()
-        self.fill_inventory_combo()
+        barcode, ok = QInputDialog.getText(self, "Add New Item", "Barcode (optional):")
+        if not ok:
+            return
+
+        self.db.submit("add_item", add_item, name, price, stock, barcode.strip(),
+                       on_result=lambda _: self._on_items_changed(f"Added new item '{name}' to inventory."),
+                       on_error=lambda e: QMessageBox.critical(self, "Database Error", f"Failed to add item: {e}"))
+
+# ----------  Barcode scanner  ----------
+SCAN_KEY_GAP = 0.03           # seconds; keyboard-wedge scanners type faster than this, people do not
+SCAN_MIN_LENGTH = 4
+SCAN_LATENCY_BUDGET_MS = 50   # last scanner key to cart line, checked by --bench-scan
+SEARCH_DEBOUNCE_MS = 60       # completer waits this long after typing so scanner bursts never open it
+
+
+class BarcodeScanner(QObject):
+    """Event filter that picks keyboard-wedge scanner bursts out of normal typing.
+
+    Keys pass through as usual. When Enter ends a burst of at least
+    ``SCAN_MIN_LENGTH`` characters typed less than ``SCAN_KEY_GAP`` apart,
+    the Enter is swallowed, the burst is taken back out of the line edit
+    it landed in and ``scanned`` is emitted with the code.
+    """
+    scanned = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._buffer = []
+        self._last = 0.0
+
+    def in_burst(self):
+        return len(self._buffer) > 1 and time.monotonic() - self._last <= SCAN_KEY_GAP
+
+    def eventFilter(self, obj, event):
+        if event.type() != QEvent.Type.KeyPress:
+            return False
+        now = time.monotonic()
+        if now - self._last > SCAN_KEY_GAP:
+            self._buffer.clear()
+        self._last = now
+        if event.key() in (Qt.Key.Key_Return, Qt.Key.Key_Enter):
+            code = "".join(self._buffer)
+            self._buffer.clear()
+            if len(code) < SCAN_MIN_LENGTH:
+                return False
+            if isinstance(obj, QLineEdit) and obj.text().endswith(code):
+                obj.setText(obj.text()[:-len(code)])
+            self.scanned.emit(code)
+            return True
+        text = event.text()
+        if text and text.isprintable():
+            self._buffer.append(text)
+        return False
+
+
+# ----------  Table models  ----------
+class ButtonDelegate(QStyledItemDelegate):
+    """Paints a flat button in every cell of a column and emits ``clicked(row)``.
+
+    Replaces a QPushButton cell widget per row, so the view holds no live
+    widgets however many rows it shows. The view needs mouse tracking on
+    for the hover colour.
+    """
+    clicked = pyqtSignal(int)
+
+    def __init__(self, text, color, hover_color, text_color="#000", parent=None):
+        super().__init__(parent)
+        self.text = text
+        self.color = QColor(color)
+        self.hover_color = QColor(hover_color)
+        self.text_color = QColor(text_color)
+
+    def paint(self, painter, option, index):
+        rect = QRectF(option.rect.adjusted(8, 4, -8, -4))
+        hovered = bool(option.state & QStyle.StateFlag.State_MouseOver)
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(self.hover_color if hovered else self.color)
+        painter.drawRoundedRect(rect, 4, 4)
+        font = QFont(option.font)
+        font.setBold(True)
+        painter.setFont(font)
+        painter.setPen(self.text_color)
+        painter.drawText(rect, Qt.AlignmentFlag.AlignCenter, self.text)
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index):
+        if (event.type() == QEvent.Type.MouseButtonRelease and event.button() == Qt.MouseButton.LeftButton
+                and option.rect.contains(event.position().toPoint())):
+            self.clicked.emit(index.row())
+            return True
+        return False
+
+
+class CartModel(QAbstractTableModel):
+    """Cart lines keyed by item id, with the basket total kept as lines change.
+
+    Lines are dicts with id, name, price, qty and total, the shape checkout
+    and ``sale_items`` expect. Adding an item already in the cart is a dict
+    lookup plus one ``dataChanged`` for that row.
+    """
+    HEADERS = ["Item", "Price", "Qty", "Total", "Reduce", "Remove"]
+    total_changed = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._lines = []
+        self._rows = {}  # item id -> row
+        self.total = Decimal("0")
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._lines)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        line = self._lines[index.row()]
+        column = index.column()
+        if column == 0:
+            return line["name"]
+        if column == 1:
+            return f"₱{line['price']:.2f}"
+        if column == 2:
+            return str(line["qty"])
+        if column == 3:
+            return f"₱{line['total']:.2f}"
+        return None
+
+    def __len__(self):
+        return len(self._lines)
+
+    def line(self, row):
+        return self._lines[row]
+
+    def lines(self):
+        """Copies of the lines, safe to hand to a worker thread."""
+        return [dict(line) for line in self._lines]
+
+    def qty_of(self, item_id):
+        row = self._rows.get(item_id)
+        return 0 if row is None else self._lines[row]["qty"]
+
+    def add(self, item_id, name, price, qty):
+        """Add ``qty`` of an item, merging into its line; returns True if a new line was made."""
+        row = self._rows.get(item_id)
+        if row is not None:
+            self._set_qty(row, self._lines[row]["qty"] + qty)
+            return False
+        row = len(self._lines)
+        self.beginInsertRows(QModelIndex(), row, row)
+        line = {"id": item_id, "name": name, "price": price, "qty": qty, "total": round(price * qty, 2)}
+        self._lines.append(line)
+        self._rows[item_id] = row
+        self.endInsertRows()
+        self._add_to_total(line["total"])
+        return True
+
+    def reduce(self, row):
+        """Take one unit off a line, dropping the line at zero; returns the line's new qty."""
+        qty = self._lines[row]["qty"] - 1
+        if qty > 0:
+            self._set_qty(row, qty)
+        else:
+            self.remove(row)
+        return qty
+
+    def remove(self, row):
+        self.beginRemoveRows(QModelIndex(), row, row)
+        line = self._lines.pop(row)
+        del self._rows[line["id"]]
+        for later in self._lines[row:]:
+            self._rows[later["id"]] -= 1
+        self.endRemoveRows()
+        self._add_to_total(-line["total"])
+        return line
+
+    def take(self, sold):
+        """Take the quantities of ``sold`` (lines from ``lines``) off the cart, keeping anything added since."""
+        for line in sold:
+            row = self._rows.get(line["id"])
+            if row is None:
+                continue
+            qty = self._lines[row]["qty"] - line["qty"]
+            if qty > 0:
+                self._set_qty(row, qty)
+            else:
+                self.remove(row)
+
+    def clear(self):
+        self.beginResetModel()
+        self._lines.clear()
+        self._rows.clear()
+        self.endResetModel()
+        self.total = Decimal("0")
+        self.total_changed.emit(self.total)
+
+    def _set_qty(self, row, qty):
+        line = self._lines[row]
+        old_total = line["total"]
+        line["qty"] = qty
+        line["total"] = round(line["price"] * qty, 2)
+        self.dataChanged.emit(self.index(row, 2), self.index(row, 3))
+        self._add_to_total(line["total"] - old_total)
+
+    def _add_to_total(self, amount):
+        self.total += amount
+        self.total_changed.emit(self.total)
+
+
+INVENTORY_PAGE_SIZE = 200
+INVENTORY_SORT_COLUMNS = ("id", "name", "price", "stock")
+INVENTORY_INDEXES = (
+    ("idx_items_name", "name"),
+    ("idx_items_price", "price"),
+)
+
+
+def build_inventory_page_query(search="", sort_column=1, descending=False, after=None, limit=INVENTORY_PAGE_SIZE):
+    """One page of items, seeking past ``after`` = (sort value, id) of the last row already shown."""
+    column = INVENTORY_SORT_COLUMNS[sort_column]
+    op, direction = ("<", "DESC") if descending else (">", "ASC")
+    sql = "SELECT id, name, price, stock FROM items WHERE name LIKE %s"
+    params = [f"%{search}%"]
+    if after is not None:
+        if column == "id":
+            sql += f" AND id {op} %s"
+            params.append(after[1])
+        else:
+            sql += f" AND ({column} {op} %s OR ({column} = %s AND id {op} %s))"
+            params += [after[0], after[0], after[1]]
+    if column == "id":
+        sql += f" ORDER BY id {direction} LIMIT %s"
+    else:
+        sql += f" ORDER BY {column} {direction}, id {direction} LIMIT %s"
+    params.append(limit)
+    return sql, params
+
+
+class PagedTableModel(QAbstractTableModel):
+    """Rows fetched from MySQL a page at a time as the view scrolls.
+
+    Subclasses give the query for the page after a row (``page_query``) and
+    how to show a cell (``format``); cells are formatted only when the view
+    paints them, so held rows stay as plain tuples.
+    """
+    HEADERS = []
+    PAGE_SIZE = 200
+
+    def __init__(self, db, key, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.key = key
+        self._rows = []
+        self._done = False
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        return self.format(self._rows[index.row()], index.column())
+
+    def item(self, row):
+        return self._rows[row]
+
+    def page_query(self, last):
+        """(sql, params) for the page after row ``last``, or the first page when it is None."""
+        raise NotImplementedError
+
+    def format(self, row, column):
+        raise NotImplementedError
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._done and not self.db.is_pending(self.key)
+
+    def fetchMore(self, parent=QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        sql, params = self.page_query(self._rows[-1] if self._rows else None)
+        self.db.submit(self.key, fetch_all, sql, params, on_result=self._append_page)
+
+    def _append_page(self, rows):
+        if len(rows) < self.PAGE_SIZE:
+            self._done = True
+        if rows:
+            first = len(self._rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+            self._rows.extend(rows)
+            self.endInsertRows()
+
+    def reload(self):
+        """Drop the fetched rows and start again from the first page."""
+        self.db.cancel(self.key)
+        self.beginResetModel()
+        self._rows = []
+        self._done = False
+        self.endResetModel()
+        self.fetchMore()
+
+
+class InventoryModel(PagedTableModel):
+    """Items for the manager's inventory view.
+
+    Sorting and the name filter run in MySQL; each page seeks past the last
+    row held, so opening the view costs one page however big the catalog is.
+    """
+    HEADERS = ["ID", "Name", "Price", "Stock", "Actions"]
+    PAGE_SIZE = INVENTORY_PAGE_SIZE
+
+    def __init__(self, db, parent=None):
+        super().__init__(db, "inventory_page", parent)
+        self._search = ""
+        self._sort_column = 1
+        self._descending = False
+
+    def page_query(self, last):
+        after = (last[self._sort_column], last[0]) if last else None
+        return build_inventory_page_query(self._search, self._sort_column, self._descending, after)
+
+    def format(self, row, column):
+        id, name, price, stock = row
+        if column == 0:
+            return str(id)
+        if column == 1:
+            return name
+        if column == 2:
+            return f"₱{price:,.2f}"
+        if column == 3:
+            return str(stock)
+        return None
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        if column >= len(INVENTORY_SORT_COLUMNS):
+            return
+        self._sort_column = column
+        self._descending = order == Qt.SortOrder.DescendingOrder
+        self.reload()
+
+    def set_search(self, text):
+        self._search = text.strip()
+        self.reload()
+
+
+SALES_LIST_CELLS = {
+    "cashier": lambda sale: sale[0],
+    "time": lambda sale: sale[1].strftime("%Y-%m-%d %H:%M"),
+    "id": lambda sale: str(sale[2]),
+    "blank": lambda sale: "",
+    "total": lambda sale: f"₱{sale[3]:,.2f}",
+    "payment": lambda sale: sale[4],
+}
+
+
+class SalesListModel(PagedTableModel):
+    """A day's sales, newest first, paged on (sale_time, id) so busy days are never cut off.
+
+    ``columns`` is a list of (header, cell) pairs, cell being a key of
+    ``SALES_LIST_CELLS``, so the admin and manager lists share one model.
+    """
+    PAGE_SIZE = SALES_PAGE_SIZE
+
+    def __init__(self, db, columns, parent=None):
+        super().__init__(db, "sales_page", parent)
+        self.HEADERS = [header for header, _ in columns]
+        self._cells = [SALES_LIST_CELLS[cell] for _, cell in columns]
+        self._day = datetime.date.today()
+        self._cashiers = None
+        self._pay_filter = "All"
+
+    def set_filters(self, day, cashiers=None, pay_filter="All"):
+        self._day, self._cashiers, self._pay_filter = day, cashiers, pay_filter
+        self.reload()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        # a search no cashier matches needs no query at all
+        return self._cashiers != [] and super().canFetchMore(parent)
+
+    def add_sales(self, sales):
+        """Slot change-feed sales the filters match in among the rows already held.
+
+        Sales older than every held row are left to the next page fetch, and
+        ones a page already brought in are skipped.
+        """
+        if not self._rows and self.db.is_pending(self.key):
+            return  # the first page is on its way and will contain them
+        start, end = day_range(self._day)
+        oldest_first = [(row[1], row[2]) for row in reversed(self._rows)]
+        positions = []
+        for sale in sales:
+            if not (start <= sale[1] < end and self._pay_filter in ("All", sale[4])
+                    and (self._cashiers is None or sale[0] in self._cashiers)):
+                continue
+            key = (sale[1], sale[2])
+            at = bisect.bisect_left(oldest_first, key)
+            if at < len(oldest_first) and oldest_first[at] == key:
+                continue
+            if at == 0 and oldest_first and not self._done:
+                continue
+            positions.append((len(oldest_first) - at, key, sale))
+        # bottom up so earlier positions stay valid; oldest first where several share a slot
+        for row, _, sale in sorted(positions, key=lambda p: (-p[0], p[1])):
+            self.beginInsertRows(QModelIndex(), row, row)
+            self._rows.insert(row, sale)
+            self.endInsertRows()
+
+    def page_query(self, last):
+        after = (last[1], last[2]) if last else None
+        return build_sales_page_query(self._day, self._cashiers, self._pay_filter, after)
+
+    def format(self, row, column):
+        return self._cells[column](row)
+
+
+ITEM_COMBO_REBUILD_THRESHOLD = 500  # past this many changed items the combo is refilled instead of patched
+
 
 class CashierWindow(QMainWindow):
     def __init__(self, username, logout_callback):
@@ -2265,11 +5281,29 @@ class CashierWindow(QMainWindow):
         self.setWindowTitle(f"Cashier POS – {username}")
         self.resize(900, 650)
         self.setStyleSheet("background:#1e1e1e;")
-        self.cart = []
-        self.items_data = {}
+        self.cart = CartModel(self)
+        self.item_map = {}
+        self._item_names = []  # in-stock names in model order, for bisecting
+        self._item_name_by_id = {}
+        self._catalog_version = None
+        self.item_model = QStringListModel(self)
+        self.item_index = CatalogSearchIndex()
+        self._scan_queue = deque()
+        self.journal = offline_journal()
+        self._unsynced = self.journal.queued_quantities()  # units sold offline, not in the server's stock yet
+        self.writer = sale_writer() if WRITE_BEHIND else None
+        self._waiting_for_writer = False
+        self._written = []  # quantities the writer committed, taken off _unsynced once a catalog read has them
+        self.db = DbRequests(self)
         self._build_ui()
         self._load_items()
-        self._fill_item_combo()
+        change_feed().catalog_changed.connect(self._on_catalog_changed)
+        if self.writer:
+            self.writer.saved.connect(self._on_sales_written)
+            self.writer.short.connect(self._on_sales_short)
+            self.writer.failed.connect(self._on_sales_write_failed)
+        journal_replicator().synced.connect(self._on_journal_synced)
+        self._detached = False
 
     def _build_ui(self):
         central = QWidget()
@@ -2353,18 +5387,28 @@ class CashierWindow(QMainWindow):
         inp.addWidget(add_btn)
         lay.addLayout(inp)
 
-        self.cart_table = QTableWidget(0, 6)
-        self.cart_table.setHorizontalHeaderLabels(["Item", "Price", "Qty", "Total", "Reduce", "Remove"])
+        self.cart_table = QTableView()
+        self.cart_table.setModel(self.cart)
         self.cart_table.setAlternatingRowColors(True)
-        self.cart_table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
+        self.cart_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
         self.cart_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.cart_table.setMouseTracking(True)
+        self.cart_table.verticalHeader().setVisible(False)
+        reduce_delegate = ButtonDelegate("-1", "#ff9f1c", "#ffb627", parent=self.cart_table)
+        reduce_delegate.clicked.connect(self.reduce_quantity)
+        self.cart_table.setItemDelegateForColumn(4, reduce_delegate)
+        remove_delegate = ButtonDelegate("✖", "#e63946", "#f77f00", "#fff", parent=self.cart_table)
+        remove_delegate.clicked.connect(self.remove_row)
+        self.cart_table.setItemDelegateForColumn(5, remove_delegate)
+        self.cart.total_changed.connect(lambda _: self.update_total())
+        self.cart.rowsInserted.connect(lambda _, first, last: self.cart_table.scrollTo(self.cart.index(last, 0)))
         hdr = self.cart_table.horizontalHeader()
         for i in range(4):
             hdr.setSectionResizeMode(i, QHeaderView.ResizeMode.Stretch)
         self.cart_table.setColumnWidth(4, 80)
         self.cart_table.setColumnWidth(5, 80)
         self.cart_table.setStyleSheet("""
-            QTableWidget{
+            QTableView{
                 background:#2b2b2b;
                 gridline-color:#444;
                 color:#f8f9fa;
@@ -2404,26 +5448,115 @@ class CashierWindow(QMainWindow):
         self.status_lbl.setStyleSheet(
             "color:#adb5bd;padding:10px 20px;font-size:14px;background:#2b2b2b;margin:0px 20px 10px 20px;border-radius:5px;")
         lay.addWidget(self.status_lbl)
+        self.combo.setModel(self.item_model)
+        # the search model does the matching, so the completer shows its rows unfiltered
+        self.search_model = ItemSearchModel(self.item_index, self)
+        completer = QCompleter(self.search_model, self)
+        completer.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+        completer.setCompletionMode(QCompleter.CompletionMode.UnfilteredPopupCompletion)
+        self.combo.setCompleter(completer)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(lambda: self._search_items(self.combo.lineEdit().text()))
+        self.combo.lineEdit().textEdited.connect(lambda _: self.search_timer.start())
         self.combo.currentTextChanged.connect(self.on_item_selected)
+        # scans land in the item box, which keeps focus between scans
+        self.scanner = BarcodeScanner(self)
+        self.scanner.scanned.connect(self._queue_scan)
+        self.combo.lineEdit().installEventFilter(self.scanner)
+        self.combo.setFocus()
+
+    def _search_items(self, text):
+        if self.scanner.in_burst():
+            return
+        self.search_model.set_query(text)
+        if self.search_model.rowCount():
+            self.combo.completer().complete()
+
+    def _queue_scan(self, code):
+        self._scan_queue.append(code)
+        if len(self._scan_queue) == 1:
+            QTimer.singleShot(0, self._drain_scans)
+
+    def _drain_scans(self):
+        while self._scan_queue:
+            self.add_scanned(self._scan_queue.popleft())
+
+    def add_scanned(self, code):
+        item_id = CATALOG.find_barcode(code)
+        name = self._item_name_by_id.get(item_id)
+        if name is None:
+            item = CATALOG.get(item_id) if item_id is not None else None
+            self.status_lbl.setText(f"Out of stock: {item[1]}" if item else f"Unknown barcode: {code}")
+            QApplication.beep()
+            return
+        problem = self._add_line(name, 1)
+        if problem:
+            self.status_lbl.setText(f"{name}: {problem}")
+            QApplication.beep()
 
     def _load_items(self):
-        try:
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("SELECT id, name, price, stock FROM items WHERE stock > 0 ORDER BY name")
-                    self.items_data = cur.fetchall()
-        except Exception as e:
-            print(f"Error loading items: {e}")
-            self.items_data = []
+        written = len(self._written)
+        self.db.submit("items", CATALOG.refresh, on_result=lambda _: self._sync_items(written),
+                       on_error=self._on_items_failed)
+
+    def _on_items_failed(self, e):
+        print(f"Error loading items: {e}")
+
+    def _sync_items(self, written=0):
+        # the read began after the first ``written`` writer commits, so the catalog has their stock now
+        released = []
+        for sold in self._written[:written]:
+            for item_id, qty in sold:
+                left = self._unsynced.get(item_id, 0) - qty
+                if left > 0:
+                    self._unsynced[item_id] = left
+                else:
+                    self._unsynced.pop(item_id, None)
+                released.append(item_id)
+        del self._written[:written]
+        changed, self._catalog_version = CATALOG.changes_since(self._catalog_version)
+        if changed is None or len(changed) > ITEM_COMBO_REBUILD_THRESHOLD:
+            self._fill_item_combo()
+            return
+        for item_id in dict.fromkeys([*changed, *released]):
+            item = CATALOG.get(item_id)
+            if item is not None:
+                self._put_item(self._less_unsynced(item))
 
     def _fill_item_combo(self):
-        self.item_map = {name: (id, price, stock) for id, name, price, stock in self.items_data}
-        self.combo.clear()
-        self.combo.addItems(self.item_map.keys())
-        completer = QCompleter(list(self.item_map.keys()), self)
-        completer.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
-        completer.setFilterMode(Qt.MatchFlag.MatchContains)
-        self.combo.setCompleter(completer)
+        rows = [self._less_unsynced(row) for row in CATALOG.rows(in_stock=True)]
+        rows = [row for row in rows if row[3] > 0]
+        self.item_map = {name: (id, price, stock) for id, name, price, stock in rows}
+        self._item_name_by_id = {id: name for id, name, price, stock in rows}
+        self._item_names = [name for id, name, price, stock in rows]
+        self.item_model.setStringList(self._item_names)
+        self.item_index.rebuild((id, name) for id, name, price, stock in rows)
+
+    def _put_item(self, item):
+        """Patch one item into the combo model in place; items out of stock are dropped."""
+        id, name, price, stock = item
+        old_name = self._item_name_by_id.get(id)
+        if old_name == name and stock > 0:
+            self.item_map[name] = (id, price, stock)
+            return
+        if old_name is not None:
+            del self._item_name_by_id[id]
+            self.item_map.pop(old_name, None)
+            self.item_index.remove(id)
+            row = bisect.bisect_left(self._item_names, old_name)
+            if row < len(self._item_names) and self._item_names[row] == old_name:
+                del self._item_names[row]
+                self.item_model.removeRows(row, 1)
+        if stock > 0:
+            row = bisect.bisect_left(self._item_names, name)
+            self._item_names.insert(row, name)
+            self.item_model.insertRows(row, 1)
+            self.item_model.setData(self.item_model.index(row), name)
+            self.item_map[name] = (id, price, stock)
+            self._item_name_by_id[id] = name
+            self.item_index.add(id, name)
 
     def on_item_selected(self, item_name):
         if item_name and item_name in self.item_map:
@@ -2438,116 +5571,86 @@ class CashierWindow(QMainWindow):
             QMessageBox.warning(self, "Input", "Select a valid item.")
             return
 
-        id, price, stock = self.item_map[name]
-        qty = self.qty_spin.value()
-
-        if qty > stock:
-            QMessageBox.warning(self, "Stock", f"Not enough stock! Available: {stock}")
+        problem = self._add_line(name, self.qty_spin.value())
+        if problem:
+            QMessageBox.warning(self, "Stock", problem)
             return
+        self.qty_spin.setValue(1)
 
-        total = round(price * qty, 2)
-        for item in self.cart:
-            if item["name"] == name:
-                item["qty"] += qty
-                item["total"] = round(item["price"] * item["qty"], 2)
-                self.refresh_cart_table()
-                self.qty_spin.setValue(1)
-                self.status_lbl.setText(f"Updated {name} in cart")
-                return
+    def _add_line(self, name, qty):
+        """Add ``qty`` of a listed item to the cart; returns why not, or None."""
+        id, price, stock = self.item_map[name]
+        in_cart = self.cart.qty_of(id)
+        if in_cart + qty > stock:
+            return f"Not enough stock! Available: {stock - in_cart}" + (f" more ({in_cart} in cart)" if in_cart else "")
 
-        self.cart.append({
-            "id": id,
-            "name": name,
-            "price": price,
-            "qty": qty,
-            "total": total
-        })
-        self.refresh_cart_table()
-        self.qty_spin.setValue(1)
-        self.status_lbl.setText(f"Added {qty} × {name} to cart")
-
-    def refresh_cart_table(self):
-        self.cart_table.setRowCount(0)
-        for row, item in enumerate(self.cart):
-            self.cart_table.insertRow(row)
-            self.cart_table.setItem(row, 0, QTableWidgetItem(item["name"]))
-            self.cart_table.setItem(row, 1, QTableWidgetItem(f"₱{item['price']:.2f}"))
-            self.cart_table.setItem(row, 2, QTableWidgetItem(str(item["qty"])))
-            self.cart_table.setItem(row, 3, QTableWidgetItem(f"₱{item['total']:.2f}"))
-
-            reduce_btn = QPushButton("-1")
-            reduce_btn.setFixedSize(60, 30)
-            reduce_btn.setStyleSheet(
-                "QPushButton{background:#ff9f1c;color:#000;border:none;border-radius:4px;font-size:12px;font-weight:bold;}QPushButton:hover{background:#ffb627;}")
-            reduce_btn.clicked.connect(lambda _, r=row: self.reduce_quantity(r))
-            self.cart_table.setCellWidget(row, 4, reduce_btn)
-
-            del_btn = QPushButton("✖")
-            del_btn.setFixedSize(60, 30)
-            del_btn.setStyleSheet(
-                "QPushButton{background:#e63946;color:#fff;border:none;border-radius:4px;font-weight:bold;}QPushButton:hover{background:#f77f00;}")
-            del_btn.clicked.connect(lambda _, r=row: self.remove_row(r))
-            self.cart_table.setCellWidget(row, 5, del_btn)
-
-        self.update_total()
+        if self.cart.add(id, name, price, qty):
+            self.status_lbl.setText(f"Added {qty} × {name} to cart")
+        else:
+            self.status_lbl.setText(f"Updated {name} in cart")
+        return None
 
     def reduce_quantity(self, row):
         if 0 <= row < len(self.cart):
-            item = self.cart[row]
-            if item["qty"] > 1:
-                # Reduce quantity by 1
-                item["qty"] -= 1
-                item["total"] = round(item["price"] * item["qty"], 2)
-                self.status_lbl.setText(f"Reduced {item['name']} quantity to {item['qty']}")
+            item_name = self.cart.line(row)["name"]
+            qty = self.cart.reduce(row)
+            if qty > 0:
+                self.status_lbl.setText(f"Reduced {item_name} quantity to {qty}")
             else:
-                # Remove item if quantity becomes 0
-                item_name = item["name"]
-                del self.cart[row]
                 self.status_lbl.setText(f"Removed {item_name} from cart")
 
-            self.refresh_cart_table()
-
     def remove_row(self, row):
         if 0 <= row < len(self.cart):
-            item_name = self.cart[row]["name"]
-            del self.cart[row]
-            self.refresh_cart_table()
+            item_name = self.cart.remove(row)["name"]
             self.status_lbl.setText(f"Removed {item_name} from cart")
 
     def clear_cart(self):
         self.cart.clear()
-        self.refresh_cart_table()
         self.status_lbl.setText("Cart cleared")
 
     def update_total(self):
-        total = sum(item["total"] for item in self.cart)
-        self.total_lbl.setText(f"₱ {total:,.2f}")
+        self.total_lbl.setText(f"₱ {self.cart.total:,.2f}")
 
     def checkout(self):
         if not self.cart:
             QMessageBox.warning(self, "Cart", "Cart is empty.")
             return
 
-        try:
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    for item in self.cart:
-                        cur.execute("SELECT stock FROM items WHERE id = %s", (item["id"],))
-                        result = cur.fetchone()
-                        if not result or result[0] < item["qty"]:
-                            raise RuntimeError(
-                                f"Not enough stock for '{item['name']}'. Available: {result[0] if result else 0}"
-                            )
-        except RuntimeError as e:
-            QMessageBox.warning(self, "Stock", str(e))
+        cart = self.cart.lines()
+        self._set_checkout_enabled(False)
+        if self.writer and not self.journal.offline and self.writer.full():
+            # backpressure: take no more payments until the writer catches up
+            self._waiting_for_writer = True
+            self.status_lbl.setText(f"Saving earlier sales – {self.writer.backlog()} waiting...")
             return
-        except Exception as e:
-            QMessageBox.critical(self, "Database error", f"Stock check failed:\n{e}")
+        if self.journal.offline:
+            # the cart was already limited to the stock in the last catalog snapshot
+            self._on_stock_checked(cart, [])
+            return
+        self.status_lbl.setText("Checking stock...")
+        self.db.submit("stock_check", check_stock, cart,
+                       on_result=lambda shortages: self._on_stock_checked(cart, shortages),
+                       on_error=lambda e: self._on_stock_check_failed(cart, e))
+
+    def _on_stock_check_failed(self, cart, e):
+        if is_connection_error(e):
+            self.journal.offline = True
+            self._on_stock_checked(cart, [])
+            return
+        self._set_checkout_enabled(True)
+        self.status_lbl.setText("Ready")
+        QMessageBox.critical(self, "Database error", f"Stock check failed:\n{e}")
+
+    def _on_stock_checked(self, cart, shortages):
+        if shortages:
+            self._show_shortage(OutOfStockError(shortages))
             return
 
-        total = sum(item["total"] for item in self.cart)
+        total = sum(item["total"] for item in cart)
         dlg = PaymentDialog(total, parent=self)
         if dlg.exec() != QDialog.DialogCode.Accepted:
+            self._set_checkout_enabled(True)
+            self.status_lbl.setText("Ready")
             return
 
         payment_method = dlg.method()
@@ -2556,42 +5659,170 @@ class CashierWindow(QMainWindow):
         cash_received = dlg.get_cash_amount() if payment_method == "Cash" else 0.0
 
         if payment_method == "Cash" and cash_received < final_total:
+            self._set_checkout_enabled(True)
+            self.status_lbl.setText("Ready")
             QMessageBox.warning(
                 self, "Payment error",
                 f"Cash received (₱{cash_received:,.2f}) is less than total amount (₱{final_total:,.2f})"
             )
             return
 
-        try:
-            items_json = json.dumps(self.cart, default=str)  # Convert Decimal to string
-            timestamp = datetime.datetime.now().replace(microsecond=0)
+        sale = self.journal.append(self.username, cart, payment_method, total, final_total, discount_applied)
+        if self.journal.offline:
+            self._on_sale_saved(cart, offline=True)
+            return
+        if self.writer:
+            self.writer.put(sale)
+            self._on_sale_saved(cart, behind=True)
+            return
+        self.status_lbl.setText("Saving sale...")
+        self.db.submit("save_sale", push_sale, sale, on_result=lambda _: self._on_sale_saved(cart),
+                       on_error=lambda e: self._on_sale_failed(sale, e))
+
+    def _show_shortage(self, e):
+        self._set_checkout_enabled(True)
+        self.status_lbl.setText("Ready")
+        QMessageBox.warning(self, "Stock", str(e))
+
+    def _on_sale_failed(self, sale, e):
+        if is_connection_error(e) or isinstance(e, AggregatorError):
+            # the sale may or may not have been written: it stays journaled and the
+            # replicator sends it again, where its client_txn_id stops a double count
+            self.journal.queue(sale["client_txn_id"])
+            self.journal.offline = True
+            self._on_sale_saved(sale["cart"], offline=True)
+            return
+        self.journal.remove([sale["client_txn_id"]])
+        if isinstance(e, OutOfStockError):
+            # another lane sold the stock while the payment dialog was open; nothing was written
+            self._show_shortage(e)
+            self._load_items()
+            return
+        # the server refused the sale; keep the cart so it can be tried again
+        self._set_checkout_enabled(True)
+        self.status_lbl.setText("Ready")
+        QMessageBox.critical(self, "Database error", f"Failed to save sale: {str(e)}")
+
+    def _on_sale_saved(self, sold=(), offline=False, behind=False):
+        self._set_checkout_enabled(True)
+        # items scanned for the next customer while the sale was saving stay in the cart
+        self.cart.take(sold)
+        # apply our own deduction right away; the refresh then brings in other lanes' changes
+        for item_id, qty in cart_quantities(sold):
+            if offline or behind:
+                self._unsynced[item_id] = self._unsynced.get(item_id, 0) + qty
+            name = self._item_name_by_id.get(item_id)
+            if name is not None:
+                id, price, stock = self.item_map[name]
+                self._put_item((id, name, price, stock - qty))
+        if offline:
+            self.status_lbl.setText(f"Saved offline – {self.journal.count()} sale(s) waiting to sync")
+            return
+        if behind:
+            self.status_lbl.setText("Sale completed – saving in the background")
+            return
+        self._load_items()
+        self.status_lbl.setText("Sale completed successfully!")
 
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    # Insert sale record
-                    cur.execute("""
-                        INSERT INTO sales (cashier, sale_time, payment_method, total_amount, items_json, discount_applied)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                    """, (self.username, timestamp, payment_method, final_total, items_json, discount_applied))
-
-                    # Update stock levels
-                    for item in self.cart:
-                        cur.execute("UPDATE items SET stock = stock - %s WHERE id = %s",
-                                    (item["qty"], item["id"]))
-        except Exception as e:
-            QMessageBox.critical(self, "Database error", f"Failed to save sale: {str(e)}")
+    def _on_sales_written(self, sales):
+        if sales:
+            self._written.append(cart_quantities(line for sale in sales for line in sale["cart"]))
+            self._load_items()
+        self._resume_checkout()
 
-        self.cart.clear()
-        self.refresh_cart_table()
+    def _on_sales_short(self, short):
+        # held sales are not counted as sold any more; the server's stock is what is left
+        self._written.append(cart_quantities(line for sale, _ in short for line in sale["cart"]))
         self._load_items()
-        self._fill_item_combo()
-        self.status_lbl.setText("Sale completed successfully!")
+        details = "\n".join(str(e) for _, e in short)
+        QMessageBox.warning(self, "Stock",
+                            f"{len(short)} paid sale(s) could not be recorded because another lane sold "
+                            f"the stock first:\n{details}\n\nThey are kept on this lane and recorded "
+                            "automatically once the stock covers them. Please recount these items and "
+                            "correct their stock in the inventory.")
+
+    def _on_sales_write_failed(self, sales, e):
+        if not is_connection_error(e):
+            print(f"Error saving {len(sales)} sale(s), kept in the journal: {e}")
+        self.status_lbl.setText(f"Saved offline – {self.journal.count()} sale(s) waiting to sync")
+        self._resume_checkout()
+
+    def _resume_checkout(self):
+        if self._waiting_for_writer and (self.journal.offline or not self.writer.full()):
+            self._waiting_for_writer = False
+            self._set_checkout_enabled(True)
+            self.status_lbl.setText("Ready")
+
+    def _on_catalog_changed(self, _version):
+        self._load_items()
+
+    def _on_journal_synced(self, result):
+        pushed, queued, self._unsynced = result
+        if self.writer:
+            unwritten = list(self.writer.pending_quantities().items())
+            for item_id, qty in unwritten + [line for sold in self._written for line in sold]:
+                self._unsynced[item_id] = self._unsynced.get(item_id, 0) + qty
+        if pushed:
+            self.status_lbl.setText("Back online – offline sales synced" if not queued
+                                    else f"Syncing – {queued} sale(s) still waiting")
+            self._load_items()
+
+    def _less_unsynced(self, item):
+        """A catalog row with the units sold offline taken off its stock."""
+        id, name, price, stock = item
+        return id, name, price, stock - self._unsynced.get(id, 0)
+
+    def _wait_for_writer(self):
+        """Give queued sales up to WRITE_BEHIND_FLUSH_TIMEOUT to be written, keeping the window responsive."""
+        loop = QEventLoop()
+        self.writer.drained.connect(loop.quit)
+        if self.writer.backlog():
+            self.status_lbl.setText(f"Saving {self.writer.backlog()} sale(s)...")
+            self.centralWidget().setEnabled(False)
+            timer = QTimer(self)
+            timer.setSingleShot(True)
+            timer.timeout.connect(loop.quit)
+            timer.start(int(WRITE_BEHIND_FLUSH_TIMEOUT * 1000))
+            loop.exec()
+            timer.stop()
+            timer.deleteLater()
+            self.centralWidget().setEnabled(True)
+        self.writer.drained.disconnect(loop.quit)
+        if self.writer.backlog():
+            QMessageBox.warning(self, "Saving sales", f"{self.writer.backlog()} sale(s) are still being saved. "
+                                "They are kept on this lane and sent as soon as the database responds.")
+
+    def _set_checkout_enabled(self, enabled):
+        self.checkout_btn.setEnabled(enabled)
+        self.clear_btn.setEnabled(enabled)
 
     def logout(self):
+        self._detach()
         if self.logout_callback:
             self.logout_callback()
         self.close()
 
+    def closeEvent(self, event):
+        self._detach()
+        super().closeEvent(event)
+
+    def _detach(self):
+        """Let queued sales be written, then stop listening to the writer, feed and replicator.
+
+        They all outlive this window, which is left on logout or closed directly.
+        """
+        if self._detached:
+            return
+        self._detached = True
+        if self.writer:
+            self._wait_for_writer()
+            self.writer.saved.disconnect(self._on_sales_written)
+            self.writer.short.disconnect(self._on_sales_short)
+            self.writer.failed.disconnect(self._on_sales_write_failed)
+        change_feed().catalog_changed.disconnect(self._on_catalog_changed)
+        journal_replicator().synced.disconnect(self._on_journal_synced)
+
+
 class PaymentDialog(QDialog):
     def __init__(self, total_amount, parent=None):
         super().__init__(parent)
@@ -2608,7 +5839,7 @@ class PaymentDialog(QDialog):
         self.total_lbl.setAlignment(Qt.AlignmentFlag.AlignCenter)
         v.addWidget(self.total_lbl)
 
-        self.discount_chk = QPushButton("Senior/PWD 20% OFF")
+        self.discount_chk = QPushButton(f"Senior/PWD {1 - SENIOR_DISCOUNT_FACTOR:.0%} OFF")
         self.discount_chk.setCheckable(True)
         self.discount_chk.setStyleSheet("""
             QPushButton{
@@ -2750,7 +5981,7 @@ class PaymentDialog(QDialog):
 
         if self.discount_chk.isChecked():
             discount_amount = self.total * Decimal('0.2')
-            self.discounted_lbl.setText(f"After 20% discount: ₱ {(final):,.2f} (Save: ₱ {discount_amount:,.2f})")
+            self.discounted_lbl.setText(f"After {1 - SENIOR_DISCOUNT_FACTOR:.0%} discount: ₱ {(final):,.2f} (Save: ₱ {discount_amount:,.2f})")
             self.discounted_lbl.show()
         else:
             self.discounted_lbl.hide()
@@ -2769,7 +6000,7 @@ class PaymentDialog(QDialog):
 
     def final_total(self):
         if self.discount_chk.isChecked():
-            return round(self.total * Decimal('0.8'), 2)
+            return round(self.total * SENIOR_DISCOUNT_FACTOR, 2)
         return self.total
 
     def method(self):
@@ -2864,7 +6095,14 @@ class CashierApp(QApplication):
     def __init__(self, argv):
         super().__init__(argv)
         self._win = None
+        self.aboutToQuit.connect(POOL.close)
+        try:
+            POOL.warm()
+        except Exception as e:
+            print(f"❌ Could not open database connections: {e}")
         self._ensure_tables_exist()
+        if os.path.exists(JOURNAL_PATH):
+            journal_replicator()  # sales an earlier session left queued sync whoever logs in
         self._show_login()
 
     def _show_login(self):
@@ -2900,25 +6138,9 @@ class CashierApp(QApplication):
 
     def _ensure_tables_exist(self):
         try:
+            run_migrations()
             with get_connection() as conn:
                 with conn.cursor() as cur:
-                    cur.execute("""
-                        CREATE TABLE IF NOT EXISTS users (
-                            id INT AUTO_INCREMENT PRIMARY KEY,
-                            username VARCHAR(50) UNIQUE NOT NULL,
-                            password VARCHAR(64) NOT NULL,
-                            role ENUM('cashier', 'admin') NOT NULL,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        )
-                    """)
-                    cur.execute("""
-                        CREATE TABLE IF NOT EXISTS managers (
-                            id INT AUTO_INCREMENT PRIMARY KEY,
-                            username VARCHAR(50) UNIQUE NOT NULL,
-                            password VARCHAR(64) NOT NULL,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        )
-                    """)
                     cur.execute("SELECT COUNT(*) FROM users")
                     user_count = cur.fetchone()[0]
                     if user_count == 0:
@@ -2935,7 +6157,198 @@ class CashierApp(QApplication):
             print(f"❌ Error ensuring tables exist: {e}")
 
 
+def _cmd_check_plans():
+    problems = check_query_plans()
+    for problem in problems:
+        print(f"❌ {problem}")
+    if not problems:
+        print("✅ All hot sales queries are index-backed")
+    return 1 if problems else 0
+
+
+def _cmd_migrate():
+    applied = run_migrations()
+    print(f"✅ Schema at version {LATEST_SCHEMA_VERSION} ({len(applied)} migration(s) applied)")
+    return 0
+
+
+def _cmd_rebuild_rollup(start_day=None):
+    start = datetime.date.fromisoformat(start_day) if start_day else None
+    days = rebuild_sales_rollup(start)
+    print(f"✅ Rebuilt sales_daily_rollup ({days} rows)")
+    return 0
+
+
+def _cmd_backfill_sale_items(chunk_size="1000"):
+    copied = backfill_sale_items(int(chunk_size))
+    print(f"✅ Copied {copied} sale lines into sale_items")
+    return 0
+
+
+def _cmd_bench_search(count="100000"):
+    rng = random.Random(12)
+    syllables = ["ka", "lo", "mi", "ran", "to", "su", "pe", "ni", "gar", "del", "vo", "shi", "mar", "ten", "bu"]
+    brands = ["".join(rng.sample(syllables, 3)).capitalize() for _ in range(1500)]
+    products = ["banana chips", "apple juice", "fresh milk", "wheat bread", "jasmine rice", "brown sugar",
+                "instant coffee", "bath soap", "sardines in tomato sauce", "beef noodles", "cheddar cheese",
+                "salted butter", "corned beef", "tuna flakes", "soy sauce", "cane vinegar", "orange juice",
+                "laundry powder", "dish liquid", "toothpaste"]
+    products += ["".join(rng.sample(syllables, 2)) + " " + "".join(rng.sample(syllables, 2)) for _ in range(400)]
+    index = CatalogSearchIndex()
+    started = time.perf_counter()
+    index.rebuild((n, f"{rng.choice(brands)} {rng.choice(products)} {rng.randint(1, 40) * 25}g")
+                  for n in range(int(count)))
+    print(f"Indexed {len(index):,} names in {time.perf_counter() - started:.2f}s")
+    for query in ("b", "ba", "ban", "banana", "milk 25", "bannana", "cofee", "sardnes", "xyzzy"):
+        runs = []
+        for _ in range(50):
+            started = time.perf_counter()
+            results = index.search(query)
+            runs.append(time.perf_counter() - started)
+        runs.sort()
+        top = results[0][1] if results else "-"
+        print(f"{query!r:>15}: median {runs[len(runs) // 2] * 1000:.3f} ms, max {runs[-1] * 1000:.3f} ms, "
+              f"{len(results)} results, top {top!r}")
+    return 0
+
+
+def _cmd_bench_scan(count="30000", scans="500"):
+    """Feed synthetic scanner bursts to a cashier lane and time last key to cart line."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    rng = random.Random(13)
+    count, scans = int(count), int(scans)
+    CATALOG._apply([(n, f"Item {n:06d}", Decimal("9.75"), 10 ** 6, f"48{n:011d}", 1) for n in range(1, count + 1)],
+                   None, 1)
+    window = CashierWindow("bench", None)
+    window._sync_items()
+    # shown, so each scan's time includes repainting the cart table
+    window.show()
+    app.processEvents()
+    edit = window.combo.lineEdit()
+    codes = [f"48{rng.randint(1, count):011d}" for _ in range(200)]
+    latencies = []
+    for n in range(scans):
+        code = rng.choice(codes)
+        for ch in code:
+            QApplication.sendEvent(edit, QKeyEvent(QEvent.Type.KeyPress, Qt.Key.Key_0 + int(ch),
+                                                   Qt.KeyboardModifier.NoModifier, ch))
+        started = time.perf_counter()
+        QApplication.sendEvent(edit, QKeyEvent(QEvent.Type.KeyPress, Qt.Key.Key_Return, Qt.KeyboardModifier.NoModifier))
+        app.processEvents()
+        latencies.append((time.perf_counter() - started) * 1000)
+    added = sum(line["qty"] for line in window.cart.lines())
+    latencies.sort()
+    p50, p99 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+    print(f"{scans} scans over {len(window.cart)} cart lines ({count:,} SKUs): "
+          f"p50 {p50:.2f} ms, p99 {p99:.2f} ms, max {latencies[-1]:.2f} ms, {added} units added")
+    ok = added == scans and p99 <= SCAN_LATENCY_BUDGET_MS
+    print(f"{'✅' if ok else '❌'} budget {SCAN_LATENCY_BUDGET_MS} ms")
+    window.close()
+    return 0 if ok else 1
+
+
+class _FirstPaint(QObject):
+    """Stamps the first paint event a widget receives."""
+
+    def __init__(self, widget):
+        super().__init__(widget)
+        self.at = None
+        widget.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Paint and self.at is None:
+            self.at = time.perf_counter()
+        return False
+
+
+def _cmd_bench_startup(runs="5"):
+    """Time from building the admin window to its first painted frame and to its landing page."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    frames, landings = [], []
+    for n in range(int(runs)):
+        started = time.perf_counter()
+        window = AdminWindow("bench", None)
+        built = time.perf_counter()
+        first_paint = _FirstPaint(window)
+        window.show()
+        landed = None
+        while first_paint.at is None or landed is None:
+            app.processEvents(QEventLoop.ProcessEventsFlag.WaitForMoreEvents)
+            if landed is None and window.pages[0] is not None:
+                landed = time.perf_counter()
+        landings.append((landed - started) * 1000)
+        frames.append((first_paint.at - started) * 1000)
+        print(f"run {n + 1}: constructor {(built - started) * 1000:.1f} ms, "
+              f"first frame {frames[-1]:.1f} ms, dashboard built {landings[-1]:.1f} ms")
+        window.close()
+        window.deleteLater()
+        app.processEvents()
+    frames.sort()
+    landings.sort()
+    print(f"median first frame {frames[len(frames) // 2]:.1f} ms, "
+          f"dashboard built {landings[len(landings) // 2]:.1f} ms; "
+          f"matplotlib {'loaded' if 'matplotlib' in sys.modules else 'not loaded'}")
+    return 0
+
+
+def _cmd_aggregator(address=None):
+    # lanes run on the same machine; there is no authentication, so listen on loopback unless told otherwise
+    aggregator = SalesAggregator(address)
+    print(f"Aggregating lane sales on {aggregator.address}")
+    try:
+        aggregator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _cmd_aggregator_stats(address=None):
+    stats = aggregator_request({"op": "stats"}, address)
+    print(f"backlog {stats['backlog_sales']} sales in {stats['backlog_batches']} batches; "
+          f"committed {stats['sales']} sales in {stats['batches']} batches over {stats['group_commits']} commits, "
+          f"{stats['duplicates']} duplicates, {stats['failed_batches']} failed batches")
+    return 0
+
+
+def _cmd_simulate_lanes(lanes="12", batches="50", batch_size="5", address=None):
+    problems = simulate_lanes(int(lanes), int(batches), int(batch_size), address)
+    for problem in problems:
+        print(f"❌ {problem}")
+    if not problems:
+        print("✅ Every shipped sale recorded once, stock matches")
+    return 1 if problems else 0
+
+
+def _cmd_stress_stock(lanes="8", checkouts="200", stock="500"):
+    problems = stress_stock(int(lanes), int(checkouts), int(stock))
+    for problem in problems:
+        print(f"❌ {problem}")
+    if not problems:
+        print("✅ No oversell: stock matches what was sold")
+    return 1 if problems else 0
+
+
+CLI_COMMANDS = {
+    "--migrate": _cmd_migrate,
+    "--check-plans": _cmd_check_plans,
+    "--rebuild-rollup": _cmd_rebuild_rollup,
+    "--backfill-sale-items": _cmd_backfill_sale_items,
+    "--stress-stock": _cmd_stress_stock,
+    "--bench-search": _cmd_bench_search,
+    "--bench-scan": _cmd_bench_scan,
+    "--bench-startup": _cmd_bench_startup,
+    "--aggregator": _cmd_aggregator,
+    "--aggregator-stats": _cmd_aggregator_stats,
+    "--simulate-lanes": _cmd_simulate_lanes,
+}
+
+
 if __name__ == "__main__":
+    command = CLI_COMMANDS.get(sys.argv[1]) if len(sys.argv) > 1 else None
+    if command:
+        sys.exit(command(*sys.argv[2:]))
     app = CashierApp(sys.argv)
     app.setStyleSheet("QWidget { background-color: #d3d3d3; }")
     sys.exit(app.exec())
\ No newline at end of file
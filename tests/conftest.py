@@ -0,0 +1,6 @@
+import os
+import sys
+
+# cashier imports PyQt6 widgets; nothing here opens a window or a database connection
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,195 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+
+import cashier
+from cashier import (
+    CartModel, HighWaterMark, KPISnapshot, LiveKpi, OfflineJournal, OutOfStockError,
+    build_refund_claim_query, build_stock_deduct_query, build_stock_restore_query, kpi_with_sales,
+    sale_item_rows,
+)
+
+TODAY = datetime.date(2024, 5, 10)
+NOON = datetime.datetime(2024, 5, 10, 12, 0)
+
+
+# ----------  Query builders  ----------
+def test_stock_deduct_query_is_one_guarded_update():
+    sql, params = build_stock_deduct_query([(1, 2), (5, 1)])
+    assert sql.count("UPDATE") == 1
+    assert sql.count("SELECT %s AS id, %s AS qty") == 2
+    assert "WHERE i.stock >= w.qty" in sql
+    assert params == [1, 2, 5, 1]
+
+
+def test_stock_deduct_query_unguarded_may_go_negative():
+    sql, _ = build_stock_deduct_query([(1, 2)], guarded=False)
+    assert "WHERE" not in sql
+
+
+def test_refund_claim_query_caps_at_sold_qty():
+    sql, params = build_refund_claim_query(42, [(1, 2), (3, 1)])
+    assert "si.refunded_qty + r.qty <= si.qty" in sql
+    assert sql.count("SELECT %s AS id, %s AS qty") == 2
+    assert params == [1, 2, 3, 1, 42]
+
+
+def test_stock_restore_query_stamps_version():
+    sql, params = build_stock_restore_query([(7, 4)], 99)
+    assert "i.stock = i.stock + r.qty" in sql
+    assert "i.catalog_version = %s" in sql
+    assert params == [7, 4, 99]
+
+
+def test_sale_item_rows_fold_repeated_items():
+    rows = sale_item_rows(9, [
+        {"id": 1, "price": Decimal("2.50"), "qty": 1},
+        {"id": 2, "price": Decimal("3"), "qty": 2, "total": Decimal("6")},
+        {"id": 1, "price": Decimal("2.50"), "qty": 3},
+    ])
+    assert rows == [(9, 1, 4, Decimal("2.50"), Decimal("10.00")), (9, 2, 2, Decimal("3"), Decimal("6"))]
+
+
+# ----------  KPI  ----------
+def _sale(sale_id, total, cashier_name="ann", method="Cash", when=NOON):
+    return (cashier_name, when, sale_id, Decimal(total), method)
+
+
+def test_kpi_with_sales_moves_every_running_total():
+    kpi = KPISnapshot(day=TODAY, daily=10.0, weekly=20.0, month=30.0, year=40.0)
+    totals = {"bob": 10.0}
+    kpi = kpi_with_sales(kpi, [_sale(1, "5"), _sale(2, "7", "bob", "Card")], totals)
+    assert (kpi.daily, kpi.weekly, kpi.month, kpi.year) == (22.0, 32.0, 42.0, 52.0)
+    assert (kpi.cash_today, kpi.card_today) == (5.0, 7.0)
+    assert totals == {"ann": 5.0, "bob": 17.0}
+    assert (kpi.top_cashier, kpi.top_cashier_total) == ("bob", 17.0)
+
+
+def test_kpi_with_sales_rejects_another_day():
+    kpi = KPISnapshot(day=TODAY)
+    assert kpi_with_sales(kpi, [_sale(1, "5", when=NOON + datetime.timedelta(days=1))], {}) is None
+
+
+def test_live_kpi_counts_each_sale_once():
+    live = LiveKpi()
+    live.reset((KPISnapshot(day=TODAY, daily=100.0), {"ann": 100.0}, 10))
+    assert live.add_sales([_sale(10, "50"), _sale(11, "5")])  # 10 is already in the snapshot
+    assert live.add_sales([_sale(11, "5"), _sale(12, "1")])
+    assert live.kpi.daily == 106.0
+    assert live.cashier_totals == {"ann": 106.0}
+
+
+def test_live_kpi_copies_snapshot_totals():
+    shared = {"ann": 1.0}
+    first, second = LiveKpi(), LiveKpi()
+    first.reset((KPISnapshot(day=TODAY), shared, 0))
+    second.reset((KPISnapshot(day=TODAY), shared, 0))
+    first.add_sales([_sale(1, "2")])
+    second.add_sales([_sale(1, "2")])
+    assert shared == {"ann": 1.0}
+    assert second.cashier_totals == {"ann": 3.0}
+
+
+def test_live_kpi_waits_for_first_snapshot_and_day_rollover():
+    live = LiveKpi()
+    assert live.add_sales([_sale(1, "5")])
+    assert live.kpi.daily == 0.0
+    live.reset((KPISnapshot(day=TODAY), {}, 0))
+    assert not live.add_sales([_sale(2, "5", when=NOON + datetime.timedelta(days=1))])
+
+
+# ----------  Change feed marks  ----------
+def test_high_water_mark_records_and_fills_holes():
+    marks = HighWaterMark(10)
+    marks.advance([11, 14])
+    assert marks.mark == 14
+    assert sorted(marks.holes) == [12, 13]
+    marks.advance([12])
+    assert marks.mark == 14
+    assert sorted(marks.holes) == [13]
+
+
+def test_high_water_mark_copy_is_independent():
+    marks = HighWaterMark(5)
+    marks.advance([7])
+    copy = marks.copy()
+    copy.advance([6, 9])
+    assert (marks.mark, sorted(marks.holes)) == (7, [6])
+    assert (copy.mark, sorted(copy.holes)) == (9, [8])
+
+
+def test_high_water_mark_expires_old_holes(monkeypatch):
+    marks = HighWaterMark(0)
+    marks.advance([3])
+    monkeypatch.setattr(cashier, "CHANGE_FEED_HOLE_TTL", 0.0)
+    marks.advance([4])
+    assert marks.holes == {}
+    assert marks.mark == 4
+
+
+# ----------  Offline journal  ----------
+def _append(journal, item_id=1):
+    return journal.append("ann", [{"id": item_id, "price": Decimal("2"), "qty": 1}], "Cash",
+                          Decimal("2"), Decimal("2"), False)
+
+
+def test_journal_round_trips_a_sale(tmp_path):
+    journal = OfflineJournal(str(tmp_path / "journal.db"))
+    journal.offline = True
+    sale = _append(journal)
+    (queued,) = journal.queued(10)
+    assert queued["client_txn_id"] == sale["client_txn_id"]
+    assert queued["sale_time"] == sale["sale_time"]
+    assert journal.count() == 1
+    journal.remove([sale["client_txn_id"]])
+    assert journal.count() == 0
+
+
+def test_journal_reopen_requeues_all_but_short(tmp_path):
+    path = str(tmp_path / "journal.db")
+    journal = OfflineJournal(path)
+    pushing, held, short = _append(journal, 1), _append(journal, 2), _append(journal, 3)
+    assert journal.count() == 0  # online sales are 'pushing', not queued
+    journal.hold(held["client_txn_id"])
+    journal.hold(short["client_txn_id"], state="short")
+
+    reopened = OfflineJournal(path)
+    assert {sale["client_txn_id"] for sale in reopened.queued(10)} == {pushing["client_txn_id"],
+                                                                        held["client_txn_id"]}
+    assert [sale["client_txn_id"] for sale in reopened.queued(10, state="short")] == [short["client_txn_id"]]
+    assert reopened.offline
+
+
+def test_short_sales_are_recorded_once_stock_covers_them(tmp_path, monkeypatch):
+    journal = OfflineJournal(str(tmp_path / "journal.db"))
+    sale = _append(journal)
+    journal.hold(sale["client_txn_id"], state="short")
+    stock = {"covered": False}
+    recorded = []
+
+    def checkout_sale(**kwargs):
+        if not stock["covered"]:
+            raise OutOfStockError([])
+        recorded.append(kwargs["client_txn_id"])
+
+    monkeypatch.setattr(cashier, "check_stock", lambda cart: [])
+    monkeypatch.setattr(cashier, "checkout_sale", checkout_sale)
+    assert cashier._record_short(journal) == 0
+    assert len(journal.queued(10, state="short")) == 1
+    stock["covered"] = True
+    assert cashier._record_short(journal) == 1
+    assert recorded == [sale["client_txn_id"]]
+    assert journal.queued(10, state="short") == []
+
+
+# ----------  Cart  ----------
+def test_cart_take_keeps_what_was_added_since():
+    cart = CartModel()
+    cart.add(1, "Milk", Decimal("2"), 3)
+    cart.add(2, "Bread", Decimal("1"), 1)
+    sold = [{"id": 1, "qty": 2}, {"id": 2, "qty": 1}]
+    cart.add(1, "Milk", Decimal("2"), 1)
+    cart.take(sold)
+    assert cart.qty_of(1) == 2
+    assert cart.qty_of(2) == 0